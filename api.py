@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import os
+import traceback
+
+from dotenv import load_dotenv
+from flask import Flask, Response, jsonify, request
+
+from engine import (BATCH_MENUS, SPREADSHEET_NAME, add_to_google_sheet, build_sheet_row, generate_positions,
+                    generate_positions_async, generate_questions, get_coverage_scheduler, get_formation_index,
+                    get_question_index, iter_batch_jobs, openai_retry_in, plan_batch_jobs, question_issue,
+                    question_matrix, render_png, validate_question)
+from formation import Formation
+from geometry import MIN_LAYOUT_SCORE, repair_positions
+from metrics import prometheus_text, span
+from presets import DEFAULT_POSITIONS, DIFFICULTIES, scenario_presets
+from resilience import CircuitOpenError, retryable_openai_errors
+from resources import get_job_store, run_async
+
+# JSON HTTP API of the engine, for services generating questions without the
+# Streamlit page. It keeps no state between requests: answers carry everything
+# the caller needs, and the jobs of long batches are kept in the job store, so
+# several worker processes sharing JOB_STORE_PATH can run behind a load balancer:
+#
+#   python api.py --port 8000
+#   gunicorn --workers 4 --threads 8 api:app
+#
+# Set API_TOKEN to require an "Authorization: Bearer <token>" header.
+#
+#   POST /v1/questions           {"situation", "scenario", "axe", "difficulty", "instruction"?}
+#   POST /v1/positions           {"question"}
+#   POST /v1/render              {"positions"} -> image/png
+#   POST /v1/validate            {"situation", "scenario", "axe", "generated_output", "generated_positions"?, "share"?}
+#   POST /v1/questions/batch     {"situations", "scenarios", "axes", "difficulties", "count"?, "per_request"?,
+#                                 "workers"?, "async"?}
+#   POST /v1/positions/batch     {"questions", "workers"?, "async"?}
+#   POST /v1/render/batch        {"positions", "async"?}
+#   GET  /v1/jobs/<id>
+
+# Items a batch request may hold; larger batches must run as jobs
+MAX_SYNC_BATCH = 50
+MAX_BATCH = 2000
+
+# Upper bounds of the batch options
+MAX_PER_REQUEST = 10
+MAX_WORKERS = 16
+
+# Jobs running at once in each worker process
+JOB_WORKERS = int(os.getenv("API_JOB_WORKERS", "2"))
+_job_executor = concurrent.futures.ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="api-job")
+
+
+class ApiError(Exception):
+    """
+    Error answered to the caller as {"error": message} with an HTTP status.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def body():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        raise ApiError("Expected a JSON object.")
+    return payload
+
+
+def field(payload, name, choices=None, default=None):
+    value = payload.get(name, default)
+    if value is None or value == "":
+        raise ApiError(f"Missing {name}.")
+    if choices is not None and value not in choices:
+        raise ApiError(f"Invalid {name} {value!r}, expected one of {list(choices)}.")
+    return value
+
+
+def items(payload, name):
+    values = payload.get(name)
+    if not isinstance(values, list) or not values:
+        raise ApiError(f"Expected a non-empty list of {name}.")
+    if len(values) > MAX_BATCH:
+        raise ApiError(f"At most {MAX_BATCH} {name} per batch.", 413)
+    return values
+
+
+def choices(payload, name, allowed, default=None):
+    """
+    Returns a non-empty list field whose values must all be in `allowed`.
+    """
+    values = items(payload, name) if default is None or name in payload else default
+    invalid = [value for value in values if value not in allowed]
+    if invalid:
+        raise ApiError(f"Invalid {name} {invalid}, expected some of {list(allowed)}.")
+    return values
+
+
+def number(payload, name, default, maximum):
+    """
+    Returns an integer field between 1 and `maximum`.
+    """
+    value = payload.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ApiError(f"Expected an integer {name}.")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(f"Expected an integer {name}, got {value!r}.")
+    if not 1 <= value <= maximum:
+        raise ApiError(f"{name} must be between 1 and {maximum}.")
+    return value
+
+
+def menu_choices(situations):
+    """
+    Returns the scenarios and axes that may be picked for any of `situations`, as on the page.
+    """
+    menus = [BATCH_MENUS[situation] for situation in situations]
+    scenarios = [name for scenario_menu, _ in menus for name, preset in scenario_menu.items() if preset is not None]
+    axes = [axe for _, axe_menu in menus for axe in axe_menu if axe != "Select Axe"]
+    return scenarios, axes
+
+
+def check_situation(payload):
+    # Only the menu values are accepted: they end up in prompts, the sheet and the coverage
+    situation = field(payload, "situation", list(BATCH_MENUS))
+    scenarios, axes = menu_choices([situation])
+    scenario = field(payload, "scenario", scenarios)
+    axe = field(payload, "axe", axes)
+    return situation, scenario, axe, field(payload, "difficulty", DIFFICULTIES, DIFFICULTIES[0])
+
+
+def positions_result(positions_data):
+    """
+    Repairs generated positions into the payload answered to the caller, or None if unusable.
+    """
+    formation, score, issues = repair_positions(positions_data)
+    if formation is None or score < MIN_LAYOUT_SCORE:
+        return None
+    return {"generated_positions": {"coordinates": formation.to_dict()}, "score": score, "issues": issues}
+
+
+def parse_formation(positions):
+    try:
+        return Formation.coerce(positions)
+    except (ValueError, AttributeError, TypeError) as e:
+        raise ApiError(f"Invalid positions: {e}")
+
+
+def run_batch(payload, kind, total, work):
+    """
+    Runs `work(progress)` now, or as a job if the request asks for it or is too
+    large to answer at once. `progress(done)` reports the items completed.
+    """
+    if not payload.get("async") and total <= MAX_SYNC_BATCH:
+        return jsonify(work(lambda done: None))
+    store = get_job_store()
+    job_id = store.create(kind, total)
+
+    def run():
+        try:
+            store.finish(job_id, work(lambda done: store.progress(job_id, done)))
+        except Exception as e:
+            traceback.print_exc()
+            store.fail(job_id, str(e))
+
+    _job_executor.submit(run)
+    response = jsonify({"id": job_id, "status": "running", "total": total})
+    response.status_code = 202
+    response.headers["Location"] = f"/v1/jobs/{job_id}"
+    return response
+
+
+def questions_work(jobs, workers):
+    def work(progress):
+        questions, errors = [], []
+        for result in iter_batch_jobs(jobs, workers):
+            (errors if "error" in result else questions).append(result)
+            progress(len(questions))
+        return {"questions": questions, "errors": errors}
+
+    return work
+
+
+def positions_work(questions, workers):
+    def work(progress):
+        semaphore = asyncio.Semaphore(workers)
+
+        async def generate(question):
+            async with semaphore:
+                return await generate_positions_async(f"Question: {question}")
+
+        futures = [run_async(generate(question)) for question in questions]
+        # Progress is stored and the layouts repaired from this thread rather than
+        # on the event loop shared by every request, which the SQLite writes would block
+        for done, _ in enumerate(concurrent.futures.as_completed(futures), start=1):
+            progress(done)
+        return {"positions": [positions_result(future.result()) for future in futures]}
+
+    return work
+
+
+def render_work(formations):
+    def work(progress):
+        images = []
+        for i, formation in enumerate(formations):
+            images.append(base64.b64encode(render_png(formation)).decode("ascii"))
+            progress(i + 1)
+        return {"images": images}
+
+    return work
+
+
+def create_app():
+    app = Flask(__name__)
+    token = os.getenv("API_TOKEN")
+
+    @app.before_request
+    def authenticate():
+        if token and request.path.startswith("/v1/") and request.headers.get("Authorization") != f"Bearer {token}":
+            raise ApiError("Invalid or missing API token.", 401)
+
+    @app.errorhandler(ApiError)
+    def api_error(e):
+        return jsonify({"error": str(e)}), e.status
+
+    @app.errorhandler(CircuitOpenError)
+    def circuit_open(e):
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(int(e.retry_in) + 1)}
+
+    for error in retryable_openai_errors():
+        # Rate limits and outages that outlasted the retries
+        app.register_error_handler(error, lambda e: (jsonify({"error": f"OpenAI API error: {e}"}), 503))
+
+    @app.get("/health")
+    def health():
+        return jsonify({"ok": True, "openai_retry_in": openai_retry_in()})
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+    @app.post("/v1/questions")
+    def question():
+        payload = body()
+        situation, scenario, axe, difficulty = check_situation(payload)
+        instruction = payload.get("instruction") or get_coverage_scheduler(SPREADSHEET_NAME).next_instruction(
+            situation, scenario, axe, difficulty)
+        with span("api_request", endpoint="questions"):
+            generated_output = generate_questions(situation, scenario, axe, instruction, difficulty,
+                                                  bool(payload.get("use_cache", False)))
+        if not generated_output:
+            raise ApiError("The model did not return a valid question.", 502)
+        return jsonify({"generated_output": generated_output, "instruction": instruction})
+
+    @app.post("/v1/positions")
+    def positions():
+        payload = body()
+        with span("api_request", endpoint="positions"):
+            result = positions_result(generate_positions(field(payload, "question"),
+                                                         bool(payload.get("use_cache", True))))
+        if result is None:
+            raise ApiError("The model did not return usable positions.", 502)
+        return jsonify(result)
+
+    @app.post("/v1/render")
+    def render():
+        formation = parse_formation(field(body(), "positions"))
+        with span("api_request", endpoint="render"):
+            image = render_png(formation)
+        return Response(image, mimetype="image/png", headers={"Cache-Control": "public, max-age=86400"})
+
+    @app.post("/v1/validate")
+    def validate():
+        """
+        Checks a question and its positions as the Validate button does, and adds
+        them to the bank with "share": true when they pass.
+        """
+        payload = body()
+        situation, scenario, axe, difficulty = check_situation(payload)
+        use_ai_positions = field(payload, "use_ai_positions", ("Yes", "No"), "Yes")
+        generated_output = field(payload, "generated_output")
+        issues = []
+        if not validate_question(generated_output):
+            issues.append("The question does not have a text and four answers scored 1 to 4.")
+        elif (issue := question_issue(generated_output)) is not None:
+            issues.append(issue)
+        elif (match := get_question_index(SPREADSHEET_NAME).find(generated_output["question"])[0]) is not None:
+            issues.append(f"The question duplicates one of the bank: {match}")
+        if use_ai_positions == "Yes":
+            formation, score, layout_issues = repair_positions(payload.get("generated_positions"))
+            if formation is None or score < MIN_LAYOUT_SCORE:
+                issues.append(f"The positions are not usable: {layout_issues}")
+        else:
+            formation = parse_formation(scenario_presets(situation).get(scenario) or DEFAULT_POSITIONS)
+        if issues or not payload.get("share"):
+            return jsonify({"valid": not issues, "issues": issues, "shared": False})
+
+        instruction = payload.get("instruction", "")
+        result = add_to_google_sheet(SPREADSHEET_NAME, build_sheet_row(
+            situation, scenario, axe, use_ai_positions, generated_output, formation, difficulty, instruction))
+        if not result.ok:
+            raise ApiError(f"Failed to share the question: {result.error}", 502)
+        get_question_index(SPREADSHEET_NAME).add(generated_output["question"])
+        get_coverage_scheduler(SPREADSHEET_NAME).add(situation, scenario, axe, difficulty, instruction)
+        if use_ai_positions == "Yes":
+            get_formation_index(SPREADSHEET_NAME).add(formation, situation, scenario, axe,
+                                                      generated_output["question"])
+        # A pending row is queued until the sheet accepts it, so the caller must not send it again
+        return jsonify({"valid": True, "issues": [], "shared": True, "pending": result.pending})
+
+    @app.post("/v1/questions/batch")
+    def questions_batch():
+        payload = body()
+        situations = choices(payload, "situations", list(BATCH_MENUS))
+        scenario_choices, axe_choices = menu_choices(situations)
+        scenarios = choices(payload, "scenarios", scenario_choices)
+        axes = choices(payload, "axes", axe_choices)
+        difficulties = choices(payload, "difficulties", DIFFICULTIES, DIFFICULTIES)
+        count = number(payload, "count", 1, MAX_BATCH)
+        per_request = number(payload, "per_request", 5, MAX_PER_REQUEST)
+        workers = number(payload, "workers", 4, MAX_WORKERS)
+        combinations = question_matrix(situations, scenarios, axes, difficulties)
+        if not combinations:
+            raise ApiError("No valid Situation, Scenario, Axe and Difficulty combination.")
+        # Checked before planning, so oversized batches cost nothing
+        if len(combinations) * count > MAX_BATCH:
+            raise ApiError(f"At most {MAX_BATCH} questions per batch.", 413)
+        jobs = plan_batch_jobs(combinations, count, per_request)
+        return run_batch(payload, "questions", len(combinations) * count, questions_work(jobs, workers))
+
+    @app.post("/v1/positions/batch")
+    def positions_batch():
+        payload = body()
+        questions = items(payload, "questions")
+        if not all(isinstance(question, str) and question.strip() for question in questions):
+            raise ApiError("Expected the questions as non-empty strings.")
+        return run_batch(payload, "positions", len(questions),
+                         positions_work(questions, number(payload, "workers", 4, MAX_WORKERS)))
+
+    @app.post("/v1/render/batch")
+    def render_batch():
+        payload = body()
+        formations = [parse_formation(positions) for positions in items(payload, "positions")]
+        return run_batch(payload, "render", len(formations), render_work(formations))
+
+    @app.get("/v1/jobs/<job_id>")
+    def job(job_id):
+        job = get_job_store().get(job_id)
+        if job is None:
+            raise ApiError("Unknown or expired job.", 404)
+        return jsonify(job)
+
+    return app
+
+
+load_dotenv()
+app = create_app()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Matchango quiz generation API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    # Development server; run several workers behind a WSGI server in production
+    app.run(args.host, args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,38 @@
 import streamlit as st
-import openai
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from dotenv import load_dotenv
-import re
+import contextlib
 import json
-import matplotlib.pyplot as plt
-from mplsoccer import Pitch
-from matplotlib.patches import Circle
 from io import BytesIO
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import random
 
-import json
-
-# Access GCP credentials from secrets
-gcp_credentials = json.loads(st.secrets["GCP_CREDENTIALS"])
-
-
-# Authenticate and connect to Google Sheets using in-memory credentials
-def connect_to_google_sheet(gcp_credentials, spreadsheet_name):
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    # Use in-memory credentials
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(gcp_credentials, scope)
-    client = gspread.authorize(creds)
-    sheet = client.open(spreadsheet_name).sheet1
-    return sheet
-
-
-# Example usage
-spreadsheet_name = "Matchango Quiz Bank of Questions"
-try:
-    sheet = connect_to_google_sheet(gcp_credentials, spreadsheet_name)
-except Exception as e:
-    st.error(f"Failed to connect to Google Sheets: {e}")
-
-
-# Function to add a new row to Google Sheets
-def add_to_google_sheet(sheet, values):
-    try:
-        # Append the row to the sheet
-        result = sheet.append_row(values)
-        print("Append Row Result:", result)  # Debugging
-        return True  # Indicate success
-    except Exception as e:
-        print("Error during append_row:", str(e))  # Log the error
-        return False, str(e)  # Return failure and the error message
-
-
-# Load service account credentials
-SPREADSHEET_NAME = "Matchango Quiz Bank of Questions"
+from engine import (FORMATION_MATCH_THRESHOLD, MAX_DUPLICATE_RETRIES, SPREADSHEET_NAME, add_to_google_sheet,
+                    build_sheet_row, generate_positions, generate_questions, get_coverage_scheduler,
+                    get_formation_index, get_question_index, get_question_pool, iter_batch_jobs, openai_retry_in,
+                    plan_batch_jobs, positions_agree, question_matrix, render_png, start_pipelined_generation,
+                    stream_questions, wait_for_sheet_writes)
+from formation import Formation
+from metrics import serve_from_env, snapshot, span
+from geometry import MIN_LAYOUT_SCORE, repair_positions
+from parsing import parse_stats
+from presets import (DEFAULT_POSITIONS, DIFFICULTIES, defensive_axes, defensive_scenarios, offensive_axes,
+                     offensive_scenarios, other_scenarios, scenario_presets)
+from question_index import QuestionIndex
+from rate_limiter import current_session
+from resilience import CircuitOpenError
+from resources import get_response_cache, get_sheet_writer
+
+# Thin Streamlit client of engine.py: everything below builds the page and calls
+# into the engine, which loads its heavy dependencies on first use.
 
 # Load environment variables from .env
 load_dotenv()
 
-# Access the API key
-api_key = st.secrets["OPENAI_API_KEY"]
+# Expose /metrics when METRICS_PORT is set
+serve_from_env()
 
-client = openai.OpenAI(
-    api_key=api_key,
-)
+# OpenAI calls of this browser session take turns with the other sessions for the rate limits
+if (script_run_ctx := get_script_run_ctx()) is not None:
+    current_session.set(script_run_ctx.session_id)
 
 # Title
 st.title("Matchango Questions Generator")
@@ -70,674 +44,413 @@ st.sidebar.header("Options")
 if "generated_output" not in st.session_state:
     st.session_state.generated_output = None
 
+# Dropdown menus for user inputs
+situation = st.sidebar.selectbox("Situation", ["Select Situation", "Offense", "Defense", "Other"])
 
-# Define the PlayerPositionPlotter class
-class PlayerPositionPlotter:
-    def __init__(self, pitch_length=120, pitch_width=80):
-        """
-        Initialize the PlayerPositionPlotter with pitch dimensions.
-        """
-        self.pitch_length = pitch_length
-        self.pitch_width = pitch_width
-        self.pitch = Pitch(pitch_length=self.pitch_length, pitch_width=self.pitch_width,
-                           line_color='white', pitch_color='#aabb97')
-
-    def plot_player_positions(self, player_data):
-        """
-        Plots the players' positions based on input data.
-        """
-        # st.write("Player Data to be Plotted:", player_data)  # DEBUG
-
-        fig, ax = self.pitch.draw(figsize=(10, 7))
-
-        team_players = player_data.get('team_players', [])
-        opponent_players = player_data.get('opponent_players', [])
-        ball_position = player_data.get('ball', None)
-        main_player = player_data.get('main_player', None)
-
-        self._plot_players(team_players, ax, color='#4CAF50', label='Team Player', main_player=main_player)
-        self._plot_players(opponent_players, ax, color='#FF5733', label='Opponent Player')
-
-        if ball_position:
-            self._plot_ball(ax, ball_position)
-
-        plt.title("Player and Ball Positions", fontsize=16, color='#34495e', weight='bold')
-        plt.tight_layout()
-        return fig
-
-    def _plot_players(self, players, ax, color, label, main_player=None):
-        """
-        Private method to plot multiple players on the pitch.
-
-        Args:
-        players (list): List of player dictionaries containing position information.
-        ax: The axis to plot the players on.
-        color (str): Color of the players for the respective team or opponent.
-        label (str): Label for the player type (team or opponent).
-        main_player (list): The position of the main player to highlight.
-        """
-        for player in players:
-            position = player.get('position')
-            is_main = (position == main_player) if main_player else False
-            self._plot_player(ax, position, color, is_main=is_main, label=label)
-
-    def _plot_player(self, ax, position, color, is_main=False, label=None):
-        """
-        Private method to plot a single player at a specific position.
-
-        Args:
-        ax: The axis to plot the player on.
-        position (list): The [x, y] position on the pitch.
-        color (str): Color of the player marker.
-        is_main (bool): Whether the player is the main player.
-        label (str): Player type (team or opponent).
-        """
-        marker_size = 300
-        edge_color = 'gold' if is_main else 'black'
-        ax.scatter(position[0], position[1], s=marker_size, color=color, edgecolor=edge_color, lw=2.5, label=label,
-                   zorder=3)
-
-    def _plot_ball(self, ax, position):
-        """
-        Private method to plot the ball on the pitch.
-
-        Args:
-        ax: The axis to plot the ball on.
-        position (list): The [x, y] position of the ball on the pitch.
-        """
-        # Plot the ball as a circle
-        ball = Circle((position[0], position[1]), radius=1, color='white', zorder=4)
-        ax.add_patch(ball)
-
-
-def flatten_positions(positions):
-    """
-    Converts player positions to a string representation suitable for Google Sheets.
-    """
-    return [json.dumps(player["position"]) for player in positions]
+if situation == "Offense":
+    scenario = st.sidebar.selectbox("Scenario", list(offensive_scenarios.keys()))
+    axe = st.sidebar.selectbox("Axe", offensive_axes)
+if situation == "Defense":
+    scenario = st.sidebar.selectbox("Scenario", list(defensive_scenarios.keys()))
+    axe = st.sidebar.selectbox("Axe", defensive_axes)
+if situation == "Other":
+    scenario = st.sidebar.selectbox("Scenario", other_scenarios)
+    axe = st.sidebar.selectbox("Axe", offensive_axes + defensive_axes)
+use_ai_positions = st.sidebar.selectbox("Use AI Positions", ["Yes", "No"])
+reuse_formations = st.sidebar.checkbox("Reuse matching formations", value=True,
+                                       disabled=use_ai_positions == "No",
+                                       help="Use the positions of a similar validated question instead of "
+                                            "generating new ones when a close match exists.")
+pipelined = st.sidebar.checkbox("Generate positions in parallel", value=False,
+                                disabled=use_ai_positions == "No",
+                                help="Generate the positions from the inputs while the question is being written.")
+reconcile = st.sidebar.checkbox("Reconcile positions with the question", value=True,
+                                disabled=use_ai_positions == "No" or not pipelined,
+                                help="Regenerate the positions from the question when they do not fit it.")
+difficulty = st.sidebar.selectbox("Difficulty", DIFFICULTIES)
+stream_question = st.sidebar.checkbox("Stream question", value=True,
+                                      disabled=use_ai_positions == "Yes" and pipelined,
+                                      help="Display the question and answers while they are being written.")
+reject_duplicates = st.sidebar.checkbox(
+    "Reject duplicate questions", value=True,
+    help="Generate another question when the new one is too close to a question already in the bank.")
+reuse_cached_questions = st.sidebar.checkbox(
+    "Reuse cached questions", value=False,
+    help="Return the stored answer for identical inputs instead of asking the model again (prompt development).")
+use_pregenerated = st.sidebar.checkbox(
+    "Serve pre-generated questions", value=True, disabled=reuse_cached_questions,
+    help="Answer instantly from questions generated in the background for the options you use most.")
+if use_pregenerated and not reuse_cached_questions:
+    # Options are only stocked once Generate was pressed for them, see `pregenerated_bundle`:
+    # merely browsing the sidebar must not start paid background generations
+    pool_stats = get_question_pool(SPREADSHEET_NAME).stats()
+    st.sidebar.caption(f"Pre-generated: {pool_stats['stocked']} ready, {pool_stats['hits']} served, "
+                       f"{pool_stats['misses']} misses")
+show_diagnostics = st.sidebar.checkbox("Show diagnostics", value=False,
+                                       help="Display stage timings, token counts and cache hit rates.")
+cache_stats = get_response_cache().stats()
+st.sidebar.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                   f"{cache_stats['entries']} entries")
+for prompt_name, counts in parse_stats().items():
+    st.sidebar.caption(f"Parse failures ({prompt_name}): {counts['failures']}/{counts['attempts']} "
+                       f"({counts['failure_rate']:.0%}), {counts['repaired']} repaired")
 
+if "generated_output" not in st.session_state:
+    st.session_state["generated_output"] = None
 
-def generate_text(prompt, model="gpt-4o"):
-    openai.api_key = api_key
+if "generated_positions" not in st.session_state:
+    st.session_state["generated_positions"] = None
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=1000,
-    )
+# Question specific instruction of the generated question, recorded with it in the sheet
+if "question_instruction" not in st.session_state:
+    st.session_state["question_instruction"] = ""
 
-    model_resp = response.choices[0].message.content.strip()
-    print(model_resp)
-    return model_resp
+if "generated_questions_history" not in st.session_state:
+    st.session_state["generated_questions_history"] = []
 
 
-def extract_json_from_generated(model_resp):
-    json_match = re.search(r'<JSON>(.*?)</JSON>', model_resp, re.DOTALL)
 
-    if json_match:
-        json_str = json_match.group(1).strip()
 
-        # Remove any comments like `//` using regex
-        json_str = re.sub(r'//.*', '', json_str)  # This removes any inline comments starting with //
+def render_question(generated_output):
+    """
+    Displays a generated question and its answers.
+    """
+    st.subheader("Generated Question:")
+    st.markdown(f"**{generated_output['question']}**")
 
-        try:
-            quiz_data = json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON: {e}")
-            return None
-    else:
-        print("No JSON data found between <JSON> tags.")
-        return None
-    return quiz_data
+    st.subheader("Answers:")
+    for i, answer in enumerate(generated_output["answers"], start=1):
+        st.write(f"**Option {i}:** {answer['text']}")
 
 
-random_instruction = random.choice([
-    "Focus on the player's decision-making process and how they should prioritize options in this scenario.",
-    "Emphasize the tactical implications of the scenario and how it impacts team dynamics.",
-    "Highlight the psychological aspects of the player's actions under pressure in this scenario.",
-    "Explore the technical skills required for a player to execute optimal actions in this situation.",
-    "Consider the game's context (e.g., time left, scoreline) and how it influences the player's choices.",
-    "Frame the question to reflect a high-stakes scenario, such as a critical moment in the match.",
-    "Incorporate elements of player positioning and spatial awareness in the decision-making process.",
-    "Focus on the interaction between teammates and how their positions affect the player's options.",
-    "Explore how the opponent's defensive setup creates challenges or opportunities for the player.",
-    "Use specific terminology related to the scenario (e.g., 'breaking the lines,' 'high press,' 'compact defense')."
-])
+def render_positions(positions_data):
+    """
+    Plots the positions of a parsed positions payload and displays the image.
+    """
+    # Visualize field positions
+    with st.spinner("Displaying player positions..."):
+        st.image(render_png(positions_data))
 
 
-def generate_questions(situation, scenario, axe, random_instruction, difficulty):
+def show_streamed_question(placeholder, events):
     """
-    Generates a soccer quiz question based on the provided inputs.
+    Displays a streamed question in `placeholder` as its fields arrive.
+
+    Falls back to a regular request if the stream was abandoned as malformed.
+
+    Returns:
+        dict: The parsed question, or None if generation failed.
+    """
+    question_text, answers = None, []
+    for field, value in events:
+        if field == "question":
+            question_text = value
+        elif field == "answer":
+            answers.append(value)
+        elif field == "done":
+            return value
+        elif field == "malformed":
+            placeholder.empty()
+            with st.spinner("Generating question..."):
+                return generate_questions(situation, scenario, axe, st.session_state["question_instruction"],
+                                          difficulty)
+
+        with placeholder.container():
+            st.subheader("Generated Question:")
+            st.markdown(f"**{question_text or '...'}**")
+            st.subheader("Answers:")
+            for i, answer in enumerate(answers, start=1):
+                st.write(f"**Option {i}:** {answer.get('text', '')}")
+    return None
+
+
+def checked_positions(generated_positions, regenerate):
+    """
+    Repairs generated positions locally and only asks the model again when the
+    layout is too broken to fix, falling back to the scenario preset if needed.
 
     Args:
-        situation (str): The game situation (e.g., "Offense", "Defense").
-        scenario (str): The specific scenario (e.g., "Attaque Positionnelle").
-        axe (str): The axis of evaluation (e.g., "Créativité").
+        generated_positions (dict): Parsed positions JSON, possibly None.
+        regenerate (callable): Returns a new positions payload from the model.
 
     Returns:
-        dict: Parsed JSON containing the generated question and answers.
+        dict: Usable positions with a "coordinates" key.
+    """
+    formation, score, issues = repair_positions(generated_positions)
+    if issues:
+        print(f"Layout score {score:.2f}, issues: {issues}")
+    if formation is None or score < MIN_LAYOUT_SCORE:
+        with st.spinner("Regenerating player positions..."):
+            formation, score, issues = repair_positions(regenerate())
+    if formation is None:
+        st.warning("Could not generate usable positions; showing the scenario's preset formation.")
+        return {"coordinates": scenario_presets(situation).get(scenario) or DEFAULT_POSITIONS["coordinates"]}
+    return {"coordinates": formation.to_dict()}
+
+
+def next_instruction():
     """
-    prompt = f"""You are a highly skilled soccer tactician and quiz author. Your task is to create a high quality 
-    question aimed at assessing a soccer player’s skills. The question should cover soccer tactics, rules, 
-    or specific game scenarios. Your question must be followed by four possible answers. Each answer should be 
-    evaluated on a scale from 1 to 4 based on its relevance to the situation, with 1 being the least optimal and 4 
-    being the most optimal.
-    The question has to assess the player based on the axis of evaluation.
-    The question doesn't have to explicitely announce the scenario, situation and axis.
-
-    Follow these guidelines:
-        
-    The question and answers must be written in French.
-    Each answer should be clearly associated with an evaluation score.
-    Format the final output in a JSON-like structure.
-    IMPERATIVE: JSON format must be wrapped with <JSON></JSON> tags, contain no extraneous 
-    characters, and be valid JSON. 
-    IMPERATIVE: Never use `//` comments.
-
-    Inputs:
-    - Situation: {situation}.
-    - Scenario: {scenario}.
-    - Axis of evaluation: {axe}.
-    - Question specific instruction: {random_instruction}
-    - Difficulty of the question: {difficulty}
-
-    JSON format:
-    <JSON>
-    {{
-      "question": "",
-      "answers": [
-        {{
-          "text": "",
-          "score": 4
-        }},
-        {{
-          "text": "",
-          "score": 3
-        }},
-        {{
-          "text": "",
-          "score": 2
-        }},
-        {{
-          "text": "",
-          "score": 1
-        }}
-      ]
-    }}
-    </JSON>
+    Returns the question specific instruction least covered in the bank for the
+    current options, and remembers it for the validation.
     """
-    # Generate and parse the response
-    question_raw = generate_text(prompt)
-    question_json = extract_json_from_generated(question_raw)
-    print(random_instruction)
-    return question_json
+    instruction = get_coverage_scheduler(SPREADSHEET_NAME).next_instruction(situation, scenario, axe, difficulty)
+    st.session_state["question_instruction"] = instruction
+    return instruction
 
 
-def generate_positions(question_context):
+def unique_question(generated_output):
     """
-    Generates player positions based on the provided question context.
+    Regenerates a question while it duplicates one already in the bank.
 
-    Args:
-        question_context (str): The context of the question (e.g., "How should players position themselves?").
+    Each retry takes the next instruction so the model is steered elsewhere.
 
     Returns:
-        dict: Parsed JSON containing the generated player positions.
+        dict: A question that is not in the bank, or None if none could be generated.
     """
-    prompt = f"""
-    You are an AI model tasked with generating player positions and coordinates for a 
-    soccer scenario based on a quiz generated by another agent. 
-
-    Question: {question_context}
-
-
-    Follow these steps carefully to ensure precision:
-
-    Step 1: Understand the context. The quiz question is related to soccer tactics, rules, or scenarios. The aim is to 
-    illustrate the scenario clearly on a soccer pitch using player positions. Consider the information provided in the 
-    question and options and align the positions with the given scenario.
-
-    Step 2: Define the pitch dimensions. The soccer pitch dimensions are 120 (coordinates from 0 (left) to 120 (right)) 
-    for the x-axis and 80 (from 0 (top) to 80 (bottom)) for the y-axis. This will help in placing the players 
-    appropriately on the field. Make sure the coordinates respect these boundaries and align logically with the scenario. 
-    Calculate the key stadium areas, like the penalty area, corners, attacking and defending positions, half spaces, 
-    goalkeeper position... these will help you be more conscious about the stadium dimensions.
-
-    Step 3: Position the main player. Place the main player at a position that reflects their key role in the scenario. 
-    Think about whether this player is attacking or defending, and place them accordingly. Make sure to assign the main 
-    player a unique position.
-
-    Step 4: Place the team players (5 players, including the main player and the goalkeeper). Distribute the remaining 4 players from the 
-    main player’s team around the pitch based on the scenario. These players should be positioned strategically to 
-    reflect typical game dynamics, such as positioning during an attack, defense, or counterattack.
-
-    Step 5: Position the opponent players (5 players, including the goalkeeper). Place the defending team's players in 
-    appropriate positions to counter the team with the ball. Ensure that one of the players is clearly positioned as the 
-    goalkeeper, staying close to the goal. The other 4 opponent players should be positioned according to the game flow.
-
-    Step 6: Place the ball. The ball should be positioned near the main player, reflecting its role in the scenario. 
-    Ensure that the ball’s coordinates are logical in relation to the main player's position.
-
-    Format the final output in a JSON-like structure.
-    IMPERATIVE: JSON format must be wrapped with <JSON></JSON> tags, contain no extraneous 
-    characters, and be valid JSON. 
-    IMPERATIVE: Never use `//` comments.
-
-    Output JSON Format:
-    <JSON>
-    {{
-      "coordinates": {{
-        "team_players": [
-          {{"position": [x1, y1]}},
-          {{"position": [x2, y2]}},
-          {{"position": [x3, y3]}},
-          {{"position": [x4, y4]}},
-          {{"position": [x5, y5]}}
-        ],
-        "opponent_players": [
-          {{"position": [x6, y6]}},
-          {{"position": [x7, y7]}},
-          {{"position": [x8, y8]}},
-          {{"position": [x9, y9]}},
-          {{"position": [x10, y10]}}
-        ],
-        "main_player": [x_main, y_main],
-        "ball": [ball_x, ball_y]
-      }}
-    }}
-    </JSON>
+    if not reject_duplicates:
+        return generated_output
+    index = get_question_index(SPREADSHEET_NAME)
+    for attempt in range(MAX_DUPLICATE_RETRIES + 1):
+        if not generated_output:
+            return generated_output
+        match, similarity = index.find(generated_output["question"])
+        if match is None:
+            return generated_output
+        print(f"Duplicate question ({similarity:.2f}): {match}")
+        if attempt == MAX_DUPLICATE_RETRIES:
+            break
+        with st.spinner("Question already in the bank, generating another one..."):
+            generated_output = generate_questions(situation, scenario, axe, next_instruction(), difficulty)
+    st.warning("Only questions already in the bank were generated; please try again or change the options.")
+    return None
+
+
+def pregenerated_bundle():
     """
+    Takes a pre-generated question for the current options from the pool, skipping
+    any that entered the bank since they were generated.
 
-    # Generate and parse the response
-    positions_raw = generate_text(prompt)
-    positions_json = extract_json_from_generated(positions_raw)
-    return positions_json
-
-
-offensive_axes = [
-    "Select Axe",
-    "Contrôle de la possession",
-    "Créativité",
-    "Finition",
-    "Capacité de dribble",
-    "Précision des passes",
-    "Vision de jeu",
-    "Adaptabilité tactique",
-    "Puissance physique",
-    "Vitesse d'exécution"
-]
-
-defensive_axes = [
-    "Select Axe",
-    "Engagement défensif",
-    "Pressing et Récupération",
-    "Anticipation",
-    "Adaptabilité tactique",
-    "Puissance physique",
-    "Vitesse d'exécution",
-    "Vision de jeu"
-]
-
-# Offensive scenarios
-offensive_scenarios = [
-    "Select Scenario",
-    "Attaque Positionnelle",
-    "Contre-Attaque Rapide",
-    "Débordement sur les Côtés",
-    "Jeu en Profondeur",
-    "Centre en Retrait",
-    "Mouvement de Rupture (Appel sans Ballon)"
-]
-
-# Defensive scenarios
-defensive_scenarios = [
-    "Select Scenario",
-    "Défense en Bloc Bas",
-    "Marquage Individuel",
-    "Marquage en Zone",
-    "Réaction Rapide après un Tir Contré",
-    "Interception des Passes",
-    "Défense en Bloc Haut"
-]
-
-# Offensive scenarios with player positions
-offensive_scenarios = {
-    "Select Scenario": None,
-    "Attaque Positionnelle": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [40, 30]},  # Player 1
-            {"position": [60, 50]},  # Player 2
-            {"position": [80, 60]},  # Player 3
-            {"position": [100, 40]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 20]},  # Opp Player 1
-            {"position": [85, 50]},  # Opp Player 2
-            {"position": [80, 35]},  # Opp Player 3
-            {"position": [75, 45]}  # Opp Player 4
-        ],
-        "main_player": [60, 50],
-        "ball": [58, 48]
-    },
-    "Contre-Attaque Rapide": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [30, 50]},  # Player 1
-            {"position": [50, 40]},  # Player 2
-            {"position": [70, 45]},  # Player 3
-            {"position": [90, 55]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [100, 35]},  # Opp Player 1
-            {"position": [95, 50]},  # Opp Player 2
-            {"position": [85, 40]},  # Opp Player 3
-            {"position": [80, 30]}  # Opp Player 4
-        ],
-        "main_player": [70, 45],
-        "ball": [68, 43]
-    },
-    "Mouvement de Rupture (Appel sans Ballon)": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [30, 60]},  # Player 1
-            {"position": [50, 70]},  # Player 2
-            {"position": [80, 65]},  # Player 3
-            {"position": [100, 60]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 55]},  # Opp Player 1
-            {"position": [85, 65]},  # Opp Player 2
-            {"position": [80, 50]},  # Opp Player 3
-            {"position": [75, 40]}  # Opp Player 4
-        ],
-        "main_player": [80, 65],
-        "ball": [78, 63]
-    },
-    "Jeu en Profondeur": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [30, 60]},  # Player 1
-            {"position": [50, 70]},  # Player 2
-            {"position": [80, 65]},  # Player 3
-            {"position": [100, 60]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 55]},  # Opp Player 1
-            {"position": [85, 65]},  # Opp Player 2
-            {"position": [80, 50]},  # Opp Player 3
-            {"position": [75, 40]}  # Opp Player 4
-        ],
-        "main_player": [80, 65],
-        "ball": [78, 63]
-    },
-    "Centre en Retrait": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [30, 60]},  # Player 1
-            {"position": [50, 70]},  # Player 2
-            {"position": [80, 65]},  # Player 3
-            {"position": [100, 60]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 55]},  # Opp Player 1
-            {"position": [85, 65]},  # Opp Player 2
-            {"position": [80, 50]},  # Opp Player 3
-            {"position": [75, 40]}  # Opp Player 4
-        ],
-        "main_player": [80, 65],
-        "ball": [78, 63]
-    },
-    "Débordement sur les Côtés": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [30, 60]},  # Player 1
-            {"position": [50, 70]},  # Player 2
-            {"position": [80, 65]},  # Player 3
-            {"position": [100, 60]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 55]},  # Opp Player 1
-            {"position": [85, 65]},  # Opp Player 2
-            {"position": [80, 50]},  # Opp Player 3
-            {"position": [75, 40]}  # Opp Player 4
-        ],
-        "main_player": [80, 65],
-        "ball": [78, 63]
-    },
-    # Add more offensive scenarios as needed
-}
-
-# Defensive scenarios with player positions
-defensive_scenarios = {
-    "Select Scenario": None,
-    "Défense en Bloc Bas": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [20, 30]},  # Player 1
-            {"position": [25, 50]},  # Player 2
-            {"position": [30, 35]},  # Player 3
-            {"position": [40, 40]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 20]},  # Opp Player 1
-            {"position": [95, 50]},  # Opp Player 2
-            {"position": [85, 35]},  # Opp Player 3
-            {"position": [75, 40]}  # Opp Player 4
-        ],
-        "main_player": [25, 50],
-        "ball": [23, 48]
-    },
-    "Marquage Individuel": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [20, 40]},  # Player 1
-            {"position": [25, 35]},  # Player 2
-            {"position": [30, 50]},  # Player 3
-            {"position": [40, 45]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 30]},  # Opp Player 1
-            {"position": [95, 40]},  # Opp Player 2
-            {"position": [85, 50]},  # Opp Player 3
-            {"position": [75, 60]}  # Opp Player 4
-        ],
-        "main_player": [30, 50],
-        "ball": [28, 48]
-    },
-    "Marquage en Zone": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [20, 40]},  # Player 1
-            {"position": [25, 35]},  # Player 2
-            {"position": [30, 50]},  # Player 3
-            {"position": [40, 45]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 30]},  # Opp Player 1
-            {"position": [95, 40]},  # Opp Player 2
-            {"position": [85, 50]},  # Opp Player 3
-            {"position": [75, 60]}  # Opp Player 4
-        ],
-        "main_player": [30, 50],
-        "ball": [28, 48]
-    },
-    "Réaction Rapide après un Tir Contré": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [20, 40]},  # Player 1
-            {"position": [25, 35]},  # Player 2
-            {"position": [30, 50]},  # Player 3
-            {"position": [40, 45]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 30]},  # Opp Player 1
-            {"position": [95, 40]},  # Opp Player 2
-            {"position": [85, 50]},  # Opp Player 3
-            {"position": [75, 60]}  # Opp Player 4
-        ],
-        "main_player": [30, 50],
-        "ball": [28, 48]
-    },
-    "Interception des Passes": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [20, 40]},  # Player 1
-            {"position": [25, 35]},  # Player 2
-            {"position": [30, 50]},  # Player 3
-            {"position": [40, 45]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 30]},  # Opp Player 1
-            {"position": [95, 40]},  # Opp Player 2
-            {"position": [85, 50]},  # Opp Player 3
-            {"position": [75, 60]}  # Opp Player 4
-        ],
-        "main_player": [30, 50],
-        "ball": [28, 48]
-    },
-    "Défense en Bloc Haut": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [20, 40]},  # Player 1
-            {"position": [25, 35]},  # Player 2
-            {"position": [30, 50]},  # Player 3
-            {"position": [40, 45]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [90, 30]},  # Opp Player 1
-            {"position": [95, 40]},  # Opp Player 2
-            {"position": [85, 50]},  # Opp Player 3
-            {"position": [75, 60]}  # Opp Player 4
-        ],
-        "main_player": [30, 50],
-        "ball": [28, 48]
-    }
-    # Add more defensive scenarios as needed
-}
-
-# Other scenarios
-other_scenarios = []
-
-plotter = PlayerPositionPlotter(pitch_length=120, pitch_width=80)
+    Returns:
+        dict: {"generated_output": ..., "generated_positions": ...}, or None on a miss.
+    """
+    if not use_pregenerated or reuse_cached_questions:
+        return None
+    pool = get_question_pool(SPREADSHEET_NAME)
+    key = (situation, scenario, axe, difficulty, use_ai_positions)
+    while (bundle := pool.take(key)) is not None:
+        if get_question_index(SPREADSHEET_NAME).find(bundle["generated_output"]["question"])[0] is None:
+            return bundle
+    return None
 
-# Dropdown menus for user inputs
-situation = st.sidebar.selectbox("Situation", ["Select Situation", "Offense", "Defense", "Other"])
 
-if situation == "Offense":
-    scenario = st.sidebar.selectbox("Scenario", list(offensive_scenarios.keys()))
-    axe = st.sidebar.selectbox("Axe", offensive_axes)
-if situation == "Defense":
-    scenario = st.sidebar.selectbox("Scenario", list(defensive_scenarios.keys()))
-    axe = st.sidebar.selectbox("Axe", defensive_axes)
-if situation == "Other":
-    scenario = st.sidebar.selectbox("Scenario", other_scenarios)
-    axe = st.sidebar.selectbox("Axe", offensive_axes + defensive_axes)
-use_ai_positions = st.sidebar.selectbox("Use AI Positions", ["Yes", "No"])
-difficulty = st.sidebar.selectbox("Difficulty", ["Easy", "Medium", "Complex", "Unusual situations"])
+def matching_positions(question_text):
+    """
+    Looks up validated positions close enough to the current inputs and question.
 
-if "generated_output" not in st.session_state:
-    st.session_state["generated_output"] = None
+    Returns:
+        dict: Positions with a "coordinates" key, or None if nothing matches well enough.
+    """
+    if not reuse_formations:
+        return None
+    formation, confidence = get_formation_index(SPREADSHEET_NAME).query(situation, scenario, axe, question_text)
+    if formation is None or confidence < FORMATION_MATCH_THRESHOLD:
+        return None
+    print(f"Reusing validated positions (match {confidence:.2f})")
+    return {"coordinates": formation.to_dict()}
 
-if "generated_positions" not in st.session_state:
-    st.session_state["generated_positions"] = None
 
-if "generated_questions_history" not in st.session_state:
-    st.session_state["generated_questions_history"] = []
+@contextlib.contextmanager
+def outage_notice():
+    """
+    Shows an error instead of a traceback when OpenAI calls get suspended during a generation.
+    """
+    try:
+        yield
+    except CircuitOpenError as e:
+        st.error(f"{e} Please try again later.")
 
-positions_data = {
-    "coordinates": {
-        "team_players": [
-            {"position": [5, 40]},  # GK
-            {"position": [63, 55]},  # Player 1
-            {"position": [78, 50]},  # Player 2 (MAIN)
-            {"position": [97, 5]},  # Player 3
-            {"position": [98, 76]}  # Player 4
-        ],
-        "opponent_players": [
-            {"position": [115, 40]},  # Opp GK
-            {"position": [107, 20]},  # Opp Player 1
-            {"position": [107, 60]},  # Opp Player 2
-            {"position": [99, 42]},  # Opp Player 3
-            {"position": [74, 50]}  # Opp Player 4
-        ],
-        "main_player": [78, 50],  # Player 2 (MAIN)
-        "ball": [0, 0]  # Update this if ball coordinates are provided
-    }
-}
 
 # Generate Button
 if st.sidebar.button("Generate"):
-    # Check if all required options are selected
-    if situation == "Select Situation" or scenario == "Select Scenario" or axe == "Select Axe":
-        st.error("Please select valid options for Situation, Scenario, and Axe.")
-    else:
-        # Generate the question and answers
-        generated_output = generate_questions(situation, scenario, axe, random_instruction, difficulty)
-
-        if generated_output:
-            # Store the output in session state for persistence
-            st.session_state.generated_output = generated_output
-
+    with span("generate_click", use_ai_positions=use_ai_positions), outage_notice():
+        # Check if all required options are selected
+        if situation == "Select Situation" or scenario == "Select Scenario" or axe == "Select Axe":
+            st.error("Please select valid options for Situation, Scenario, and Axe.")
+        elif (bundle := pregenerated_bundle()) is not None:
+            st.session_state.generated_output = bundle["generated_output"]
+            st.session_state["question_instruction"] = bundle["instruction"]
             if use_ai_positions == "No":
-                # Visualize field positions
-                scenario_data = {
-                    "team_players": positions_data["coordinates"]["team_players"],
-                    "opponent_players": positions_data["coordinates"]["opponent_players"],
-                    "main_player": positions_data["coordinates"]["main_player"],
-                    "ball": positions_data["coordinates"]["ball"]
-                }
-                with st.spinner("Displaying player positions..."):
-                    fig = plotter.plot_player_positions(scenario_data)
-                    buf = BytesIO()
-                    fig.savefig(buf, format="png")
-                    st.image(buf)
-
-            if use_ai_positions == "Yes":
-                question_context = st.session_state["generated_output"].get("question", "")
-                if question_context:
-                    positions_data = generate_positions(question_context)
-                    if positions_data:
-                        st.session_state["generated_positions"] = positions_data  # Store in session state
-                    else:
-                        st.error("Failed to generate positions.")
-
-                print(positions_data)
-                # Visualize field positions
-                scenario_data = {
-                    "team_players": positions_data["coordinates"]["team_players"],
-                    "opponent_players": positions_data["coordinates"]["opponent_players"],
-                    "main_player": positions_data["coordinates"]["main_player"],
-                    "ball": positions_data["coordinates"]["ball"]
-                }
-                with st.spinner("Displaying player positions..."):
-                    fig = plotter.plot_player_positions(scenario_data)
-                    buf = BytesIO()
-                    fig.savefig(buf, format="png")
-                    st.image(buf)
+                render_positions(DEFAULT_POSITIONS)
+            else:
+                st.session_state["generated_positions"] = bundle["generated_positions"]
+                render_positions(bundle["generated_positions"])
+        elif (retry_in := openai_retry_in()) is not None:
+            # Fail fast rather than waiting for requests that are known to fail
+            st.error(f"The OpenAI API is unavailable; please try again in {retry_in:.0f}s.")
+        elif use_ai_positions == "Yes" and pipelined:
+            pitch_slot = st.empty()
+            question_future, positions_future = start_pipelined_generation(situation, scenario, axe,
+                                                                           next_instruction(), difficulty,
+                                                                           reuse_cached_questions)
+            with st.spinner("Generating question..."):
+                generated_output = unique_question(question_future.result())
+
+            if generated_output:
+                st.session_state.generated_output = generated_output
+                # Show the question right away; the full block below replaces it at the end of the run
+                preview = st.empty()
+                with preview.container():
+                    render_question(generated_output)
+
+                question_context = generated_output.get("question", "")
+                generated_positions = matching_positions(question_context)
+                if generated_positions:
+                    positions_future.cancel()
+                else:
+                    with st.spinner("Generating player positions..."):
+                        generated_positions = positions_future.result()
+                    if reconcile and not positions_agree(generated_positions, situation):
+                        with st.spinner("Adjusting player positions to the question..."):
+                            generated_positions = generate_positions(question_context) or generated_positions
+                    generated_positions = checked_positions(
+                        generated_positions, lambda: generate_positions(question_context, use_cache=False))
+
+                preview.empty()
+                st.session_state["generated_positions"] = generated_positions
+                with pitch_slot.container():
+                    render_positions(generated_positions)
+            else:
+                positions_future.cancel()
+        else:
+            # Generate the question and answers
+            preview = st.empty()
+            if stream_question:
+                generated_output = show_streamed_question(preview, stream_questions(
+                    situation, scenario, axe, next_instruction(), difficulty, reuse_cached_questions))
+            else:
+                generated_output = generate_questions(situation, scenario, axe, next_instruction(), difficulty,
+                                                      reuse_cached_questions)
+            generated_output = unique_question(generated_output)
+
+            if generated_output:
+                # Store the output in session state for persistence
+                st.session_state.generated_output = generated_output
+
+                if use_ai_positions == "No":
+                    render_positions(DEFAULT_POSITIONS)
+
+                if use_ai_positions == "Yes":
+                    question_context = st.session_state["generated_output"].get("question", "")
+                    generated_positions = matching_positions(question_context) or checked_positions(
+                        generate_positions(question_context),
+                        lambda: generate_positions(question_context, use_cache=False))
+                    st.session_state["generated_positions"] = generated_positions  # Store in session state
+
+                    print(generated_positions)
+                    render_positions(generated_positions)
+            # The full question block below takes over from the streamed preview
+            preview.empty()
+
+
+# Batch generation
+with st.sidebar.expander("Batch generation"):
+    batch_situations = st.multiselect("Situations", ["Offense", "Defense"], key="batch_situations")
+    batch_scenarios = st.multiselect(
+        "Scenarios",
+        [name for name, preset in {**offensive_scenarios, **defensive_scenarios}.items() if preset is not None],
+        key="batch_scenarios")
+    batch_axes = st.multiselect("Axes", list(dict.fromkeys(offensive_axes[1:] + defensive_axes[1:])),
+                                key="batch_axes")
+    batch_difficulties = st.multiselect("Difficulties", DIFFICULTIES, key="batch_difficulties")
+    questions_per_combination = st.number_input("Questions per combination", min_value=1, max_value=50, value=1)
+    questions_per_request = st.number_input("Questions per request", min_value=1, max_value=10, value=5)
+    batch_workers = st.number_input("Concurrent requests", min_value=1, max_value=16, value=4)
+    batch_to_sheet = st.checkbox("Add results to Google Sheets", value=False)
+    fill_gaps = st.checkbox("Fill coverage gaps", value=False,
+                            help="Ignore the selections above and generate the questions the bank misses most, "
+                                 "rotating the question specific instructions.")
+    gap_budget = st.number_input("Questions to generate", min_value=1, max_value=500, value=20, disabled=not fill_gaps)
+    run_batch = st.button("Generate batch")
+
+if run_batch:
+    if fill_gaps:
+        scheduler = get_coverage_scheduler(SPREADSHEET_NAME)
+        batch_jobs = scheduler.plan(gap_budget, questions_per_request)
+        if not batch_jobs:
+            st.success(f"Every cell of the bank already has {scheduler.quota} question(s).")
+    else:
+        scheduler = None
+        combinations = question_matrix(batch_situations, batch_scenarios, batch_axes, batch_difficulties)
+        batch_jobs = plan_batch_jobs(combinations, questions_per_combination, questions_per_request)
+        if not combinations:
+            st.error("Please select at least one valid Situation, Scenario, Axe and Difficulty combination.")
+    if batch_jobs:
+        total = sum(job["count"] for job in batch_jobs)
+        progress = st.progress(0.0, text=f"Generating {total} questions...")
+        table = st.empty()
+        batch_results, batch_errors, row_writes = [], [], []
+        # Questions of this batch, so that the batch does not repeat itself either
+        batch_index = QuestionIndex()
+        duplicates = 0
+        # Planned questions that will not reach the bank, released from the coverage at the end
+        unfilled = []
+        for result in iter_batch_jobs(batch_jobs, batch_workers):
+            cell = (result["situation"], result["scenario"], result["axe"], result["difficulty"],
+                    result["instruction"])
+            if "error" in result:
+                batch_errors.append(result)
+                unfilled.append((cell, result["missing"]))
+                continue
+            question_text = result["output"]["question"]
+            if reject_duplicates and (get_question_index(SPREADSHEET_NAME).find(question_text)[0] is not None
+                                      or batch_index.find(question_text)[0] is not None):
+                duplicates += 1
+                unfilled.append((cell, 1))
+                continue
+            batch_index.add(question_text)
+            batch_results.append({
+                "situation": result["situation"],
+                "scenario": result["scenario"],
+                "axe": result["axe"],
+                "difficulty": result["difficulty"],
+                "question": result["output"]["question"],
+            })
+            progress.progress(min(len(batch_results) / total, 1.0),
+                              text=f"{len(batch_results)}/{total} questions generated")
+            table.dataframe(batch_results)
+            if batch_to_sheet:
+                # Batch questions use the preset formation of their scenario
+                presets = scenario_presets(result["situation"])
+                row_writes.append(get_sheet_writer(SPREADSHEET_NAME).submit(build_sheet_row(
+                    result["situation"], result["scenario"], result["axe"], "No", result["output"],
+                    presets[result["scenario"]], result["difficulty"], result["instruction"])))
+                get_question_index(SPREADSHEET_NAME).add(question_text)
+                if scheduler is None:
+                    get_coverage_scheduler(SPREADSHEET_NAME).add(*cell)
+            else:
+                unfilled.append((cell, 1))
+        if scheduler is not None:
+            for cell, missing in unfilled:
+                scheduler.add(*cell, weight=-missing)
+        st.success(f"Generated {len(batch_results)} questions.")
+        if row_writes:
+            get_sheet_writer(SPREADSHEET_NAME).flush()
+            with st.spinner("Writing questions to Google Sheets..."):
+                failed_writes, syncing = wait_for_sheet_writes(row_writes)
+            if failed_writes:
+                st.error(f"{len(failed_writes)} question(s) could not be written: {failed_writes[0].error}")
+            elif syncing:
+                st.success(f"Saved {len(row_writes)} questions, {syncing} still syncing to Google Sheets.")
+            else:
+                st.success(f"Added {len(row_writes)} questions to Google Sheets.")
+        if duplicates:
+            st.warning(f"{duplicates} duplicate question(s) were dropped.")
+        if batch_errors:
+            st.warning(f"{len(batch_errors)} request(s) failed or returned invalid questions.")
 
 # Display the generated question and answers if available
 if st.session_state.generated_output:
-    st.subheader("Generated Question:")
-    st.markdown(f"**{st.session_state.generated_output['question']}**")
-
-    st.subheader("Answers:")
-    for i, answer in enumerate(st.session_state.generated_output["answers"], start=1):
-        st.write(f"**Option {i}:** {answer['text']}")
+    render_question(st.session_state.generated_output)
 
     # Action buttons
     col1, col2 = st.columns(2)
@@ -761,29 +474,30 @@ if st.session_state.generated_output:
                     st.stop()
 
                 # Prepare data to insert into Google Sheet
-                row_data = [
-                    situation,  # Selected situation
-                    scenario,  # Selected scenario
-                    axe,  # Selected axis
-                    use_ai_positions,  # Use AI Positions (Yes/No)
-                    st.session_state["generated_output"]["question"],  # Generated question
-                    *[answer["text"] for answer in st.session_state["generated_output"]["answers"]],  # Answers
-                    "; ".join(flatten_positions(positions.get("team_players", []))),  # Flattened team positions
-                    "; ".join(flatten_positions(positions.get("opponent_players", []))),  # Flattened opponent positions
-                    json.dumps(positions.get("ball", {})),  # Serialize ball position
-                    positions.get("main_player", "N/A")  # Add the main player field, defaulting to "N/A" if not present
-                ]
+                row_data = build_sheet_row(situation, scenario, axe, use_ai_positions,
+                                           st.session_state["generated_output"], positions, difficulty,
+                                           st.session_state["question_instruction"])
 
                 # Add the data to Google Sheets
-                success = add_to_google_sheet(sheet, row_data)
+                result = add_to_google_sheet(SPREADSHEET_NAME, row_data)
 
-                if success:
-                    st.success("Question successfully validated and shared!")
+                if result.ok:
+                    if result.pending:
+                        st.success("Question saved, syncing to Google Sheets. There is no need to validate it again.")
+                    else:
+                        st.success("Question successfully validated and shared!")
+                    get_question_index(SPREADSHEET_NAME).add(st.session_state["generated_output"]["question"])
+                    get_coverage_scheduler(SPREADSHEET_NAME).add(situation, scenario, axe, difficulty,
+                                                                 st.session_state["question_instruction"])
+                    if use_ai_positions == "Yes":
+                        get_formation_index(SPREADSHEET_NAME).add(
+                            Formation.coerce(positions), situation, scenario, axe,
+                            st.session_state["generated_output"]["question"])
                     # Clear session state after successful validation
                     st.session_state["generated_output"] = None
                     st.session_state["generated_positions"] = None
                 else:
-                    st.error("Failed to share the question. Please check your Google Sheets configuration.")
+                    st.error(f"Failed to share the question: {result.error}")
             except Exception as e:
                 st.error(f"An unexpected error occurred: {e}")
 
@@ -818,3 +532,12 @@ if st.session_state.generated_output:
             st.warning("Question rejected.")
             # Clear session state when rejected
             st.session_state.generated_output = None
+
+# Diagnostics panel
+if show_diagnostics:
+    with st.expander("Diagnostics", expanded=True):
+        diagnostics = snapshot()
+        st.caption("Stage timings (p50/p95 over the most recent calls)")
+        st.dataframe(diagnostics["stages"])
+        st.caption("Counters and gauges")
+        st.json({**diagnostics["counters"], **diagnostics["gauges"]})
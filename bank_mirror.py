@@ -0,0 +1,195 @@
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from formation import PLAYERS_PER_TEAM, Formation
+
+# Columns of a question bank row: situation, scenario, axe, use AI positions,
+# question, four answers, the team, opponents, ball and main player cells
+# written by `Formation.sheet_columns`, then the difficulty and question specific
+# instruction, empty in rows written before they were recorded.
+SHEET_COLUMNS = 15
+SHEET_RANGE = "A{first}:O"
+
+# Bumped when the table changes; older mirrors are rebuilt from the sheet
+SCHEMA_VERSION = 2
+
+
+class BankMirror:
+    """
+    Local SQLite copy of the question bank sheet with typed columns.
+
+    Positions are stored as float64 arrays of shape (5, 2) and the ball and main
+    player as numbers, so reads need neither the network nor parsing the joined
+    JSON cells of the sheet. The sheet is append-only in practice, so a sync only
+    fetches the rows after the last one mirrored. That last row is fetched again
+    and compared as an anchor: if it changed, rows were edited or deleted and the
+    mirror is rebuilt. A full rebuild also happens every `full_sync_interval`
+    seconds to pick up edits further up the sheet.
+    """
+
+    def __init__(self, path, full_sync_interval=3600.0):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+            full_sync_interval (float): Seconds between two full rebuilds.
+        """
+        self.full_sync_interval = full_sync_interval
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+        if self._meta("schema") != SCHEMA_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS questions")
+            self._db.execute("DELETE FROM meta")
+            self._set_meta("schema", SCHEMA_VERSION)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS questions ("
+            "row INTEGER PRIMARY KEY, situation TEXT, scenario TEXT, axe TEXT, use_ai INTEGER, question TEXT, "
+            "answer_1 TEXT, answer_2 TEXT, answer_3 TEXT, answer_4 TEXT, "
+            "team BLOB, opponents BLOB, ball_x REAL, ball_y REAL, main_index INTEGER, "
+            "difficulty TEXT, instruction TEXT, cells TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS questions_combination ON questions (situation, scenario, axe)")
+        self._db.commit()
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _record(row_number, cells):
+        cells = [str(cell) for cell in cells[:SHEET_COLUMNS]]
+        cells += [""] * (SHEET_COLUMNS - len(cells))
+        try:
+            formation = Formation.from_sheet_columns(*cells[9:13])
+        except ValueError:
+            formation = None
+        use_ai = {"Yes": 1, "No": 0}.get(cells[3])
+        positions = (None, None, None, None, None) if formation is None else (
+            formation.team.tobytes(), formation.opponents.tobytes(),
+            float(formation.ball[0]) if formation.has_ball else None,
+            float(formation.ball[1]) if formation.has_ball else None,
+            formation.main_index)
+        return (row_number, *cells[:3], use_ai, *cells[4:9], *positions, *cells[13:15],
+                json.dumps(cells, ensure_ascii=False))
+
+    def _insert(self, first_row, rows):
+        self._db.executemany("INSERT OR REPLACE INTO questions VALUES (" + ", ".join("?" * 18) + ")",
+                             [self._record(first_row + i, cells) for i, cells in enumerate(rows)])
+
+    def sync(self, read_rows, max_age=0.0):
+        """
+        Brings the mirror up to date with the sheet.
+
+        Args:
+            read_rows (callable): `read_rows(first)` returning the sheet rows from row
+                number `first` (1-based) to the end, as lists of cell strings.
+            max_age (float): Skip the sync if the last one is more recent than this.
+
+        Returns:
+            int: Number of rows fetched from the sheet.
+        """
+        now = time.time()
+        with self._lock:
+            last_sync = self._meta("last_sync") or 0.0
+            if now - last_sync < max_age:
+                return 0
+            last_row = self._db.execute("SELECT MAX(row) FROM questions").fetchone()[0] or 0
+            full = now - (self._meta("last_full_sync") or 0.0) >= self.full_sync_interval
+
+        anchor = None
+        if last_row and not full:
+            rows = read_rows(last_row)
+            with self._lock:
+                anchor = self._db.execute("SELECT cells FROM questions WHERE row = ?", (last_row,)).fetchone()
+            if not rows or self._record(last_row, rows[0])[-1] != anchor[0]:
+                print("The question bank changed above the mirrored rows, rebuilding the mirror")
+                full = True
+        if full or not last_row:
+            rows = read_rows(1)
+
+        with self._lock:
+            if full or not last_row:
+                self._db.execute("DELETE FROM questions")
+                self._insert(1, rows)
+                self._set_meta("last_full_sync", now)
+            else:
+                self._insert(last_row + 1, rows[1:])
+            self._set_meta("last_sync", now)
+            self._db.commit()
+        return len(rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def rows(self):
+        """
+        Returns the mirrored rows as lists of cell strings, like `get_all_values`.
+        """
+        with self._lock:
+            return [json.loads(cells) for cells, in self._db.execute("SELECT cells FROM questions ORDER BY row")]
+
+    def questions(self):
+        """
+        Returns the text of every non-empty question.
+        """
+        with self._lock:
+            return [question for question, in
+                    self._db.execute("SELECT question FROM questions WHERE question != '' ORDER BY row")]
+
+    def formations(self, use_ai=True):
+        """
+        Returns (formation, situation, scenario, axe, question) for every row with valid positions.
+
+        Args:
+            use_ai (bool): Only the rows with AI positions, or only the others when False.
+        """
+        with self._lock:
+            records = self._db.execute(
+                "SELECT team, opponents, ball_x, ball_y, main_index, situation, scenario, axe, question "
+                "FROM questions WHERE team IS NOT NULL AND use_ai = ? ORDER BY row", (int(use_ai),)).fetchall()
+        shape = (PLAYERS_PER_TEAM, 2)
+        return [(Formation(np.frombuffer(team).reshape(shape), np.frombuffer(opponents).reshape(shape), main_index,
+                           None if ball_x is None else (ball_x, ball_y)), situation, scenario, axe, question)
+                for team, opponents, ball_x, ball_y, main_index, situation, scenario, axe, question in records]
+
+    def formation_rows(self):
+        """
+        Returns (row, formation, situation, scenario, axe, question) for every row
+        with valid positions, AI and preset ones.
+        """
+        with self._lock:
+            records = self._db.execute(
+                "SELECT row, team, opponents, ball_x, ball_y, main_index, situation, scenario, axe, question "
+                "FROM questions WHERE team IS NOT NULL ORDER BY row").fetchall()
+        shape = (PLAYERS_PER_TEAM, 2)
+        return [(row, Formation(np.frombuffer(team).reshape(shape), np.frombuffer(opponents).reshape(shape),
+                                main_index, None if ball_x is None else (ball_x, ball_y)),
+                 situation, scenario, axe, question)
+                for row, team, opponents, ball_x, ball_y, main_index, situation, scenario, axe, question in records]
+
+    def cells(self):
+        """
+        Returns (situation, scenario, axe, difficulty, instruction) for every question,
+        with empty strings where the row does not record them.
+        """
+        with self._lock:
+            return self._db.execute("SELECT situation, scenario, axe, difficulty, instruction FROM questions "
+                                    "WHERE question != '' ORDER BY row").fetchall()
+
+    def coverage(self):
+        """
+        Returns the number of questions per (situation, scenario, axe).
+        """
+        with self._lock:
+            return {(situation, scenario, axe): total for situation, scenario, axe, total in self._db.execute(
+                "SELECT situation, scenario, axe, COUNT(*) FROM questions WHERE question != '' "
+                "GROUP BY situation, scenario, axe")}
@@ -0,0 +1,232 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the chat completions endpoint of the OpenAI API.
+#
+# Point the client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1. It
+# answers the question, positions and batch prompts of the engine with synthetic
+# payloads, or with responses replayed from a JSONL file, after a configurable
+# latency, and fails a configurable share of the requests with 429 or 500.
+# Repeated system messages are reported as cached prompt tokens, like the API does.
+
+WORDS = ("joueur passe ballon espace appel profondeur pressing bloc couloir milieu ailier lateral gardien "
+         "centre tir transition recuperation repli marquage interception soutien decalage rupture").split()
+
+
+def synthetic_question(rng):
+    words = " ".join(rng.choice(WORDS) for _ in range(12))
+    return {
+        "question": f"Que doit faire le joueur dans cette situation : {words} ?",
+        "answers": [{"text": f"Option {score} : " + " ".join(rng.choice(WORDS) for _ in range(8)), "score": score}
+                    for score in (4, 3, 2, 1)],
+    }
+
+
+def synthetic_positions(rng):
+    team = [[5, 40]] + [[rng.randint(20, 110), rng.randint(5, 75)] for _ in range(4)]
+    opponents = [[115, 40]] + [[rng.randint(20, 110), rng.randint(5, 75)] for _ in range(4)]
+    main_player = team[rng.randint(1, 4)]
+    return {"coordinates": {
+        "team_players": [{"position": position} for position in team],
+        "opponent_players": [{"position": position} for position in opponents],
+        "main_player": main_player,
+        "ball": [main_player[0] + 1, main_player[1]],
+    }}
+
+
+def prompt_kind(prompt):
+    """
+    Returns ("positions" | "batch" | "question" | "repair", count) for a prompt of the engine.
+    """
+    if "player positions and coordinates" in prompt:
+        return "positions", 1
+    batch = re.search(r"create (\d+) distinct questions", prompt)
+    if batch:
+        return "batch", int(batch.group(1))
+    if "does not match the expected format" in prompt:
+        return "repair", 1
+    return "question", 1
+
+
+class FakeOpenAI:
+    """
+    Builds the responses and decides the latency and failures of each request.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.5, error_rate=0.0, recorded=None, seed=0):
+        """
+        Args:
+            latency (float): Mean response time in seconds.
+            jitter (float): Relative spread of the response time, uniform in
+                latency * [1 - jitter, 1 + jitter].
+            error_rate (float): Share of requests failing with 429 or 500.
+            recorded (dict): Optional kind -> list of response texts to replay.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.recorded = recorded or {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self._prefixes = set()
+
+    def content(self, prompt, structured):
+        kind, count = prompt_kind(prompt)
+        with self._lock:
+            self.requests += 1
+            if self.recorded.get(kind):
+                return self._rng.choice(self.recorded[kind])
+            if kind == "positions":
+                payload = synthetic_positions(self._rng)
+            elif kind == "batch":
+                payload = [synthetic_question(self._rng) for _ in range(count)]
+            elif "coordinates" in prompt:
+                payload = synthetic_positions(self._rng)
+            else:
+                payload = synthetic_question(self._rng)
+        text = json.dumps(payload, ensure_ascii=False)
+        return text if structured else f"<JSON>{text}</JSON>"
+
+    def cached_tokens(self, messages):
+        """
+        Mimics the API prompt cache: in prompts of 1024 tokens or more, the leading
+        messages seen in an earlier request count as cached, in blocks of 128 tokens.
+        """
+        prefix = "\n".join(message["content"] for message in messages[:-1])
+        with self._lock:
+            seen = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        if not seen or sum(len(message["content"]) for message in messages) // 4 < 1024:
+            return 0
+        return len(prefix) // 4 // 128 * 128
+
+    def delay(self):
+        with self._lock:
+            return max(0.0, self.latency * self._rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def failure(self):
+        with self._lock:
+            if self._rng.random() >= self.error_rate:
+                return None
+            return self._rng.choice((429, 500))
+
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload, headers=()):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+            time.sleep(fake.delay())
+            status = fake.failure()
+            if status is not None:
+                self._send_json(status, {"error": {"message": "Synthetic failure", "type": "server_error"}},
+                                [("retry-after", "0")] if status == 429 else [])
+                return
+
+            prompt = "\n".join(message["content"] for message in request["messages"])
+            content = fake.content(prompt, structured=bool(request.get("response_format")))
+            model = request.get("model", "gpt-4o")
+            usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                     "total_tokens": (len(prompt) + len(content)) // 4,
+                     "prompt_tokens_details": {"cached_tokens": fake.cached_tokens(request["messages"])}}
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            if request.get("stream"):
+                self._stream(completion_id, model, content, usage,
+                             (request.get("stream_options") or {}).get("include_usage"))
+                return
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        def _stream(self, completion_id, model, content, usage, include_usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model}
+
+            def send(**fields):
+                self.wfile.write(f"data: {json.dumps({**base, **fields})}\n\n".encode("utf-8"))
+
+            for start in range(0, len(content), 16):
+                send(choices=[{"index": 0, "delta": {"content": content[start:start + 16]}, "finish_reason": None}])
+            send(choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                send(choices=[], usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def load_recorded(path):
+    """
+    Reads recorded responses from a JSONL file of {"kind": ..., "content": ...} lines.
+    """
+    recorded = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                recorded.setdefault(record["kind"], []).append(record["content"])
+    return recorded
+
+
+def serve(port=0, ready=None, **options):
+    """
+    Runs the fake server until the process is stopped. If `ready` is given, the
+    bound port is put on it once the server accepts connections.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(FakeOpenAI(**options)))
+    server.daemon_threads = True
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--recorded", help="JSONL file of recorded responses to replay")
+    args = parser.parse_args()
+    print(f"Serving on http://127.0.0.1:{args.port}/v1")
+    serve(args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+          recorded=load_recorded(args.recorded) if args.recorded else None)
+
+
+if __name__ == "__main__":
+    main()
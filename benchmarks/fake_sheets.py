@@ -0,0 +1,45 @@
+import random
+import threading
+import time
+
+import requests
+
+
+class InMemoryWorksheet:
+    """
+    Stand-in for a gspread worksheet keeping its rows in memory.
+
+    Calls take `latency` seconds, like a round trip to Google, and a share
+    `error_rate` of them fails with a connection error, which the sheet writer
+    treats as transient.
+    """
+
+    def __init__(self, rows=None, latency=0.1, error_rate=0.0, seed=0):
+        self.rows = [list(row) for row in rows or []]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._rng.random() < self.error_rate
+        time.sleep(self.latency)
+        if failed:
+            raise requests.ConnectionError("Synthetic Google Sheets failure")
+
+    def append_rows(self, values, value_input_option="RAW", **kwargs):
+        self._request()
+        with self._lock:
+            self.rows.extend(list(row) for row in values)
+        return {"updates": {"updatedRows": len(values)}}
+
+    def append_row(self, values, value_input_option="RAW", **kwargs):
+        return self.append_rows([values], value_input_option, **kwargs)
+
+    def get_all_values(self):
+        self._request()
+        with self._lock:
+            return [list(row) for row in self.rows]
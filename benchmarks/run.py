@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmarks of the generation pipeline against local stand-ins for OpenAI and
+# Google Sheets, so that no account is needed and runs are reproducible:
+#
+#   python -m benchmarks.run                      # compare with benchmarks/baseline.json
+#   python -m benchmarks.run --update-baseline    # record a new baseline
+#
+# Each case runs at increasing concurrency and reports p50/p95/p99 latency,
+# throughput and the peak RSS of the process so far. The run fails when a p95
+# latency or a throughput is worse than the baseline by more than --tolerance.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SAMPLE_RESPONSE = """Voici la question :
+<JSON>
+{
+  "question": "Le latéral doit-il suivre l'ailier adverse ou garder sa zone ?",
+  "answers": [
+    {"text": "Garder sa zone et communiquer", "score": 4},
+    {"text": "Suivre l'ailier jusqu'au bout", "score": 3},
+    {"text": "Monter au pressing", "score": 2},
+    {"text": "Reculer dans la surface", "score": 1}
+  ]
+}
+</JSON>"""
+
+
+def start_fake_openai(latency, error_rate, recorded):
+    from benchmarks.fake_openai import load_recorded, serve
+
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(0, ready), daemon=True, kwargs={
+        "latency": latency,
+        "error_rate": error_rate,
+        "recorded": load_recorded(recorded) if recorded else None,
+    })
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(fn, concurrency, requests):
+    """
+    Calls `fn(i)` for i in range(requests) from `concurrency` threads.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, throughput in calls per second,
+            error count and peak RSS in megabytes.
+    """
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            return time.perf_counter() - start, False
+        return time.perf_counter() - start, True
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed, range(requests)))
+    wall = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "p50_ms": round(1000 * quantiles[49], 2),
+        "p95_ms": round(1000 * quantiles[94], 2),
+        "p99_ms": round(1000 * quantiles[98], 2),
+        "throughput": round(requests / wall, 2),
+        "errors": sum(not ok for _, ok in results),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def build_cases(args, workdir):
+    """
+    Returns name -> (fn(i), concurrency levels, request count) for each benchmark case.
+    """
+    import engine
+    from benchmarks.fake_sheets import InMemoryWorksheet
+    from formation import Formation
+    from rendering import PlayerPositionPlotter
+    from sheet_writer import SheetWriter
+
+    rng = random.Random(0)
+    formations = [Formation([[5, 40]] + [[rng.uniform(20, 110), rng.uniform(5, 75)] for _ in range(4)],
+                            [[115, 40]] + [[rng.uniform(20, 110), rng.uniform(5, 75)] for _ in range(4)],
+                            1, [50, 40]) for _ in range(64)]
+    plotter = PlayerPositionPlotter()
+    worksheet = InMemoryWorksheet(latency=args.sheet_latency, error_rate=args.error_rate)
+    writer = SheetWriter(worksheet.append_rows, os.path.join(workdir, "sheet_spool.jsonl"), base_delay=0.05)
+    row = ["Offense", "Jeu en Profondeur", "Finition", "Yes", "Question ?", "A", "B", "C", "D",
+           *formations[0].sheet_columns()]
+
+    def generate_questions(i):
+        if engine.generate_questions("Offense", "Jeu en Profondeur", "Finition", engine.QUESTION_INSTRUCTIONS[i % 10],
+                                     "Medium") is None:
+            raise ValueError("No question")
+
+    def generate_positions(i):
+        if engine.generate_positions(f"Question numéro {i} ?", use_cache=False) is None:
+            raise ValueError("No positions")
+
+    def write_row(i):
+        result = writer.submit(row, urgent=True).result(60)
+        if not result.ok:
+            raise RuntimeError(result.error)
+
+    levels = args.concurrency
+    return {
+        "extract_json": (lambda i: engine.extract_json_from_generated(SAMPLE_RESPONSE), [1], args.requests * 50),
+        "generate_questions": (generate_questions, levels, args.requests),
+        "generate_positions": (generate_positions, levels, args.requests),
+        "render_png": (lambda i: plotter.render_png(formations[i % len(formations)]), levels, args.requests),
+        "sheet_writer": (write_row, levels, args.requests),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Lists the cases whose p95 latency or throughput regressed beyond `tolerance`.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result["p95_ms"] > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']} ms > baseline {reference['p95_ms']} ms")
+        if result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']}/s < baseline {reference['throughput']}/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against local stand-ins")
+    parser.add_argument("--cases", nargs="+", help="Only run these cases")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="Calls per case and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean fake OpenAI latency in seconds")
+    parser.add_argument("--sheet-latency", type=float, default=0.1, help="Fake Google Sheets latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of failing fake API calls")
+    parser.add_argument("--recorded", help="JSONL file of recorded OpenAI responses to replay")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative regression")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="matchango-bench-")
+    server, port = start_fake_openai(args.latency, args.error_rate, args.recorded)
+    # Must be set before the engine creates its clients and caches
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+        "RESPONSE_CACHE_PATH": os.path.join(workdir, "response_cache.sqlite3"),
+        "SHEET_SPOOL_PATH": os.path.join(workdir, "sheet_spool.jsonl"),
+    })
+    os.environ.pop("METRICS_LOG", None)
+
+    results = {}
+    try:
+        cases = build_cases(args, workdir)
+        print(f"{'case':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'calls/s':>10}{'errors':>8}{'RSS MB':>9}")
+        for name, (fn, levels, requests) in cases.items():
+            if args.cases and name not in args.cases:
+                continue
+            for concurrency in levels:
+                key = f"{name}@{concurrency}"
+                results[key] = result = measure(fn, concurrency, requests)
+                print(f"{key:<28}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+                      f"{result['throughput']:>10}{result['errors']:>8}{result['peak_rss_mb']:>9}")
+    finally:
+        server.terminate()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with; run with --update-baseline to record one.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
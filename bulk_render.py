@@ -0,0 +1,186 @@
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+
+from formation import Formation
+from metrics import count
+
+# Bulk export of pitch diagrams across a process pool. Rendering is CPU bound and
+# matplotlib holds the GIL, so threads do not help; each worker process keeps one
+# PlayerPositionPlotter, whose pitch background is drawn once and reused for
+# every image it renders.
+#
+# Images go to a directory, or to a .tar or .zip archive staged in a
+# "<archive>.partial" directory and packed at the end. Images are named after the
+# content they are rendered from, so files already present are up to date and
+# skipped: an interrupted export resumes where it stopped, and a formation that
+# changed or moved to another row of the bank gets the image it should.
+
+ARCHIVE_SUFFIXES = (".tar", ".zip")
+
+# Plotter of the worker process, built by `_init_worker`
+_plotter = None
+
+
+def _init_worker(plotter_args):
+    global _plotter
+    from rendering import PlayerPositionPlotter
+
+    _plotter = PlayerPositionPlotter(**plotter_args)
+
+
+def _render_chunk(chunk, image_format):
+    # Formations travel as their 89 byte packing rather than pickled arrays
+    return [(name, _plotter.render_image(Formation.from_bytes(data), image_format)) for name, data in chunk]
+
+
+def image_name(data, plotter_args=None):
+    """
+    Returns the file name, without extension, of the image of a formation packed by
+    `Formation.to_bytes`, drawn by a PlayerPositionPlotter built with `plotter_args`.
+    """
+    key = hashlib.sha256(data)
+    key.update(json.dumps(plotter_args or {}, sort_keys=True).encode("utf-8"))
+    return key.hexdigest()[:24]
+
+
+class ImageSink:
+    """
+    Writes images to a directory and tells which ones it already holds. Archives
+    are written to a staging directory first, then packed by `close`.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.archive = output.endswith(ARCHIVE_SUFFIXES)
+        self.directory = f"{output}.partial" if self.archive else output
+        os.makedirs(self.directory, exist_ok=True)
+
+    def existing(self):
+        names = {name for name in os.listdir(self.directory) if not name.endswith(".tmp")}
+        if self.archive and os.path.exists(self.output):
+            if self.output.endswith(".zip"):
+                with zipfile.ZipFile(self.output) as archive:
+                    names.update(archive.namelist())
+            else:
+                with tarfile.open(self.output) as archive:
+                    names.update(archive.getnames())
+        return names
+
+    def write(self, name, data):
+        # Written under a temporary name first, so a resumed export never sees a truncated image
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def close(self):
+        """
+        Packs the staged images with those of an existing archive into a new one,
+        which replaces it only once complete.
+        """
+        if not self.archive:
+            return
+        staged = sorted(os.listdir(self.directory))
+        replaced = set(staged)
+        packing = f"{self.output}.tmp"
+        previous = self.output if os.path.exists(self.output) else None
+        if self.output.endswith(".zip"):
+            # PNG and WEBP are already compressed, so the entries are stored as they are
+            with zipfile.ZipFile(packing, "w", compression=zipfile.ZIP_STORED) as archive:
+                if previous:
+                    with zipfile.ZipFile(previous) as old:
+                        for info in old.infolist():
+                            if info.filename not in replaced:
+                                archive.writestr(info, old.read(info))
+                for name in staged:
+                    archive.write(os.path.join(self.directory, name), name)
+        else:
+            with tarfile.open(packing, "w") as archive:
+                if previous:
+                    with tarfile.open(previous) as old:
+                        for member in old.getmembers():
+                            if member.name not in replaced:
+                                archive.addfile(member, old.extractfile(member))
+                for name in staged:
+                    archive.add(os.path.join(self.directory, name), name)
+        os.replace(packing, self.output)
+        shutil.rmtree(self.directory)
+
+
+def export_images(records, output, workers=None, chunk_size=32, image_format="PNG", plotter_args=None,
+                  report_every=1.0):
+    """
+    Renders formations to image files named after their content, see `image_name`.
+
+    Identical formations, such as the scenario presets shared by many rows, are
+    rendered once into a single file. A manifest.jsonl lists the image of every
+    record with its metadata.
+
+    Args:
+        records (list): (formation, metadata) tuples, `metadata` a JSON serializable dict.
+        output (str): Directory, or path of a .tar or .zip archive.
+        workers (int): Processes rendering, one per CPU by default.
+        chunk_size (int): Images rendered per task sent to a worker.
+        image_format (str): "PNG" or "WEBP".
+        plotter_args (dict): Arguments of each worker's PlayerPositionPlotter.
+        report_every (float): Seconds between two progress lines on stderr.
+
+    Returns:
+        dict: Images "written", "skipped" because already present, the number of
+            "records" they cover, and the "seconds" and "images_per_second" of the run.
+    """
+    start = time.perf_counter()
+    extension = "." + image_format.lower()
+    sink = ImageSink(output)
+    existing = sink.existing()
+
+    manifest = []
+    pending = {}  # file name -> formation bytes of the images still to write
+    for formation, metadata in records:
+        data = Formation.coerce(formation).to_bytes()
+        name = image_name(data, plotter_args) + extension
+        manifest.append({"file": name, **metadata})
+        if name not in existing:
+            pending[name] = data
+    images = {entry["file"] for entry in manifest}
+    tasks = list(pending.items())
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+    written, last_report = 0, start
+    if chunks:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(chunks)))
+        # Spawned rather than forked: the parent may run threads, e.g. the event loop of the engine
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=_init_worker,
+                                                    initargs=(plotter_args or {},)) as pool:
+            futures = [pool.submit(_render_chunk, chunk, image_format) for chunk in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                rendered = future.result()
+                for name, data in rendered:
+                    sink.write(name, data)
+                written += len(rendered)
+                count("bulk_images_rendered_total", len(rendered))
+                now = time.perf_counter()
+                if now - last_report >= report_every:
+                    last_report = now
+                    print(f"{written}/{len(tasks)} images, {written / (now - start):.0f} images/s", file=sys.stderr)
+
+    sink.write("manifest.jsonl", "".join(json.dumps(entry, ensure_ascii=False) + "\n"
+                                         for entry in manifest).encode("utf-8"))
+    sink.close()
+    seconds = time.perf_counter() - start
+    return {
+        "written": written,
+        "skipped": len(images) - len(tasks),
+        "records": len(manifest),
+        "seconds": seconds,
+        "images_per_second": written / seconds if seconds else 0.0,
+    }
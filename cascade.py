@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import defaultdict
+
+from metrics import count, counter_total, observe, register_gauge
+
+# Model routing: each prompt is first sent to a small, fast model and only
+# escalated to the next model of its route when the answer fails validation.
+# Routes are overridden with <ROUTE>_MODELS, e.g. POSITIONS_MODELS=gpt-4o to
+# skip the small model, or QUESTION_MODELS=gpt-4o-mini,gpt-4o.
+
+DEFAULT_ROUTES = {
+    "question": ("gpt-4o-mini", "gpt-4o"),
+    "batch_question": ("gpt-4o-mini", "gpt-4o"),
+    "positions": ("gpt-4o-mini", "gpt-4o"),
+}
+
+# Routes not listed above keep the single model they always used
+FALLBACK_MODEL = "gpt-4o"
+
+# Outcomes per route and model, e.g. {("positions", "gpt-4o-mini"): {"attempts": 10, "accepted": 9, ...}}
+_route_stats = defaultdict(lambda: {"attempts": 0, "accepted": 0, "seconds": 0.0})
+_route_stats_lock = threading.Lock()
+
+
+def route_models(route):
+    """
+    Returns the models to try in order for a route.
+    """
+    configured = os.getenv(f"{route.upper()}_MODELS")
+    if configured:
+        return tuple(model.strip() for model in configured.split(",") if model.strip())
+    return DEFAULT_ROUTES.get(route, (FALLBACK_MODEL,))
+
+
+def record_attempt(route, model, accepted, seconds):
+    """
+    Counts one model call of a route and whether its answer was accepted.
+    """
+    outcome = "accepted" if accepted else "rejected"
+    count("cascade_attempts_total", route=route, model=model, outcome=outcome)
+    observe("cascade_step_seconds", seconds, route=route, model=model, outcome=outcome)
+    with _route_stats_lock:
+        stats = _route_stats[(route, model)]
+        stats["attempts"] += 1
+        stats["accepted"] += accepted
+        stats["seconds"] += seconds
+
+
+def route_stats():
+    """
+    Summarises the routes for tuning.
+
+    Returns:
+        dict: {route: {"models": {model: {"attempts", "accepted", "success_rate",
+            "mean_seconds"}}, "escalation_rate": share of first attempts rejected,
+            "cost_per_accepted_usd": API cost of the route, repairs included,
+            divided by its accepted answers}}.
+    """
+    with _route_stats_lock:
+        stats = {key: dict(value) for key, value in _route_stats.items()}
+
+    routes = {}
+    for (route, model), counts in sorted(stats.items()):
+        routes.setdefault(route, {"models": {}})["models"][model] = {
+            "attempts": counts["attempts"],
+            "accepted": counts["accepted"],
+            "success_rate": counts["accepted"] / counts["attempts"],
+            "mean_seconds": counts["seconds"] / counts["attempts"],
+        }
+    for route, summary in routes.items():
+        models = summary["models"]
+        first = models.get(route_models(route)[0])
+        summary["escalation_rate"] = 1 - first["success_rate"] if first else 0.0
+        accepted = sum(counts["accepted"] for counts in models.values())
+        cost = (counter_total("openai_cost_usd_total", prompt=route)
+                + counter_total("openai_cost_usd_total", prompt=f"{route}_repair"))
+        summary["cost_per_accepted_usd"] = cost / accepted if accepted else None
+    return routes
+
+
+# Route health, read when the metrics are exported
+register_gauge("cascade_success_rate", lambda: {
+    (("model", model), ("route", route)): counts["success_rate"]
+    for route, summary in route_stats().items() for model, counts in summary["models"].items()})
+register_gauge("cascade_escalation_rate", lambda: {
+    (("route", route),): summary["escalation_rate"] for route, summary in route_stats().items()})
+register_gauge("cost_per_accepted_usd", lambda: {
+    (("route", route),): summary["cost_per_accepted_usd"] for route, summary in route_stats().items()
+    if summary["cost_per_accepted_usd"] is not None})
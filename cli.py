@@ -0,0 +1,244 @@
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from engine import (COVERAGE_QUOTA, QUESTION_INSTRUCTIONS, SPREADSHEET_NAME, build_sheet_row, generate_positions,
+                    generate_questions, get_coverage_scheduler, iter_batch_jobs, plan_batch_jobs, question_matrix,
+                    render_png, sync_bank, wait_for_sheet_writes)
+from geometry import MIN_LAYOUT_SCORE, repair_positions
+from metrics import serve_from_env
+from parsing import json_schema_format
+from presets import DEFAULT_POSITIONS, DIFFICULTIES, scenario_presets
+from prompts import (MIN_CACHED_PREFIX_TOKENS, build_batch_question_prompt, build_positions_prompt,
+                     build_question_prompt, prompt_tokens)
+from resources import get_bank_mirror, get_sheet_writer
+
+# Command line entry point of the engine, for batch runs without the Streamlit page:
+#
+#   python cli.py question --situation Offense --scenario "Jeu en Profondeur" --axe Finition --positions
+#   python cli.py batch --situations Offense --scenarios "Jeu en Profondeur" --axes Finition --output out.jsonl
+#   python cli.py render positions.json pitch.png
+#   python cli.py startup
+#   python cli.py prompts
+#   python cli.py bank --full
+#   python cli.py fill --budget 50 --to-sheet
+#   python cli.py export-images diagrams.zip --workers 8
+
+
+def command_question(args):
+    generated_output = generate_questions(args.situation, args.scenario, args.axe,
+                                          random.choice(QUESTION_INSTRUCTIONS), args.difficulty)
+    if generated_output is None:
+        sys.exit("The model did not return a valid question.")
+    result = {"generated_output": generated_output, "generated_positions": None}
+    if args.positions:
+        formation, score, _ = repair_positions(generate_positions(generated_output["question"]))
+        if formation is None or score < MIN_LAYOUT_SCORE:
+            sys.exit("The model did not return usable positions.")
+        result["generated_positions"] = {"coordinates": formation.to_dict()}
+    if args.png:
+        with open(args.png, "wb") as f:
+            f.write(render_png(result["generated_positions"] or DEFAULT_POSITIONS))
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+
+
+def command_batch(args):
+    combinations = question_matrix(args.situations, args.scenarios, args.axes, args.difficulties)
+    if not combinations:
+        sys.exit("No valid Situation, Scenario, Axe and Difficulty combination.")
+    run_batch_jobs(plan_batch_jobs(combinations, args.count, args.per_request), args)
+
+
+def command_fill(args):
+    scheduler = get_coverage_scheduler(SPREADSHEET_NAME, args.quota)
+    jobs = scheduler.plan(args.budget, args.per_request)
+    if not jobs:
+        print(f"Every cell of the bank already has {args.quota} question(s).", file=sys.stderr)
+        return
+    if args.dry_run:
+        for job in jobs:
+            print(json.dumps(job, ensure_ascii=False))
+        return
+    run_batch_jobs(jobs, args)
+
+
+def run_batch_jobs(jobs, args):
+    """
+    Runs batch jobs and writes the questions as JSON lines, and to the sheet with --to-sheet.
+    """
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    writes, errors, count = [], 0, 0
+    start = time.perf_counter()
+    try:
+        for result in iter_batch_jobs(jobs, args.workers):
+            if "error" in result:
+                errors += 1
+                print(f"Failed: {result['error']}", file=sys.stderr)
+                continue
+            count += 1
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            if args.to_sheet:
+                writes.append(get_sheet_writer(SPREADSHEET_NAME).submit(build_sheet_row(
+                    result["situation"], result["scenario"], result["axe"], "No", result["output"],
+                    scenario_presets(result["situation"])[result["scenario"]], result["difficulty"],
+                    result["instruction"])))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if writes:
+        get_sheet_writer(SPREADSHEET_NAME).flush()
+        failed, queued = wait_for_sheet_writes(writes)
+        if failed:
+            print(f"{len(failed)} row(s) could not be written: {failed[0].error}", file=sys.stderr)
+        if queued:
+            print(f"{queued} row(s) are still queued and will be written by the next run.", file=sys.stderr)
+    print(f"{count} questions, {errors} failed request(s) in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+def command_render(args):
+    with open(args.positions, encoding="utf-8") as f:
+        payload = json.load(f)
+    # Accept the JSON downloaded from the app as well as a bare positions payload
+    positions = payload.get("generated_positions") or payload
+    with open(args.image, "wb") as f:
+        f.write(render_png(positions))
+
+
+def timed_import(statement, runs):
+    """
+    Returns the median wall time of running `statement` in a fresh interpreter.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def command_startup(args):
+    baseline = timed_import("pass", args.runs)
+    for label, statement in (("import engine", "import engine"),
+                             ("first render", "import engine, presets; engine.render_png(presets.DEFAULT_POSITIONS)")):
+        print(f"{label}: {(timed_import(statement, args.runs) - baseline) * 1000:.0f} ms "
+              f"(median of {args.runs}, interpreter start excluded)")
+
+
+def command_prompts(args):
+    from schemas import Positions, Question
+
+    question = build_question_prompt("Offense", "Jeu en Profondeur", "Finition", QUESTION_INSTRUCTIONS[0],
+                                     DIFFICULTIES[0])
+    samples = (
+        (question, json_schema_format(Question, "question")),
+        (build_batch_question_prompt("Offense", "Jeu en Profondeur", "Finition", QUESTION_INSTRUCTIONS[0],
+                                     DIFFICULTIES[0], 5), None),
+        (build_positions_prompt("Question: Le latéral doit-il suivre l'ailier adverse ou garder sa zone ?"),
+         json_schema_format(Positions, "positions")),
+    )
+    print(f"{'prompt':<16}{'prefix':>8}{'variable':>10}{'budget':>8}  cacheable")
+    for prompt, response_format in samples:
+        prefix, variable = prompt_tokens(prompt, response_format)
+        print(f"{prompt.name:<16}{prefix:>8}{variable:>10}{prompt.max_tokens:>8}  "
+              f"{'yes' if prefix + variable >= MIN_CACHED_PREFIX_TOKENS else 'no'}")
+
+
+def command_bank(args):
+    if args.full:
+        get_bank_mirror(SPREADSHEET_NAME).full_sync_interval = 0
+    start = time.perf_counter()
+    mirror = sync_bank(SPREADSHEET_NAME, max_age=0)
+    print(f"{len(mirror)} rows mirrored in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+    for (situation, scenario, axe), total in sorted(mirror.coverage().items()):
+        print(f"{total:>5}  {situation} / {scenario} / {axe}")
+
+
+def command_export_images(args):
+    from bulk_render import export_images
+
+    if args.full:
+        get_bank_mirror(SPREADSHEET_NAME).full_sync_interval = 0
+    records = [(formation, {"row": row, "situation": situation, "scenario": scenario, "axe": axe,
+                            "question": question})
+               for row, formation, situation, scenario, axe, question
+               in sync_bank(SPREADSHEET_NAME, max_age=0).formation_rows()]
+    stats = export_images(records, args.output, args.workers, args.chunk_size, args.format)
+    print(f"{stats['written']} images written, {stats['skipped']} already exported, for {stats['records']} rows, "
+          f"in {stats['seconds']:.1f}s: {stats['images_per_second']:.0f} images/s", file=sys.stderr)
+
+
+def main(argv=None):
+    load_dotenv()
+    serve_from_env()
+    parser = argparse.ArgumentParser(description="Matchango quiz question generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    question = commands.add_parser("question", help="Generate one question and print it as JSON")
+    question.add_argument("--situation", required=True)
+    question.add_argument("--scenario", required=True)
+    question.add_argument("--axe", required=True)
+    question.add_argument("--difficulty", choices=DIFFICULTIES, default=DIFFICULTIES[0])
+    question.add_argument("--positions", action="store_true", help="Also generate the player positions")
+    question.add_argument("--png", help="Write the pitch image to this file")
+    question.set_defaults(handler=command_question)
+
+    batch = commands.add_parser("batch", help="Generate questions for every combination, as JSON lines")
+    batch.add_argument("--situations", nargs="+", required=True, choices=["Offense", "Defense"])
+    batch.add_argument("--scenarios", nargs="+", required=True)
+    batch.add_argument("--axes", nargs="+", required=True)
+    batch.add_argument("--difficulties", nargs="+", choices=DIFFICULTIES, default=DIFFICULTIES)
+    batch.add_argument("--count", type=int, default=1, help="Questions per combination")
+    batch.add_argument("--per-request", type=int, default=5, help="Questions asked in a single model call")
+    batch.add_argument("--workers", type=int, default=4, help="Concurrent model calls")
+    batch.add_argument("--output", help="Append the questions to this file instead of printing them")
+    batch.add_argument("--to-sheet", action="store_true", help="Also add the questions to Google Sheets")
+    batch.set_defaults(handler=command_batch)
+
+    render = commands.add_parser("render", help="Render a positions JSON file to a PNG image")
+    render.add_argument("positions")
+    render.add_argument("image")
+    render.set_defaults(handler=command_render)
+
+    startup = commands.add_parser("startup", help="Measure the cold start of the engine")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(handler=command_startup)
+
+    prompts = commands.add_parser("prompts", help="Show the token counts and answer budgets of the prompts")
+    prompts.set_defaults(handler=command_prompts)
+
+    bank = commands.add_parser("bank", help="Sync the local mirror of the question bank and show its coverage")
+    bank.add_argument("--full", action="store_true", help="Rebuild the mirror from the whole sheet")
+    bank.set_defaults(handler=command_bank)
+
+    fill = commands.add_parser("fill", help="Generate the questions the bank misses most, as JSON lines")
+    fill.add_argument("--quota", type=int, default=COVERAGE_QUOTA,
+                      help="Questions wanted per combination and question specific instruction")
+    fill.add_argument("--budget", type=int, default=20, help="Questions to generate at most")
+    fill.add_argument("--per-request", type=int, default=5, help="Questions asked in a single model call")
+    fill.add_argument("--workers", type=int, default=4, help="Concurrent model calls")
+    fill.add_argument("--output", help="Append the questions to this file instead of printing them")
+    fill.add_argument("--to-sheet", action="store_true", help="Also add the questions to Google Sheets")
+    fill.add_argument("--dry-run", action="store_true", help="Print the planned requests without running them")
+    fill.set_defaults(handler=command_fill)
+
+    export = commands.add_parser("export-images", help="Render the pitch diagram of every question of the bank")
+    export.add_argument("output", help="Directory, or .tar or .zip archive; an interrupted export is resumed")
+    export.add_argument("--workers", type=int, help="Rendering processes, one per CPU by default")
+    export.add_argument("--chunk-size", type=int, default=32, help="Images per task sent to a worker")
+    export.add_argument("--format", choices=["PNG", "WEBP"], default="PNG")
+    export.add_argument("--full", action="store_true", help="Rebuild the bank mirror from the whole sheet first")
+    export.set_defaults(handler=command_export_images)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
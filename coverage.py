@@ -0,0 +1,121 @@
+import collections
+import itertools
+import math
+import threading
+
+# Coverage of the question bank per (situation, scenario, axe, difficulty,
+# instruction) cell, and planning of the generation that fills the cells below
+# their quota.
+#
+# Rows written before the difficulty and instruction were recorded in the sheet
+# only tell their (situation, scenario, axe); they are spread evenly over the
+# difficulties and instructions of that combination so that well covered
+# combinations are not planned again.
+
+
+class CoverageScheduler:
+    """
+    Counts questions per cell and hands out the generation needed to bring every
+    cell to `quota` questions, spreading it across combinations and rotating the
+    question specific instructions evenly within each one.
+    """
+
+    def __init__(self, combinations, instructions, quota=1):
+        """
+        Args:
+            combinations (list): (situation, scenario, axe, difficulty) tuples to cover,
+                see `question_matrix`.
+            instructions (list): The question specific instructions.
+            quota (int): Questions wanted per (combination, instruction) cell.
+        """
+        self.combinations = list(dict.fromkeys(combinations))
+        self.instructions = list(instructions)
+        self.quota = quota
+        self._difficulties = collections.defaultdict(list)  # (situation, scenario, axe) -> difficulties
+        for situation, scenario, axe, difficulty in self.combinations:
+            self._difficulties[(situation, scenario, axe)].append(difficulty)
+        self._counts = collections.defaultdict(float)  # (situation, scenario, axe, difficulty, instruction) -> count
+        self._rotation = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, situation, scenario, axe, difficulty="", instruction="", weight=1.0):
+        """
+        Counts a question, or a planned one. An unknown difficulty or instruction
+        spreads the question over the cells of its combination.
+        """
+        difficulties = [difficulty] if difficulty else self._difficulties.get((situation, scenario, axe), [])
+        instructions = [instruction] if instruction in self.instructions else self.instructions
+        if not difficulties:
+            return
+        share = weight / (len(difficulties) * len(instructions))
+        with self._lock:
+            for cell_difficulty, cell_instruction in itertools.product(difficulties, instructions):
+                self._counts[(situation, scenario, axe, cell_difficulty, cell_instruction)] += share
+
+    def _missing(self, combination):
+        return {instruction: self.quota - self._counts[(*combination, instruction)]
+                for instruction in self.instructions}
+
+    def next_instruction(self, situation, scenario, axe, difficulty):
+        """
+        Returns the least covered instruction of a combination, rotating among ties.
+        """
+        with self._lock:
+            missing = self._missing((situation, scenario, axe, difficulty))
+        offset = next(self._rotation) % len(self.instructions)
+        order = self.instructions[offset:] + self.instructions[:offset]
+        return max(order, key=lambda instruction: missing[instruction])
+
+    def plan(self, budget, per_request=5):
+        """
+        Plans at most `budget` questions towards the quotas, one at a time for the
+        combination with the most missing questions, and reserves them so that
+        later plans do not repeat them.
+
+        Returns:
+            list: Batch jobs as built by `plan_batch_jobs`, each with its instruction.
+        """
+        with self._lock:
+            missing = {combination: self._missing(combination) for combination in self.combinations}
+        remaining = {combination: sum(max(0.0, value) for value in cells.values())
+                     for combination, cells in missing.items()}
+        planned = collections.Counter()
+        for _ in range(budget):
+            combination = max(remaining, key=remaining.get, default=None)
+            if combination is None or remaining[combination] <= 0:
+                break
+            cells = missing[combination]
+            # Rotate the order so that ties do not always go to the first instructions
+            offset = next(self._rotation) % len(self.instructions)
+            order = self.instructions[offset:] + self.instructions[:offset]
+            instruction = max(order, key=lambda name: cells[name])
+            planned[(combination, instruction)] += 1
+            cells[instruction] -= 1
+            remaining[combination] = sum(max(0.0, value) for value in cells.values())
+
+        jobs = []
+        for ((situation, scenario, axe, difficulty), instruction), total in planned.items():
+            self.add(situation, scenario, axe, difficulty, instruction, total)
+            for start in range(0, total, per_request):
+                jobs.append({
+                    "situation": situation,
+                    "scenario": scenario,
+                    "axe": axe,
+                    "difficulty": difficulty,
+                    "instruction": instruction,
+                    "count": min(per_request, total - start),
+                })
+        return jobs
+
+    def stats(self):
+        """
+        Returns the number of cells, the cells at quota and the questions still missing.
+        """
+        with self._lock:
+            values = [self._counts[(*combination, instruction)]
+                      for combination in self.combinations for instruction in self.instructions]
+        return {
+            "cells": len(values),
+            "filled": sum(value >= self.quota for value in values),
+            "missing": sum(math.ceil(max(0.0, self.quota - value)) for value in values),
+        }
@@ -0,0 +1,919 @@
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import time
+
+from pydantic import ValidationError
+
+from formation import Formation
+from bank_mirror import SHEET_RANGE
+from cascade import record_attempt, route_models
+from coverage import CoverageScheduler
+from formation_index import FormationIndex
+from geometry import MIN_LAYOUT_SCORE, repair_positions
+from image_cache import image_key
+from metrics import count, observe, record_usage, register_gauge, span
+from parsing import json_schema_format, parse_output, parse_repaired, parse_stats, strip_json_comments
+from pregeneration import PregenerationPool
+from prompts import (QUESTION_INSTRUCTIONS, as_prompt, build_batch_question_prompt, build_positions_prompt,
+                     build_question_prompt, build_repair_prompt, chat_messages, prompt_tokens, scenario_context)
+from presets import (DIFFICULTIES, SITUATIONS, defensive_axes, defensive_scenarios, offensive_axes, offensive_scenarios,
+                     other_scenarios)
+from question_index import QuestionIndex
+from rate_limiter import current_session
+from resilience import CircuitOpenError, call_with_retries, call_with_retries_async, retryable_openai_errors
+from resources import (cached_resource, call_openai, call_openai_async, call_sheet, get_bank_mirror, get_image_cache,
+                       get_inflight_requests, get_openai_breaker, get_openai_latencies, get_rate_limiter,
+                       get_response_cache, get_sheet_writer, run_async)
+from response_cache import make_cache_key
+from schemas import Positions, Question
+from sheet_writer import WriteResult
+from stream_parser import MalformedStreamError, StreamingQuestionParser
+from text_features import normalize_text
+
+# Question and positions generation, rendering and persistence, usable without
+# Streamlit: app.py is a client of this module, and so is cli.py for batch runs.
+# Matplotlib, mplsoccer, scipy and the API client libraries are only imported
+# when first needed, so importing the engine stays cheap.
+
+SPREADSHEET_NAME = "Matchango Quiz Bank of Questions"
+
+# Deadline of each OpenAI attempt in seconds, attempts per call, and OPENAI_HEDGING=0
+# to disable hedged duplicate requests
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_ATTEMPTS = int(os.getenv("OPENAI_ATTEMPTS", "3"))
+OPENAI_HEDGING = os.getenv("OPENAI_HEDGING", "1") != "0"
+
+
+def add_to_google_sheet(spreadsheet_name, values, timeout=60):
+    """
+    Queues a row on the shared sheet writer and waits for it to be written.
+
+    Returns:
+        WriteResult: `ok` tells whether the row was saved, `error` why not. A row still
+            queued after `timeout` seconds is saved with `pending` set: the writer keeps
+            it until the sheet accepts it, so it must not be submitted again.
+    """
+    future = get_sheet_writer(spreadsheet_name).submit(values, urgent=True)
+    try:
+        with span("sheet_write_wait"):
+            return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        return WriteResult(True, None, pending=True)
+
+
+def wait_for_sheet_writes(futures, timeout=60):
+    """
+    Waits up to `timeout` seconds for rows queued on the sheet writer.
+
+    Returns:
+        tuple: (WriteResults of the rows the sheet rejected, number of rows still queued).
+    """
+    with span("sheet_write_wait"):
+        done, pending = concurrent.futures.wait(futures, timeout)
+    return [future.result() for future in done if not future.result().ok], len(pending)
+
+
+def build_sheet_row(situation, scenario, axe, use_ai_positions, generated_output, positions, difficulty="",
+                    instruction=""):
+    """
+    Builds the Google Sheets row for a question and its positions, given as a Formation
+    or as the "coordinates" dict. The difficulty and question specific instruction
+    are recorded for the coverage of the bank, see `get_coverage_scheduler`.
+    """
+    return [
+        situation,  # Selected situation
+        scenario,  # Selected scenario
+        axe,  # Selected axis
+        use_ai_positions,  # Use AI Positions (Yes/No)
+        generated_output["question"],  # Generated question
+        *[answer["text"] for answer in generated_output["answers"]],  # Answers
+        # Team positions, opponent positions, ball and main player
+        *Formation.coerce(positions).sheet_columns(),
+        difficulty,  # Selected difficulty
+        instruction,  # Question specific instruction
+    ]
+
+
+# Seconds during which the bank mirror is read without checking the sheet for new rows
+BANK_SYNC_INTERVAL = 60
+
+
+def sync_bank(spreadsheet_name, max_age=BANK_SYNC_INTERVAL):
+    """
+    Fetches the rows added to the sheet since the last sync into the local mirror.
+
+    Returns:
+        BankMirror: The mirror, left as it was if the sheet cannot be read.
+    """
+    mirror = get_bank_mirror(spreadsheet_name)
+
+    def read_rows(first):
+        return call_sheet(spreadsheet_name, lambda sheet: sheet.get_values(SHEET_RANGE.format(first=first)))
+
+    try:
+        with span("bank_sync"):
+            fetched = mirror.sync(read_rows, max_age)
+        count("bank_rows_fetched_total", fetched)
+    except Exception as e:
+        print("Could not sync the question bank:", str(e))
+    return mirror
+
+
+def read_bank_rows(spreadsheet_name):
+    """
+    Returns every row of the question bank from the local mirror, synced first.
+    """
+    return sync_bank(spreadsheet_name).rows()
+
+
+def measure_prompt(prompt, response_format=None):
+    """
+    Counts the tokens of a prompt locally, split into its static prefix and its
+    variable part, before it is sent.
+
+    Returns:
+        int: The tokens of the prompt.
+    """
+    prefix, variable = prompt_tokens(prompt, response_format)
+    count("prompt_tokens_local_total", prefix, prompt=prompt.name, part="prefix")
+    count("prompt_tokens_local_total", variable, prompt=prompt.name, part="variable")
+    return prefix + variable
+
+
+def settle_quota(limiter, reserved, usage):
+    # The answer budget is reserved up front; what the answer did not use goes back to the quota
+    if usage is not None:
+        limiter.refund(reserved - usage.total_tokens)
+
+
+def check_finish(finish_reason, prompt, max_tokens):
+    # Answers cut by their budget are counted, to tune MAX_TOKENS
+    if finish_reason == "length":
+        count("openai_truncated_total", prompt=prompt.name)
+        print(f"The {prompt.name} answer reached its budget of {max_tokens} tokens")
+
+
+def generate_text(prompt, model="gpt-4o", max_tokens=None, use_cache=True, response_format=None, hedge=True,
+                  accept=None):
+    """
+    Sends a prompt to the model and returns the text of its answer.
+
+    Args:
+        prompt (Prompt or str): The prompt, see the prompts module; a string is sent
+            as the user message after a generic system message.
+        model (str): The model name.
+        max_tokens (int): Maximum length of the answer, the budget of the prompt by default.
+        use_cache (bool): Reuse the answer to an identical earlier request. Disable it for
+            calls that need a fresh sample.
+        response_format (dict): Optional structured output format, see `json_schema_format`.
+        hedge (bool): Allow a duplicate request when the call is slower than usual,
+            see `call_with_retries`. Disable it for bulk calls.
+        accept (callable): Optional check `accept(text)` an answer must pass to be
+            cached; a cached answer failing it is dropped and requested again.
+
+    Requests wait for the quota of the model, shared by every session, see
+    `get_rate_limiter`. Identical requests that may reuse an answer share the call
+    already in flight instead of sending their own.
+
+    Raises:
+        CircuitOpenError: The API is failing and calls are suspended.
+    """
+    prompt = as_prompt(prompt)
+    max_tokens = max_tokens or prompt.max_tokens
+    messages = chat_messages(prompt)
+    cache_key = make_cache_key(model, messages, max_tokens=max_tokens, response_format=response_format)
+    if use_cache:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            if accept is None or accept(cached):
+                return cached
+            get_response_cache().delete(cache_key)
+
+    def request():
+        limiter = get_rate_limiter(model)
+        reserved = measure_prompt(prompt, response_format) + max_tokens
+        with span("openai_call", model=model):
+            response = call_with_retries(
+                lambda timeout: call_openai(lambda client: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    timeout=timeout,
+                    **({"response_format": response_format} if response_format else {}),
+                )),
+                get_openai_breaker(), get_openai_latencies(model, prompt.name), OPENAI_ATTEMPTS, OPENAI_TIMEOUT,
+                hedge=hedge and OPENAI_HEDGING, limiter=limiter, tokens=reserved)
+        settle_quota(limiter, reserved, response.usage)
+        record_usage(response.usage, model, prompt.name)
+        check_finish(response.choices[0].finish_reason, prompt, max_tokens)
+
+        model_resp = response.choices[0].message.content.strip()
+        print(model_resp)
+        if accept is None or accept(model_resp):
+            get_response_cache().put(cache_key, model_resp)
+        return model_resp
+
+    # Callers that need a fresh sample do not share one
+    return get_inflight_requests().do(cache_key, request) if use_cache else request()
+
+
+async def generate_text_async(prompt, model="gpt-4o", max_tokens=None, use_cache=True, response_format=None,
+                              hedge=True, accept=None):
+    """
+    Same as `generate_text`, using the async OpenAI client on the shared event loop.
+    """
+    prompt = as_prompt(prompt)
+    max_tokens = max_tokens or prompt.max_tokens
+    messages = chat_messages(prompt)
+    cache_key = make_cache_key(model, messages, max_tokens=max_tokens, response_format=response_format)
+    if use_cache:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            if accept is None or accept(cached):
+                return cached
+            get_response_cache().delete(cache_key)
+
+    async def request():
+        limiter = get_rate_limiter(model)
+        reserved = measure_prompt(prompt, response_format) + max_tokens
+        with span("openai_call", model=model):
+            response = await call_with_retries_async(
+                lambda timeout: call_openai_async(lambda client: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    timeout=timeout,
+                    **({"response_format": response_format} if response_format else {}),
+                )),
+                get_openai_breaker(), get_openai_latencies(model, prompt.name), OPENAI_ATTEMPTS, OPENAI_TIMEOUT,
+                hedge=hedge and OPENAI_HEDGING, limiter=limiter, tokens=reserved)
+        settle_quota(limiter, reserved, response.usage)
+        record_usage(response.usage, model, prompt.name)
+        check_finish(response.choices[0].finish_reason, prompt, max_tokens)
+
+        model_resp = response.choices[0].message.content.strip()
+        print(model_resp)
+        if accept is None or accept(model_resp):
+            get_response_cache().put(cache_key, model_resp)
+        return model_resp
+
+    return await get_inflight_requests().do_async(cache_key, request) if use_cache else await request()
+
+
+def generate_structured(prompt, model_cls, prompt_name, use_cache=True, check=None, models=None):
+    """
+    Generates a payload with structured outputs and validates it against `model_cls`.
+
+    The models of the prompt's route are tried in order, see `route_models`: an
+    answer that fails validation or `check` is escalated to the next model. An
+    invalid answer of the last model is sent back to it with the validation error
+    in a short repair request, rather than regenerating it from the full prompt.
+
+    Args:
+        check (callable): Optional quality check `check(payload)` returning a reason
+            to reject the payload, or None to accept it.
+        models (tuple): Models to try instead of the route of the prompt.
+
+    Returns:
+        dict: The validated payload, or None if every model and the repair failed.
+    """
+    prompt = as_prompt(prompt)
+    response_format = json_schema_format(model_cls, prompt_name)
+    models = models or route_models(prompt.name)
+    parse, accept = structured_parser(model_cls, prompt_name, check)
+    for model in models:
+        start = time.perf_counter()
+        model_resp = generate_text(prompt, model=model, use_cache=use_cache, response_format=response_format,
+                                   accept=accept)
+        payload, error = parse(model_resp)
+        if payload is None and model == models[-1]:
+            print(f"Invalid {prompt_name} output, asking for a repair:", error)
+            repaired = generate_text(build_repair_prompt(prompt, model_resp, error), model=model,
+                                     response_format=response_format)
+            payload = parse_repaired(repaired, model_cls, prompt_name)
+        payload, error = checked(payload, error, check)
+        record_attempt(prompt.name, model, payload is not None, time.perf_counter() - start)
+        if payload is not None:
+            return payload
+        print(f"Rejected {prompt_name} output of {model}:", error)
+    return None
+
+
+async def generate_structured_async(prompt, model_cls, prompt_name, use_cache=True, check=None, models=None):
+    """
+    Async counterpart of `generate_structured`.
+    """
+    prompt = as_prompt(prompt)
+    response_format = json_schema_format(model_cls, prompt_name)
+    models = models or route_models(prompt.name)
+    parse, accept = structured_parser(model_cls, prompt_name, check)
+    for model in models:
+        start = time.perf_counter()
+        model_resp = await generate_text_async(prompt, model=model, use_cache=use_cache,
+                                               response_format=response_format, accept=accept)
+        payload, error = parse(model_resp)
+        if payload is None and model == models[-1]:
+            print(f"Invalid {prompt_name} output, asking for a repair:", error)
+            repaired = await generate_text_async(build_repair_prompt(prompt, model_resp, error), model=model,
+                                                 response_format=response_format)
+            payload = parse_repaired(repaired, model_cls, prompt_name)
+        payload, error = checked(payload, error, check)
+        record_attempt(prompt.name, model, payload is not None, time.perf_counter() - start)
+        if payload is not None:
+            return payload
+        print(f"Rejected {prompt_name} output of {model}:", error)
+    return None
+
+
+def structured_parser(model_cls, prompt_name, check):
+    """
+    Returns `parse(text)`, `parse_output` remembering its results, and `accept(text)`
+    telling whether an answer passes validation and `check`, so that only those
+    are cached. Each answer is parsed once.
+    """
+    results = {}
+
+    def parse(text):
+        if text not in results:
+            results[text] = parse_output(text, model_cls, prompt_name)
+        return results[text]
+
+    def accept(text):
+        return checked(*parse(text), check)[0] is not None
+
+    return parse, accept
+
+
+def checked(payload, error, check):
+    """
+    Applies the quality check of `generate_structured` to a validated payload.
+
+    Returns:
+        tuple: (payload, None) if it passes, otherwise (None, reason).
+    """
+    if payload is None or check is None:
+        return payload, error
+    reason = check(payload)
+    return (payload, None) if reason is None else (None, reason)
+
+
+def question_issue(question_json):
+    """
+    Quality check of a generated question beyond its schema: the answers must be
+    distinct and the question more than a few words.
+    """
+    if len(question_json["question"].split()) < 5:
+        return "the question is too short"
+    answers = {normalize_text(answer["text"]) for answer in question_json["answers"]}
+    if len(answers) < len(question_json["answers"]):
+        return "two answers are identical"
+    return None
+
+
+def positions_issue(positions_data):
+    """
+    Quality check of generated positions: the layout must be usable after the local repairs.
+    """
+    formation, score, issues = repair_positions(positions_data)
+    if formation is None or score < MIN_LAYOUT_SCORE:
+        return f"layout score {score:.2f} below {MIN_LAYOUT_SCORE}: {issues}"
+    return None
+
+
+def extract_json_from_generated(model_resp):
+    with span("extract_json"):
+        json_match = re.search(r'<JSON>(.*?)</JSON>', model_resp, re.DOTALL)
+
+        if json_match:
+            # Remove any `//` comments, leaving URLs inside strings intact
+            json_str = strip_json_comments(json_match.group(1).strip())
+
+            try:
+                quiz_data = json.loads(json_str)
+            except json.JSONDecodeError as e:
+                print(f"Error parsing JSON: {e}")
+                return None
+        else:
+            print("No JSON data found between <JSON> tags.")
+            return None
+        return quiz_data
+
+
+def generate_questions(situation, scenario, axe, random_instruction, difficulty, use_cache=False):
+    """
+    Generates a soccer quiz question based on the provided inputs.
+
+    Args:
+        situation (str): The game situation (e.g., "Offense", "Defense").
+        scenario (str): The specific scenario (e.g., "Attaque Positionnelle").
+        axe (str): The axis of evaluation (e.g., "Créativité").
+        use_cache (bool): Return the cached question for identical inputs instead of a new one.
+
+    Returns:
+        dict: Parsed JSON containing the generated question and answers.
+    """
+    prompt = build_question_prompt(situation, scenario, axe, random_instruction, difficulty)
+    # Generate and validate the response
+    question_json = generate_structured(prompt, Question, "question", use_cache=use_cache, check=question_issue)
+    print(random_instruction)
+    return question_json
+
+
+async def generate_questions_async(situation, scenario, axe, random_instruction, difficulty, use_cache=False):
+    """
+    Async counterpart of `generate_questions`.
+    """
+    prompt = build_question_prompt(situation, scenario, axe, random_instruction, difficulty)
+    return await generate_structured_async(prompt, Question, "question", use_cache=use_cache,
+                                           check=question_issue)
+
+
+def stream_questions(situation, scenario, axe, random_instruction, difficulty, use_cache=False, model=None,
+                     max_tokens=None):
+    """
+    Streams a question from the model, reporting its fields as soon as they are complete.
+
+    The first model of the question route is streamed, unless `model` is given; an
+    answer it gets wrong is escalated to the rest of the route without streaming.
+
+    Yields:
+        tuple: ("question", str) and ("answer", dict) as they arrive, then either
+            ("done", dict or None) with the parsed question, or ("malformed", str) if
+            the output was abandoned early because it could not be valid.
+    """
+    prompt = build_question_prompt(situation, scenario, axe, random_instruction, difficulty)
+    models = (model,) if model else route_models(prompt.name)
+    model = models[0]
+    max_tokens = max_tokens or prompt.max_tokens
+    messages = chat_messages(prompt)
+    response_format = json_schema_format(Question, "question")
+    cache_key = make_cache_key(model, messages, max_tokens=max_tokens, response_format=response_format)
+    parse, accept = structured_parser(Question, "question", question_issue)
+
+    cached = get_response_cache().get(cache_key) if use_cache else None
+    if cached is not None:
+        try:
+            events = list(StreamingQuestionParser().feed(cached)) if accept(cached) else None
+        except MalformedStreamError:
+            events = None
+        if events is not None:
+            yield from events
+            yield "done", parse(cached)[0]
+            return
+        # Cached before answers were checked: dropped, and requested again below
+        get_response_cache().delete(cache_key)
+
+    parser = StreamingQuestionParser()
+
+    limiter = get_rate_limiter(model)
+    reserved = measure_prompt(prompt, response_format) + max_tokens
+    start = time.perf_counter()
+    # Only opening the stream is retried; a duplicate stream would be billed in full
+    stream = call_with_retries(
+        lambda timeout: call_openai(lambda client: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            response_format=response_format,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+        )),
+        get_openai_breaker(), get_openai_latencies(model, prompt.name), OPENAI_ATTEMPTS, OPENAI_TIMEOUT, hedge=False,
+        limiter=limiter, tokens=reserved)
+    parts = []
+    try:
+        for chunk in stream:
+            # The usage comes in a last chunk without choices
+            record_usage(chunk.usage, model, prompt.name)
+            settle_quota(limiter, reserved, chunk.usage)
+            if not chunk.choices:
+                continue
+            check_finish(chunk.choices[0].finish_reason, prompt, max_tokens)
+            delta = chunk.choices[0].delta.content or ""
+            if not parts:
+                observe("stream_first_token_seconds", time.perf_counter() - start, model=model)
+            parts.append(delta)
+            yield from parser.feed(delta)
+    except MalformedStreamError as e:
+        # Stop paying for tokens we cannot use
+        stream.close()
+        print("Aborted malformed stream:", str(e))
+        record_attempt(prompt.name, model, False, time.perf_counter() - start)
+        yield "malformed", str(e)
+        return
+    observe("stage_seconds", time.perf_counter() - start, stage="openai_stream", model=model)
+
+    model_resp = "".join(parts).strip()
+    print(model_resp)
+    if accept(model_resp):
+        get_response_cache().put(cache_key, model_resp)
+    question_json, error = parse(model_resp)
+    if question_json is None and len(models) == 1:
+        print("Invalid question output, asking for a repair:", error)
+        repaired = generate_text(build_repair_prompt(prompt, model_resp, error), model=model,
+                                 response_format=response_format)
+        question_json = parse_repaired(repaired, Question, "question")
+    question_json, error = checked(question_json, error, question_issue)
+    record_attempt(prompt.name, model, question_json is not None, time.perf_counter() - start)
+    if question_json is None and len(models) > 1:
+        print(f"Rejected question output of {model}:", error)
+        question_json = generate_structured(prompt, Question, "question", use_cache=use_cache,
+                                            check=question_issue, models=models[1:])
+    yield "done", question_json
+
+
+def generate_positions(question_context, use_cache=True):
+    """
+    Generates player positions based on the provided question context.
+
+    Args:
+        question_context (str): The context of the question (e.g., "How should players position themselves?").
+        use_cache (bool): Reuse the positions generated earlier for the same question.
+
+    Returns:
+        dict: Parsed JSON containing the generated player positions, or None if they
+            could not be generated, e.g. while the API is failing.
+    """
+    prompt = build_positions_prompt(f"Question: {question_context}")
+    # Generate and validate the response
+    try:
+        return generate_structured(prompt, Positions, "positions", use_cache=use_cache, check=positions_issue)
+    except (CircuitOpenError, *retryable_openai_errors()) as e:
+        # The callers fall back to the scenario preset
+        print("Positions not generated:", str(e))
+        return None
+
+
+async def generate_positions_async(context):
+    """
+    Async counterpart of `generate_positions`, taking an already formatted context.
+    """
+    try:
+        return await generate_structured_async(build_positions_prompt(context), Positions, "positions",
+                                               check=positions_issue)
+    except (CircuitOpenError, *retryable_openai_errors()) as e:
+        print("Positions not generated:", str(e))
+        return None
+
+
+def openai_retry_in():
+    """
+    Returns the seconds before OpenAI calls resume while the API is failing, or None if it is available.
+    """
+    return get_openai_breaker().retry_in()
+
+
+def validate_question(question_json):
+    """
+    Checks that a parsed question has a text and four answers scored 1 to 4.
+    """
+    try:
+        Question.model_validate(question_json)
+    except ValidationError:
+        return False
+    return True
+
+
+# Scenario and axe menus of each situation of the batch generation
+BATCH_MENUS = {
+    "Offense": (offensive_scenarios, offensive_axes),
+    "Defense": (defensive_scenarios, defensive_axes),
+}
+
+
+def question_matrix(situations, scenarios, axes, difficulties):
+    """
+    Expands the selected inputs into (situation, scenario, axe, difficulty) combinations,
+    keeping only the scenarios and axes that belong to each situation.
+    """
+    combinations = []
+    for situation in situations:
+        situation_scenarios, situation_axes = BATCH_MENUS[situation]
+        for scenario, axe, difficulty in itertools.product(scenarios, axes, difficulties):
+            if situation_scenarios.get(scenario) is not None and axe in situation_axes and axe != "Select Axe":
+                combinations.append((situation, scenario, axe, difficulty))
+    return combinations
+
+
+def plan_batch_jobs(combinations, questions_per_combination, per_request):
+    """
+    Splits the requested questions into model calls of at most `per_request` questions,
+    rotating the question specific instructions evenly across calls.
+    """
+    instructions = itertools.cycle(random.sample(QUESTION_INSTRUCTIONS, len(QUESTION_INSTRUCTIONS)))
+    jobs = []
+    for situation, scenario, axe, difficulty in combinations:
+        remaining = questions_per_combination
+        while remaining > 0:
+            count = min(per_request, remaining)
+            jobs.append({
+                "situation": situation,
+                "scenario": scenario,
+                "axe": axe,
+                "difficulty": difficulty,
+                "instruction": next(instructions),
+                "count": count,
+            })
+            remaining -= count
+    return jobs
+
+
+async def request_question_chunk(prompt, model, semaphore):
+    """
+    Sends a batch prompt to `model`; transient API errors are retried by `generate_text_async`.
+
+    Returns:
+        list: The questions of the response that pass `validate_question` and `question_issue`.
+    """
+    async with semaphore:
+        raw = await generate_text_async(prompt, model=model, use_cache=False, hedge=False)
+    parsed = extract_json_from_generated(raw)
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    return [question for question in parsed or []
+            if validate_question(question) and question_issue(question) is None]
+
+
+async def generate_question_chunk(job, semaphore):
+    """
+    Generates the questions of one batch job along the batch route: the questions
+    missing from a model's answer are asked again from the next model.
+
+    Returns:
+        list: The valid questions, at most `job["count"]`.
+    """
+    questions = []
+    for model in route_models("batch_question"):
+        missing = job["count"] - len(questions)
+        prompt = build_batch_question_prompt(job["situation"], job["scenario"], job["axe"], job["instruction"],
+                                             job["difficulty"], missing)
+        start = time.perf_counter()
+        questions += (await request_question_chunk(prompt, model, semaphore))[:missing]
+        record_attempt(prompt.name, model, len(questions) == job["count"], time.perf_counter() - start)
+        if len(questions) == job["count"]:
+            break
+    return questions
+
+
+async def run_question_batch(jobs, workers, results):
+    """
+    Runs the batch jobs with at most `workers` requests in flight and puts each
+    result on the `results` queue as soon as its request completes, followed by None.
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(job):
+        meta = {key: job[key] for key in ("situation", "scenario", "axe", "difficulty", "instruction")}
+        try:
+            questions = await generate_question_chunk(job, semaphore)
+        except Exception as e:
+            results.put({**meta, "error": str(e), "missing": job["count"]})
+            return
+        if len(questions) < job["count"]:
+            missing = job["count"] - len(questions)
+            results.put({**meta, "error": f"{missing} invalid or missing question(s)", "missing": missing})
+        for question in questions:
+            results.put({**meta, "output": question})
+
+    try:
+        await asyncio.gather(*(run(job) for job in jobs))
+    finally:
+        results.put(None)
+
+
+def iter_question_batch(combinations, questions_per_combination=1, per_request=5, workers=4):
+    """
+    Generates questions for every combination and yields them as they complete.
+
+    Args:
+        combinations (list): (situation, scenario, axe, difficulty) tuples, see `question_matrix`.
+        questions_per_combination (int): Number of questions wanted for each combination.
+        per_request (int): Maximum number of questions asked in a single model call.
+        workers (int): Maximum number of concurrent model calls.
+
+    Yields:
+        dict: The combination fields and either the validated question under "output"
+            or an "error" message.
+    """
+    return iter_batch_jobs(plan_batch_jobs(combinations, questions_per_combination, per_request), workers)
+
+
+def iter_batch_jobs(jobs, workers=4):
+    """
+    Runs batch jobs, as planned by `plan_batch_jobs` or `CoverageScheduler.plan`, and
+    yields their results as they complete, like `iter_question_batch`. Error results
+    also tell the number of questions they are "missing".
+    """
+    results = queue.Queue()
+    future = run_async(run_question_batch(jobs, workers, results))
+    try:
+        while (result := results.get()) is not None:
+            yield result
+        future.result()
+    finally:
+        future.cancel()
+
+
+def start_pipelined_generation(situation, scenario, axe, random_instruction, difficulty, use_cache=False):
+    """
+    Starts question and position generation concurrently on the shared event loop.
+
+    The positions are derived from the quiz inputs instead of the question text, so
+    both requests can be in flight at the same time and the user waits for the
+    slower of the two rather than their sum.
+
+    Returns:
+        tuple: (question_future, positions_future), both concurrent.futures.Future.
+    """
+    question_future = run_async(generate_questions_async(situation, scenario, axe, random_instruction, difficulty,
+                                                         use_cache))
+    positions_future = run_async(generate_positions_async(scenario_context(situation, scenario, axe, difficulty)))
+    return question_future, positions_future
+
+
+def positions_agree(positions_data, situation, max_ball_distance=10):
+    """
+    Cheap local check that positions generated without the question still fit it.
+
+    Args:
+        positions_data (dict): Parsed positions JSON with a "coordinates" key.
+        situation (str): "Offense" or "Defense"; the main player is expected in the
+            attacking or defending part of the pitch respectively.
+        max_ball_distance (float): Maximum distance between the ball and the main player.
+
+    Returns:
+        bool: False when the layout contradicts the quiz and should be reconciled.
+    """
+    coordinates = (positions_data or {}).get("coordinates") or {}
+    main_player = coordinates.get("main_player")
+    ball = coordinates.get("ball")
+    team_positions = [player.get("position") for player in coordinates.get("team_players", [])]
+    if not main_player or not ball or main_player not in team_positions:
+        return False
+    if ((ball[0] - main_player[0]) ** 2 + (ball[1] - main_player[1]) ** 2) ** 0.5 > max_ball_distance:
+        return False
+    if situation == "Offense" and main_player[0] < 40:
+        return False
+    if situation == "Defense" and main_player[0] > 80:
+        return False
+    return True
+
+
+# Confidence above which validated positions are reused instead of asking the model
+FORMATION_MATCH_THRESHOLD = 0.8
+
+
+@cached_resource
+def get_formation_index(spreadsheet_name):
+    """
+    Returns the shared index of the AI positions already validated into the sheet.
+
+    The sheet is read once per process; positions validated afterwards are added
+    to the index as they are shared.
+    """
+    index = FormationIndex(SITUATIONS,
+                           list(offensive_scenarios) + list(defensive_scenarios) + other_scenarios,
+                           offensive_axes + defensive_axes)
+    # Rows without AI positions hold the scenario presets
+    for formation, situation, scenario, axe, question in sync_bank(spreadsheet_name).formations(use_ai=True):
+        index.add(formation, situation, scenario, axe, question)
+    print(f"Formation index: {len(index)} validated layouts")
+    return index
+
+
+# New questions are regenerated this many times at most when they duplicate the bank
+MAX_DUPLICATE_RETRIES = 2
+
+
+@cached_resource
+def get_question_index(spreadsheet_name):
+    """
+    Returns the shared near-duplicate index of the questions in the bank, updated
+    as new questions are validated.
+    """
+    index = QuestionIndex()
+    for question in sync_bank(spreadsheet_name).questions():
+        index.add(question)
+    print(f"Question index: {len(index)} questions")
+    return index
+
+
+# Questions wanted per (situation, scenario, axe, difficulty, instruction) cell of the bank
+COVERAGE_QUOTA = int(os.getenv("COVERAGE_QUOTA", "1"))
+
+
+def coverage_combinations():
+    """
+    Returns every (situation, scenario, axe, difficulty) combination the bank should cover.
+    """
+    return question_matrix(["Offense", "Defense"], list(offensive_scenarios) + list(defensive_scenarios),
+                           offensive_axes + defensive_axes, DIFFICULTIES)
+
+
+@cached_resource
+def get_coverage_scheduler(spreadsheet_name, quota=COVERAGE_QUOTA):
+    """
+    Returns the shared coverage scheduler of the bank, counting the questions
+    already in the sheet. Questions validated or planned afterwards are added to
+    it as they are.
+    """
+    scheduler = CoverageScheduler(coverage_combinations(), QUESTION_INSTRUCTIONS, quota)
+    for situation, scenario, axe, difficulty, instruction in sync_bank(spreadsheet_name).cells():
+        scheduler.add(situation, scenario, axe, difficulty, instruction)
+    stats = scheduler.stats()
+    print(f"Coverage: {stats['filled']}/{stats['cells']} cells at quota, {stats['missing']} questions missing")
+    return scheduler
+
+
+async def pregenerate_bundle(key, question_index, formation_index, scheduler):
+    """
+    Generates a question and, if asked for, its positions for the pre-generation pool.
+
+    Args:
+        key (tuple): (situation, scenario, axe, difficulty, use_ai_positions).
+
+    Returns:
+        dict: {"generated_output": ..., "generated_positions": ..., "instruction": ...},
+            or None if the question duplicates the bank or no usable positions were generated.
+    """
+    situation, scenario, axe, difficulty, use_ai_positions = key
+    # The least covered instruction of the combination, so the pool also fills the gaps of the bank
+    instruction = scheduler.next_instruction(situation, scenario, axe, difficulty)
+    generated_output = await generate_questions_async(situation, scenario, axe, instruction, difficulty)
+    if not generated_output or question_index.find(generated_output["question"])[0] is not None:
+        return None
+    bundle = {"generated_output": generated_output, "generated_positions": None, "instruction": instruction}
+    if use_ai_positions == "Yes":
+        formation, confidence = formation_index.query(situation, scenario, axe, generated_output["question"])
+        if formation is None or confidence < FORMATION_MATCH_THRESHOLD:
+            formation, score, _ = repair_positions(
+                await generate_positions_async(f"Question: {generated_output['question']}"))
+            if formation is None or score < MIN_LAYOUT_SCORE:
+                return None
+        bundle["generated_positions"] = {"coordinates": formation.to_dict()}
+    return bundle
+
+
+@cached_resource
+def get_question_pool(spreadsheet_name):
+    """
+    Returns the process-wide pool of pre-generated questions, started on the shared event loop.
+    """
+    async def produce(key):
+        # Background generation queues for the rate limits as a session of its own
+        current_session.set("pregeneration")
+        # Building the indexes reads the whole bank, so it is kept off the event loop
+        question_index = await asyncio.to_thread(get_question_index, spreadsheet_name)
+        formation_index = await asyncio.to_thread(get_formation_index, spreadsheet_name)
+        scheduler = await asyncio.to_thread(get_coverage_scheduler, spreadsheet_name)
+        return await pregenerate_bundle(key, question_index, formation_index, scheduler)
+
+    pool = PregenerationPool(produce)
+    run_async(pool.run())
+    return pool
+
+
+@cached_resource
+def get_plotter(pitch_length=120, pitch_width=80):
+    """
+    Returns the shared plotter for a pitch size, keeping its rendered background.
+    Matplotlib and mplsoccer are imported on the first call.
+    """
+    from rendering import PlayerPositionPlotter
+
+    return PlayerPositionPlotter(pitch_length=pitch_length, pitch_width=pitch_width)
+
+
+def render_png(positions):
+    """
+    Returns the PNG image of a positions payload or Formation, from the image cache when possible.
+    """
+    formation = Formation.coerce(positions)
+    plotter = get_plotter()
+    with span("render_png") as labels:
+        labels["cache"] = "hit"
+
+        def render():
+            labels["cache"] = "miss"
+            return plotter.render_png(formation)
+
+        return get_image_cache().get_or_render(image_key(formation, plotter.signature), render)
+
+
+def image_cache_hit_rate():
+    stats = get_image_cache().stats()
+    return stats["hits"] / max(1, stats["hits"] + stats["misses"])
+
+
+# Cache and parsing health, read when the metrics are exported
+register_gauge("response_cache_hit_rate", lambda: get_response_cache().stats()["hit_rate"])
+register_gauge("image_cache_hit_rate", image_cache_hit_rate)
+register_gauge("parse_failure_rate", lambda: {
+    (("prompt", prompt_name),): counts["failure_rate"] for prompt_name, counts in parse_stats().items()})
@@ -0,0 +1,226 @@
+import json
+import re
+import struct
+
+import numpy as np
+
+PLAYERS_PER_TEAM = 5
+
+# Binary layout: main player index, then team, opponents and ball as little-endian float32
+_HEADER = struct.Struct("<b")
+_BINARY_SIZE = _HEADER.size + (2 * PLAYERS_PER_TEAM + 1) * 2 * 4
+
+# Numbers in a Google Sheets cell, see Formation.from_sheet_columns
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _plain(values):
+    """
+    Converts an array to nested lists, keeping whole numbers as ints ([5, 40] rather
+    than [5.0, 40.0]) so serialized positions look like the ones written by hand.
+    """
+    return [_plain(value) for value in values] if np.ndim(values) > 1 else [
+        int(value) if float(value).is_integer() else float(value) for value in values
+    ]
+
+
+class Formation:
+    """
+    Positions of both teams and the ball, stored as fixed-shape NumPy arrays.
+
+    Attributes:
+        team (np.ndarray): (5, 2) [x, y] positions of the main player's team.
+        opponents (np.ndarray): (5, 2) [x, y] positions of the opponents.
+        main_index (int): Row of `team` holding the main player, -1 if none.
+        ball (np.ndarray): (2,) [x, y] position of the ball, NaN if unknown.
+    """
+
+    __slots__ = ("team", "opponents", "main_index", "ball")
+
+    def __init__(self, team, opponents, main_index=-1, ball=None):
+        self.team = np.asarray(team, dtype=float).reshape(PLAYERS_PER_TEAM, 2)
+        self.opponents = np.asarray(opponents, dtype=float).reshape(PLAYERS_PER_TEAM, 2)
+        self.main_index = int(main_index)
+        self.ball = np.full(2, np.nan) if ball is None else np.asarray(ball, dtype=float).reshape(2)
+
+    @classmethod
+    def from_dict(cls, payload, main_tolerance=0.0):
+        """
+        Builds a formation from the nested dict used by the prompts and presets.
+
+        Args:
+            payload (dict): {"team_players": [{"position": [x, y]}, ...], "opponent_players": [...],
+                "main_player": [x, y], "ball": [x, y]}, optionally wrapped in {"coordinates": ...}.
+            main_tolerance (float): Maximum distance between "main_player" and the team player
+                it designates. The default requires an exact match.
+
+        Raises:
+            ValueError: If a team does not have exactly 5 [x, y] positions.
+        """
+        coordinates = payload.get("coordinates", payload)
+        try:
+            team = np.array([player["position"] for player in coordinates["team_players"]], dtype=float)
+            opponents = np.array([player["position"] for player in coordinates["opponent_players"]], dtype=float)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid player positions: {e}")
+        for name, positions in (("team_players", team), ("opponent_players", opponents)):
+            if positions.shape != (PLAYERS_PER_TEAM, 2):
+                raise ValueError(f"Expected {PLAYERS_PER_TEAM} [x, y] positions in {name}, got shape {positions.shape}")
+
+        main_index = -1
+        main_player = coordinates.get("main_player")
+        if isinstance(main_player, (list, tuple)) and len(main_player) == 2:
+            distances = np.linalg.norm(team - np.asarray(main_player, dtype=float), axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= main_tolerance:
+                main_index = nearest
+
+        ball = coordinates.get("ball")
+        if not (isinstance(ball, (list, tuple)) and len(ball) == 2):
+            ball = None
+        return cls(team, opponents, main_index, ball)
+
+    @classmethod
+    def coerce(cls, value):
+        """
+        Returns `value` if it is already a Formation, otherwise parses it with `from_dict`.
+        """
+        return value if isinstance(value, cls) else cls.from_dict(value)
+
+    @property
+    def main_player(self):
+        return self.team[self.main_index] if self.main_index >= 0 else None
+
+    @property
+    def has_ball(self):
+        return not np.isnan(self.ball).any()
+
+    @property
+    def points(self):
+        """
+        (10, 2) view of all players, team first.
+        """
+        return np.concatenate([self.team, self.opponents])
+
+    def copy(self):
+        return Formation(self.team.copy(), self.opponents.copy(), self.main_index, self.ball.copy())
+
+    def in_bounds(self, pitch_length=120, pitch_width=80):
+        """
+        Returns a (10,) boolean mask of the players inside the pitch, team first.
+        """
+        points = self.points
+        return (points[:, 0] >= 0) & (points[:, 0] <= pitch_length) & (points[:, 1] >= 0) & (points[:, 1] <= pitch_width)
+
+    def mirrored(self, pitch_length=120, pitch_width=80, horizontal=True, vertical=False):
+        """
+        Returns the formation flipped across the halfway line and/or the long axis.
+        """
+        scale = np.array([-1.0 if horizontal else 1.0, -1.0 if vertical else 1.0])
+        offset = np.array([pitch_length if horizontal else 0.0, pitch_width if vertical else 0.0])
+        return Formation(self.team * scale + offset, self.opponents * scale + offset, self.main_index,
+                         self.ball * scale + offset)
+
+    def translated(self, dx, dy):
+        shift = np.array([dx, dy], dtype=float)
+        return Formation(self.team + shift, self.opponents + shift, self.main_index, self.ball + shift)
+
+    def clipped(self, pitch_length=120, pitch_width=80):
+        """
+        Returns the formation with every position clamped to the pitch.
+        """
+        upper = np.array([pitch_length, pitch_width], dtype=float)
+        return Formation(np.clip(self.team, 0, upper), np.clip(self.opponents, 0, upper), self.main_index,
+                         np.clip(self.ball, 0, upper))
+
+    def to_dict(self):
+        """
+        Returns the nested dict format used by the prompts, presets and downloads.
+        """
+        main_player = self.main_player
+        return {
+            "team_players": [{"position": position} for position in _plain(self.team)],
+            "opponent_players": [{"position": position} for position in _plain(self.opponents)],
+            "main_player": _plain(main_player) if main_player is not None else None,
+            "ball": _plain(self.ball) if self.has_ball else None,
+        }
+
+    def to_json(self):
+        """
+        Compact JSON: {"t": team, "o": opponents, "m": main index, "b": ball}.
+        """
+        return json.dumps({
+            "t": _plain(self.team),
+            "o": _plain(self.opponents),
+            "m": self.main_index,
+            "b": _plain(self.ball) if self.has_ball else None,
+        }, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data):
+        payload = json.loads(data)
+        return cls(payload["t"], payload["o"], payload["m"], payload["b"])
+
+    def to_bytes(self):
+        """
+        Packs the formation into 89 bytes.
+        """
+        values = np.concatenate([self.team.ravel(), self.opponents.ravel(), self.ball]).astype("<f4")
+        return _HEADER.pack(self.main_index) + values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) != _BINARY_SIZE:
+            raise ValueError(f"Expected {_BINARY_SIZE} bytes, got {len(data)}")
+        (main_index,) = _HEADER.unpack_from(data)
+        values = np.frombuffer(data, dtype="<f4", offset=_HEADER.size).astype(float)
+        count = PLAYERS_PER_TEAM * 2
+        ball = values[2 * count:]
+        return cls(values[:count], values[count:2 * count], main_index, None if np.isnan(ball).any() else ball)
+
+    def sheet_columns(self):
+        """
+        Returns the team, opponents, ball and main player cells of a Google Sheets row.
+        """
+        main_player = self.main_player
+        return [
+            "; ".join(json.dumps(position) for position in _plain(self.team)),
+            "; ".join(json.dumps(position) for position in _plain(self.opponents)),
+            json.dumps(_plain(self.ball) if self.has_ball else {}),
+            json.dumps(_plain(main_player)) if main_player is not None else "N/A",
+        ]
+
+    @classmethod
+    def from_sheet_columns(cls, team, opponents, ball="{}", main_player="N/A"):
+        """
+        Inverse of `sheet_columns`. Cells are read loosely, as numbers in order, so rows
+        written by older versions of the app are accepted too.
+
+        Raises:
+            ValueError: If a team cell does not hold 5 [x, y] positions.
+        """
+        def numbers(cell):
+            return [float(value) for value in _NUMBER.findall(str(cell or ""))]
+
+        team, opponents = numbers(team), numbers(opponents)
+        for name, values in (("team", team), ("opponents", opponents)):
+            if len(values) != PLAYERS_PER_TEAM * 2:
+                raise ValueError(f"Expected {PLAYERS_PER_TEAM} [x, y] positions in the {name} cell, "
+                                 f"got {len(values)} numbers")
+        ball, main_player = numbers(ball), numbers(main_player)
+        return cls.from_dict({
+            "team_players": [{"position": position} for position in np.reshape(team, (-1, 2)).tolist()],
+            "opponent_players": [{"position": position} for position in np.reshape(opponents, (-1, 2)).tolist()],
+            "main_player": main_player if len(main_player) == 2 else None,
+            "ball": ball if len(ball) == 2 else None,
+        })
+
+    def __eq__(self, other):
+        if not isinstance(other, Formation):
+            return NotImplemented
+        return (self.main_index == other.main_index and np.array_equal(self.team, other.team)
+                and np.array_equal(self.opponents, other.opponents)
+                and np.array_equal(self.ball, other.ball, equal_nan=True))
+
+    def __repr__(self):
+        return f"Formation({self.to_json()})"
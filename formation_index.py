@@ -0,0 +1,104 @@
+import threading
+
+import numpy as np
+
+from text_features import hashed_vector
+
+# Weights of each block of the retrieval vector. The scenario and situation matter
+# most; the question text only breaks ties between layouts of the same scenario.
+SITUATION_WEIGHT = 1.0
+SCENARIO_WEIGHT = 1.0
+AXE_WEIGHT = 0.5
+TEXT_WEIGHT = 0.5
+TEXT_DIMS = 64
+
+
+class FormationIndex:
+    """
+    Nearest-neighbour index of validated formations.
+
+    Each formation is stored under a vector made of one-hot situation, scenario and
+    axis blocks and a hashed bag-of-words of its question. Queries return the stored
+    formation closest to a new question with a confidence between 0 and 1, so the
+    caller only asks the model for positions when nothing close enough exists.
+    Near-identical formations of the same scenario are stored once.
+    """
+
+    def __init__(self, situations, scenarios, axes, pitch_length=120, pitch_width=80, duplicate_distance=0.02):
+        """
+        Args:
+            situations (list): Known situation names.
+            scenarios (list): Known scenario names.
+            axes (list): Known axis names.
+            duplicate_distance (float): Distance between normalized coordinate vectors
+                under which a formation is considered already indexed.
+        """
+        self._vocabularies = [
+            ({name: i for i, name in enumerate(dict.fromkeys(situations))}, SITUATION_WEIGHT),
+            ({name: i for i, name in enumerate(dict.fromkeys(scenarios))}, SCENARIO_WEIGHT),
+            ({name: i for i, name in enumerate(dict.fromkeys(axes))}, AXE_WEIGHT),
+        ]
+        self._scale = np.array([pitch_length, pitch_width], dtype=float)
+        self.duplicate_distance = duplicate_distance
+        # Distance between two vectors sharing nothing, used to turn distances into confidences
+        self._max_distance = np.sqrt(2 * (SITUATION_WEIGHT ** 2 + SCENARIO_WEIGHT ** 2 + AXE_WEIGHT ** 2
+                                          + TEXT_WEIGHT ** 2))
+        self._lock = threading.Lock()
+        self._formations = []
+        self._keys = []
+        self._shapes = {}  # scenario -> list of (normalized coordinates, formation index)
+        self._tree = None
+
+    def __len__(self):
+        return len(self._formations)
+
+    def _key(self, situation, scenario, axe, text):
+        blocks = []
+        for (vocabulary, weight), value in zip(self._vocabularies, (situation, scenario, axe)):
+            block = np.zeros(len(vocabulary))
+            if value in vocabulary:
+                block[vocabulary[value]] = weight
+            blocks.append(block)
+        blocks.append(TEXT_WEIGHT * hashed_vector(text or "", TEXT_DIMS))
+        return np.concatenate(blocks)
+
+    def _shape(self, formation):
+        return np.concatenate([(formation.points / self._scale).ravel(),
+                               formation.ball / self._scale if formation.has_ball else np.zeros(2)])
+
+    def add(self, formation, situation, scenario, axe, question=""):
+        """
+        Indexes a validated formation.
+
+        Returns:
+            bool: False if an almost identical formation of the scenario was already indexed.
+        """
+        shape = self._shape(formation)
+        with self._lock:
+            for other_shape, _ in self._shapes.get(scenario, []):
+                if np.linalg.norm(shape - other_shape) < self.duplicate_distance * np.sqrt(len(shape)):
+                    return False
+            self._shapes.setdefault(scenario, []).append((shape, len(self._formations)))
+            self._formations.append(formation)
+            self._keys.append(self._key(situation, scenario, axe, question))
+            self._tree = None
+        return True
+
+    def query(self, situation, scenario, axe, question=""):
+        """
+        Finds the indexed formation that best fits a question.
+
+        Returns:
+            tuple: (formation, confidence), or (None, 0.0) if the index is empty.
+        """
+        with self._lock:
+            if not self._formations:
+                return None, 0.0
+            if self._tree is None:
+                from scipy.spatial import cKDTree
+
+                # Rebuilt lazily, so a burst of additions costs a single rebuild
+                self._tree = cKDTree(np.array(self._keys))
+            distance, position = self._tree.query(self._key(situation, scenario, axe, question))
+            formation = self._formations[position]
+        return formation.copy(), max(0.0, float(1.0 - distance / self._max_distance))
@@ -0,0 +1,167 @@
+import numpy as np
+
+from formation import Formation
+
+# Penalty area of a 120 x 80 pitch: 18 deep and 44 wide, centred on the goal
+PENALTY_AREA_DEPTH = 18
+PENALTY_AREA_WIDTH = 44
+
+# How much each kind of problem lowers the quality score of a layout
+PENALTIES = {
+    "out_of_bounds": 0.05,  # per player
+    "too_close": 0.05,  # per pair of players
+    "keeper_off_goal": 0.15,  # per team
+    "ball_far": 0.1,
+    "main_player_missing": 0.2,
+}
+
+# Below this score a layout is considered broken and worth regenerating
+MIN_LAYOUT_SCORE = 0.5
+
+
+def defends_left(formation):
+    """
+    Returns True when the main player's team defends the left goal (x = 0), i.e.
+    when it stands on average closer to it than the opponents.
+    """
+    return formation.team[:, 0].mean() <= formation.opponents[:, 0].mean()
+
+
+def keeper_indices(formation, pitch_length=120, pitch_width=80):
+    """
+    Returns the row of the player closest to its own goal in each team.
+    """
+    left = defends_left(formation)
+    team_goal = np.array([0 if left else pitch_length, pitch_width / 2])
+    opponent_goal = np.array([pitch_length if left else 0, pitch_width / 2])
+    team_keeper = int(np.argmin(np.linalg.norm(formation.team - team_goal, axis=1)))
+    opponent_keeper = int(np.argmin(np.linalg.norm(formation.opponents - opponent_goal, axis=1)))
+    return team_keeper, opponent_keeper
+
+
+def _penalty_area(left, pitch_length, pitch_width):
+    x_range = (0, PENALTY_AREA_DEPTH) if left else (pitch_length - PENALTY_AREA_DEPTH, pitch_length)
+    y_range = ((pitch_width - PENALTY_AREA_WIDTH) / 2, (pitch_width + PENALTY_AREA_WIDTH) / 2)
+    return np.array([x_range[0], y_range[0]]), np.array([x_range[1], y_range[1]])
+
+
+def check_formation(formation, pitch_length=120, pitch_width=80, min_spacing=3.0, max_ball_distance=5.0):
+    """
+    Lists the geometric problems of a formation.
+
+    Returns:
+        dict: Problem name -> count, only for the problems found.
+    """
+    issues = {}
+    out_of_bounds = int((~formation.in_bounds(pitch_length, pitch_width)).sum())
+    if out_of_bounds:
+        issues["out_of_bounds"] = out_of_bounds
+
+    points = formation.points
+    distances = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+    too_close = int(np.triu(distances < min_spacing, k=1).sum())
+    if too_close:
+        issues["too_close"] = too_close
+
+    left = defends_left(formation)
+    team_keeper, opponent_keeper = keeper_indices(formation, pitch_length, pitch_width)
+    keepers_off_goal = 0
+    for keeper, is_left in ((formation.team[team_keeper], left), (formation.opponents[opponent_keeper], not left)):
+        low, high = _penalty_area(is_left, pitch_length, pitch_width)
+        keepers_off_goal += int(np.any(keeper < low) or np.any(keeper > high))
+    if keepers_off_goal:
+        issues["keeper_off_goal"] = keepers_off_goal
+
+    if formation.main_index < 0:
+        issues["main_player_missing"] = 1
+    elif not formation.has_ball or np.linalg.norm(formation.ball - formation.main_player) > max_ball_distance:
+        issues["ball_far"] = 1
+    return issues
+
+
+def layout_score(issues):
+    """
+    Turns the problems found by `check_formation` into a quality score between 0 and 1.
+    """
+    return max(0.0, 1.0 - sum(PENALTIES[name] * count for name, count in issues.items()))
+
+
+def _spread(points, min_spacing, pitch_length, pitch_width, iterations=20):
+    """
+    Pushes players closer than `min_spacing` apart, keeping them on the pitch.
+    """
+    points = points.copy()
+    upper = np.array([pitch_length, pitch_width], dtype=float)
+    count = len(points)
+    # Fixed directions to separate players standing exactly on the same spot
+    fallback = np.stack([np.cos(np.arange(count)), np.sin(np.arange(count))], axis=1)
+    for _ in range(iterations):
+        offsets = points[:, None, :] - points[None, :, :]
+        distances = np.linalg.norm(offsets, axis=2)
+        np.fill_diagonal(distances, np.inf)
+        overlap = np.clip(min_spacing - distances, 0, None)
+        if not overlap.any():
+            break
+        same_spot = distances == 0
+        directions = np.where(same_spot[:, :, None], fallback[:, None, :],
+                              offsets / np.where(distances == 0, 1, distances)[:, :, None])
+        points += (directions * overlap[:, :, None] / 2).sum(axis=1)
+        points = np.clip(points, 0, upper)
+    return points
+
+
+def repair_positions(positions_data, pitch_length=120, pitch_width=80, min_spacing=3.0, max_ball_distance=5.0):
+    """
+    Checks an AI generated layout and fixes what can be fixed locally.
+
+    Players are clamped to the pitch and pushed apart, keepers are moved into their
+    penalty area, the main player is snapped to the nearest team player, and the
+    ball is brought next to the main player.
+
+    Args:
+        positions_data (dict): Positions payload, with or without the "coordinates" wrapper.
+
+    Returns:
+        tuple: (formation, score, issues) where `formation` is the repaired Formation,
+            or None if the payload is unusable, `score` the quality of the original
+            layout between 0 and 1 and `issues` the problems found in it.
+    """
+    try:
+        # Snap the main player to the nearest team player instead of requiring an exact match
+        formation = Formation.from_dict(positions_data or {}, main_tolerance=np.inf)
+        strict = Formation.from_dict(positions_data)
+    except (ValueError, AttributeError) as e:
+        return None, 0.0, {"invalid": str(e)}
+
+    issues = check_formation(strict, pitch_length, pitch_width, min_spacing, max_ball_distance)
+    score = layout_score(issues)
+    if not issues:
+        return strict, score, issues
+
+    if formation.main_index < 0:
+        # No main player given at all: pick the team player closest to the ball, or the most advanced one
+        team = formation.team
+        left = defends_left(formation)
+        if formation.has_ball:
+            formation.main_index = int(np.argmin(np.linalg.norm(team - formation.ball, axis=1)))
+        else:
+            formation.main_index = int(np.argmax(team[:, 0]) if left else np.argmin(team[:, 0]))
+
+    points = _spread(np.clip(formation.points, 0, [pitch_length, pitch_width]), min_spacing, pitch_length,
+                     pitch_width)
+    formation = Formation(points[:len(formation.team)], points[len(formation.team):], formation.main_index,
+                          formation.ball if formation.has_ball else None)
+
+    left = defends_left(formation)
+    team_keeper, opponent_keeper = keeper_indices(formation, pitch_length, pitch_width)
+    for players, keeper, is_left in ((formation.team, team_keeper, left),
+                                     (formation.opponents, opponent_keeper, not left)):
+        low, high = _penalty_area(is_left, pitch_length, pitch_width)
+        players[keeper] = np.clip(players[keeper], low, high)
+
+    main_player = formation.main_player
+    if not formation.has_ball or np.linalg.norm(formation.ball - main_player) > max_ball_distance:
+        # Put the ball at the main player's feet, on the side of the goal they attack
+        direction = 1.0 if left else -1.0
+        formation.ball = np.clip(main_player + np.array([2.0 * direction, 0.0]), 0, [pitch_length, pitch_width])
+    return formation, score, issues
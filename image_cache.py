@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+
+from cachetools import LRUCache
+
+from formation import Formation
+
+
+def image_key(formation, signature, image_format="PNG"):
+    """
+    Hashes a formation into a cache key independent of how its positions were written.
+
+    Args:
+        formation (Formation): The positions; a positions dict is also accepted.
+        signature (tuple): Everything else that changes the image, e.g. pitch size and style.
+        image_format (str): The encoding of the cached image.
+    """
+    digest = hashlib.sha256(Formation.coerce(formation).to_bytes())
+    digest.update(json.dumps([list(signature), image_format]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """
+    LRU cache of encoded images bounded by their total size in bytes.
+
+    When `disk_dir` is set, images are also written there so they survive
+    restarts; the directory is trimmed to `max_disk_bytes` by dropping the least
+    recently used files.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self._memory = LRUCache(maxsize=max_bytes, getsizeof=len)
+        self._lock = threading.Lock()
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def get(self, key):
+        """
+        Returns the cached image bytes, or None on a miss.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self.hits += 1
+                return data
+        if self.disk_dir:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                # Refresh the modification time used for disk eviction
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self._memory[key] = data
+                    self.hits += 1
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data):
+        with self._lock:
+            # Images larger than the whole cache are only kept on disk
+            if len(data) <= self._memory.maxsize:
+                self._memory[key] = data
+        if self.disk_dir:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            self._trim_disk()
+
+    def get_or_render(self, key, render):
+        """
+        Returns the cached image for `key`, calling `render()` to produce it on a miss.
+        """
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def _trim_disk(self):
+        entries = [entry for entry in os.scandir(self.disk_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+        total = sum(entry.stat().st_size for entry in entries)
+        if total <= self.max_disk_bytes:
+            return
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Already trimmed by a concurrent put
+                pass
+            if total <= self.max_disk_bytes:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._memory),
+                "bytes": self._memory.currsize,
+            }
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class JobStore:
+    """
+    Status, progress and result of long-running API requests.
+
+    Jobs live in a SQLite file rather than in memory, so any worker process sharing
+    the file can answer the polls of a job started by another. A running job whose
+    worker stopped updating it for `stale_after` seconds is reported as failed, and
+    finished jobs are dropped after `ttl` seconds.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, stale_after=600.0):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+            ttl (float): Lifetime of a finished job in seconds.
+            stale_after (float): Seconds without progress after which a running job is lost.
+        """
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, done INTEGER NOT NULL, "
+            "total INTEGER NOT NULL, result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated)")
+        self._db.commit()
+
+    def create(self, kind, total):
+        """
+        Records a new running job and drops the expired ones.
+
+        Returns:
+            str: The job id.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE status != 'running' AND updated < ?", (now - self.ttl,))
+            self._db.execute("INSERT INTO jobs VALUES (?, ?, 'running', 0, ?, NULL, NULL, ?, ?)",
+                             (job_id, kind, total, now, now))
+            self._db.commit()
+        return job_id
+
+    def _update(self, job_id, **columns):
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments}, updated = ? WHERE id = ?",
+                             (*columns.values(), time.time(), job_id))
+            self._db.commit()
+
+    def progress(self, job_id, done):
+        self._update(job_id, done=done)
+
+    def finish(self, job_id, result):
+        self._update(job_id, status="done", result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id, error):
+        self._update(job_id, status="failed", error=error)
+
+    def get(self, job_id):
+        """
+        Returns the job as a dict, or None if it does not exist or expired.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT id, kind, status, done, total, result, error, created, updated "
+                                   "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "kind", "status", "done", "total", "result", "error", "created", "updated"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        if job["status"] == "running" and time.time() - job["updated"] > self.stale_after:
+            job["status"], job["error"] = "failed", "The worker running the job stopped."
+        return job
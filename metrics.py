@@ -0,0 +1,287 @@
+import bisect
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide timings and counters of the generation pipeline.
+#
+# Stages are timed with `span`, which feeds a latency histogram per stage and,
+# when METRICS_LOG is set, appends one JSON line per span to that file. The
+# totals are exported in the Prometheus text format by `prometheus_text`, served
+# on METRICS_PORT by `serve_from_env`, and summarised by `snapshot` for the
+# diagnostics panel of the app.
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Recent durations kept per series to compute percentiles in `snapshot`
+RECENT_SAMPLES = 500
+
+# USD per million (input, cached input, output) tokens, to report the cost of the calls
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+_lock = threading.Lock()
+_counters = collections.defaultdict(float)  # (name, labels) -> total
+_histograms = {}  # (name, labels) -> {"buckets": [...], "sum": float, "count": int}
+_recent = collections.defaultdict(lambda: collections.deque(maxlen=RECENT_SAMPLES))
+_gauges = {}  # name -> callable returning {labels dict as tuple: value}
+_log_lock = threading.Lock()
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _log(record):
+    path = os.getenv("METRICS_LOG")
+    if not path:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _log_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def count(name, value=1, **labels):
+    """
+    Adds `value` to a counter, e.g. count("openai_tokens_total", 120, kind="prompt").
+    """
+    with _lock:
+        _counters[(name, _labels(labels))] += value
+
+
+def observe(name, seconds, **labels):
+    """
+    Records a duration in the `name` histogram.
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(LATENCY_BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+        _recent[key].append(seconds)
+
+
+@contextlib.contextmanager
+def span(stage, **labels):
+    """
+    Times the enclosed block as `stage` in the "stage_seconds" histogram. Failed
+    blocks are recorded too, with an "error" label holding the exception type.
+
+    Yields:
+        dict: Labels that the block may extend, e.g. with the outcome of a cache lookup.
+    """
+    labels = dict(labels)
+    start = time.perf_counter()
+    try:
+        yield labels
+    except BaseException as e:
+        labels["error"] = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_seconds", elapsed, stage=stage, **labels)
+        _log({"time": time.time(), "stage": stage, "seconds": round(elapsed, 6), **labels})
+
+
+def record_usage(usage, model, prompt="text"):
+    """
+    Counts the prompt, cached prompt and completion tokens of an OpenAI `response.usage`,
+    and its cost per prompt name for the models in MODEL_PRICES.
+    """
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    count("openai_tokens_total", usage.prompt_tokens, model=model, kind="prompt")
+    count("openai_tokens_total", cached_tokens, model=model, kind="cached")
+    count("openai_tokens_total", usage.completion_tokens, model=model, kind="completion")
+    prices = MODEL_PRICES.get(model)
+    if prices is not None:
+        input_price, cached_price, output_price = prices
+        cost = ((usage.prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + usage.completion_tokens * output_price) / 1e6
+        count("openai_cost_usd_total", cost, model=model, prompt=prompt)
+    _log({"time": time.time(), "event": "usage", "model": model, "prompt_tokens": usage.prompt_tokens,
+          "cached_tokens": cached_tokens, "completion_tokens": usage.completion_tokens})
+
+
+def counter_total(name, **labels):
+    """
+    Returns the sum of the `name` counters whose labels include `labels`.
+    """
+    wanted = set(_labels(labels))
+    with _lock:
+        return sum(value for (series, series_labels), value in _counters.items()
+                   if series == name and wanted <= set(series_labels))
+
+
+def cached_token_ratio():
+    """
+    Returns the share of prompt tokens served from the API prompt cache, per model.
+    """
+    with _lock:
+        totals = {(name, labels): value for (name, labels), value in _counters.items()
+                  if name == "openai_tokens_total"}
+    ratios = {}
+    for (_, labels), prompt in totals.items():
+        label_dict = dict(labels)
+        if label_dict.get("kind") != "prompt" or not prompt:
+            continue
+        cached = totals.get(("openai_tokens_total", _labels({**label_dict, "kind": "cached"})), 0)
+        ratios[(("model", label_dict["model"]),)] = cached / prompt
+    return ratios
+
+
+def register_gauge(name, read):
+    """
+    Exports the values returned by `read()` as the `name` gauge. `read` returns a
+    number, or a dict mapping label dicts given as tuples of (key, value) pairs to numbers.
+    """
+    with _lock:
+        _gauges[name] = read
+
+
+def _gauge_values(read):
+    try:
+        values = read()
+    except Exception as e:
+        print("Could not read gauge:", str(e))
+        return {}
+    return values if isinstance(values, dict) else {(): values}
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def prometheus_text():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                      for key, value in _histograms.items()}
+        gauges = dict(_gauges)
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (series, labels), value in sorted(counters.items()):
+            if series == name:
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (series, labels), histogram in sorted(histograms.items()):
+            if series != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    for name, read in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(_gauge_values(read).items()):
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def snapshot():
+    """
+    Summarises the metrics for display.
+
+    Returns:
+        dict: "stages": one row per histogram series with its count, mean, p50, p95 and
+            max over the recent samples in milliseconds; "counters": {series: total};
+            "gauges": {series: value}. Series are named like name{key="value"}.
+    """
+    with _lock:
+        recent = {key: sorted(values) for key, values in _recent.items()}
+        totals = {key: (value["count"], value["sum"]) for key, value in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    stages = []
+    for (name, labels), values in sorted(recent.items()):
+        total_count, total_sum = totals[(name, labels)]
+        row = {"series": name, **dict(labels), "count": total_count,
+               "mean_ms": round(1000 * total_sum / total_count, 1)}
+        row.update({
+            "p50_ms": round(1000 * _percentile(values, 0.5), 1),
+            "p95_ms": round(1000 * _percentile(values, 0.95), 1),
+            "max_ms": round(1000 * values[-1], 1),
+        })
+        stages.append(row)
+    return {
+        "stages": stages,
+        "counters": {f"{name}{_format_labels(labels)}": value for (name, labels), value in sorted(counters.items())},
+        "gauges": {f"{name}{_format_labels(labels)}": value for name, read in sorted(gauges.items())
+                   for labels, value in sorted(_gauge_values(read).items())},
+    }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_from_env():
+    """
+    Serves /metrics on the port in METRICS_PORT from a daemon thread, once per
+    process. Does nothing if the variable is not set.
+    """
+    global _server
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            except OSError as e:
+                print(f"Could not serve metrics on port {port}:", str(e))
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
+
+
+# Prompt caching efficiency, from the usage reported by the API
+register_gauge("openai_cached_token_ratio", cached_token_ratio)
@@ -0,0 +1,110 @@
+import json
+import re
+import threading
+from collections import defaultdict
+
+from pydantic import ValidationError
+
+from metrics import span
+
+# Parse outcomes per prompt, e.g. {"question": {"attempts": 10, "failures": 1, "repaired": 1}}
+_parse_stats = defaultdict(lambda: {"attempts": 0, "failures": 0, "repaired": 0})
+_parse_stats_lock = threading.Lock()
+
+# A JSON string literal, or a // comment running to the end of the line
+_STRING_OR_COMMENT = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*')
+
+
+def strip_json_comments(json_str):
+    """
+    Removes `//` comments while leaving string values untouched, so that answers
+    containing URLs survive.
+    """
+    return _STRING_OR_COMMENT.sub(lambda match: "" if match.group(0).startswith("//") else match.group(0), json_str)
+
+
+def extract_json_text(model_resp):
+    """
+    Returns the JSON part of a model response: the content of the <JSON></JSON>
+    tags when present, otherwise the response itself without code fences.
+    """
+    json_match = re.search(r'<JSON>(.*?)</JSON>', model_resp, re.DOTALL)
+    if json_match:
+        json_str = json_match.group(1)
+    else:
+        json_str = re.sub(r'^```(?:json)?|```$', '', model_resp.strip())
+    return strip_json_comments(json_str.strip())
+
+
+def json_schema_format(model_cls, name):
+    """
+    Builds the `response_format` asking the API for output matching a pydantic model.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": model_cls.model_json_schema(), "strict": True},
+    }
+
+
+def parse_output(model_resp, model_cls, prompt_name):
+    """
+    Parses and validates a model response against a pydantic model.
+
+    Args:
+        model_resp (str): The raw text returned by the model.
+        model_cls (type): The pydantic model the payload must satisfy.
+        prompt_name (str): Name under which the outcome is counted, see `parse_stats`.
+
+    Returns:
+        tuple: (payload, None) with the parsed dict when it is valid, otherwise
+            (None, error) with a description of the problem usable for a repair.
+    """
+    with span("parse", prompt=prompt_name):
+        payload, error = _validate(model_resp, model_cls)
+    with _parse_stats_lock:
+        _parse_stats[prompt_name]["attempts"] += 1
+        if error is not None:
+            _parse_stats[prompt_name]["failures"] += 1
+    return payload, error
+
+
+def _validate(model_resp, model_cls):
+    try:
+        # Structured outputs return bare JSON, so try the fast path first
+        model_cls.model_validate_json(model_resp)
+        return json.loads(model_resp), None
+    except (ValidationError, ValueError):
+        pass
+    try:
+        payload = json.loads(extract_json_text(model_resp))
+        model_cls.model_validate(payload)
+        return payload, None
+    except json.JSONDecodeError as e:
+        return None, f"Invalid JSON: {e}"
+    except ValidationError as e:
+        return None, str(e)
+
+
+def parse_repaired(model_resp, model_cls, prompt_name):
+    """
+    Validates the output of a repair request and counts successful repairs.
+
+    Returns:
+        dict: The repaired payload, or None if it is still invalid.
+    """
+    payload, _ = _validate(model_resp, model_cls)
+    if payload is not None:
+        with _parse_stats_lock:
+            _parse_stats[prompt_name]["repaired"] += 1
+    return payload
+
+
+def parse_stats():
+    """
+    Returns a copy of the parse counters per prompt, with the failure rate.
+    """
+    with _parse_stats_lock:
+        return {
+            prompt_name: {**counts, "failure_rate": counts["failures"] / counts["attempts"]}
+            for prompt_name, counts in _parse_stats.items() if counts["attempts"]
+        }
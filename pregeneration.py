@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import threading
+import time
+
+
+class PregenerationPool:
+    """
+    Bounded stock of pre-generated items per key, refilled in the background.
+
+    Keys earn priority each time they are asked for, and the priority decays over
+    time, so the combinations users actually pick stay stocked while abandoned ones
+    drain. The producer runs as a coroutine on the shared event loop and always
+    refills the highest-priority key that is below capacity. Items older than
+    `ttl` are dropped rather than served.
+    """
+
+    def __init__(self, produce, capacity=2, ttl=1800.0, max_keys=20, workers=2, half_life=3600.0,
+                 min_priority=0.5, failure_delay=10.0):
+        """
+        Args:
+            produce (callable): Coroutine function `produce(key)` returning a new item,
+                or None if generation failed.
+            capacity (int): Items kept in stock per key.
+            ttl (float): Seconds after which a stocked item is discarded.
+            max_keys (int): Number of highest-priority keys kept stocked.
+            workers (int): Items produced concurrently.
+            half_life (float): Seconds for a key's priority to halve.
+            min_priority (float): Priority below which a key is no longer refilled.
+            failure_delay (float): Seconds before retrying a key whose generation failed.
+        """
+        self.produce = produce
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.workers = workers
+        self.half_life = half_life
+        self.min_priority = min_priority
+        self.failure_delay = failure_delay
+        self._lock = threading.Lock()
+        self._stock = collections.defaultdict(collections.deque)  # key -> deque of (created, item)
+        self._priority = {}  # key -> (priority, time it was last updated)
+        self._in_flight = collections.Counter()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._failures = 0
+        self._loop = None
+        self._wake = None
+
+    def _current_priority(self, key, now):
+        priority, updated = self._priority.get(key, (0.0, now))
+        return priority * 0.5 ** ((now - updated) / self.half_life)
+
+    def request(self, key, weight=1.0):
+        """
+        Raises the priority of a key without taking anything from its stock.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._priority[key] = (self._current_priority(key, now) + weight, now)
+        self._notify()
+
+    def take(self, key):
+        """
+        Returns a stocked item for `key`, or None if there is none. Either way the
+        key's priority is raised and its stock refilled in the background.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._priority[key] = (self._current_priority(key, now) + 1.0, now)
+            self._drop_expired(key, now)
+            stock = self._stock.get(key)
+            item = stock.popleft()[1] if stock else None
+            if item is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        self._notify()
+        return item
+
+    def _drop_expired(self, key, now):
+        stock = self._stock.get(key)
+        while stock and now - stock[0][0] > self.ttl:
+            stock.popleft()
+            self._expired += 1
+
+    def _next_key(self):
+        """
+        Returns the highest-priority key that needs another item, or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(self._priority, key=lambda key: self._current_priority(key, now), reverse=True)
+            for key in ranked[self.max_keys:]:
+                # Forget keys that fell out of the top, along with their stock
+                self._priority.pop(key, None)
+                self._stock.pop(key, None)
+            for key in ranked[:self.max_keys]:
+                if self._current_priority(key, now) < self.min_priority:
+                    break
+                self._drop_expired(key, now)
+                if len(self._stock[key]) + self._in_flight[key] < self.capacity:
+                    self._in_flight[key] += 1
+                    return key
+        return None
+
+    def _notify(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _fill(self, key):
+        try:
+            item = await self.produce(key)
+        except Exception as e:
+            print(f"Pre-generation failed for {key}:", str(e))
+            item = None
+        if item is None:
+            # Keep the key reserved for a while so that a failing API is not hammered
+            await asyncio.sleep(self.failure_delay)
+        with self._lock:
+            self._in_flight[key] -= 1
+            if item is None:
+                self._failures += 1
+            elif key in self._priority:
+                self._stock[key].append((time.monotonic(), item))
+
+    async def run(self):
+        """
+        Keeps the stock filled until cancelled. Must run on the loop that drives `produce`.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        tasks = set()
+        while True:
+            while len(tasks) < self.workers and (key := self._next_key()) is not None:
+                task = asyncio.create_task(self._fill(key))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: self._wake.set())
+            self._wake.clear()
+            # Also wake up periodically so that expired items get replaced
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=min(self.ttl, 60.0))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        """
+        Returns the stocked item count and the hit, miss, expiry and failure counters.
+        """
+        with self._lock:
+            return {
+                "stocked": sum(len(stock) for stock in self._stock.values()),
+                "keys": len(self._priority),
+                "hits": self._hits,
+                "misses": self._misses,
+                "expired": self._expired,
+                "failures": self._failures,
+            }
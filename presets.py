@@ -0,0 +1,312 @@
+# Menus of the quiz generator and the preset formation of each scenario, on a
+# 120 x 80 pitch.
+
+SITUATIONS = ["Offense", "Defense", "Other"]
+
+DIFFICULTIES = ["Easy", "Medium", "Complex", "Unusual situations"]
+
+offensive_axes = [
+    "Select Axe",
+    "Contrôle de la possession",
+    "Créativité",
+    "Finition",
+    "Capacité de dribble",
+    "Précision des passes",
+    "Vision de jeu",
+    "Adaptabilité tactique",
+    "Puissance physique",
+    "Vitesse d'exécution"
+]
+
+defensive_axes = [
+    "Select Axe",
+    "Engagement défensif",
+    "Pressing et Récupération",
+    "Anticipation",
+    "Adaptabilité tactique",
+    "Puissance physique",
+    "Vitesse d'exécution",
+    "Vision de jeu"
+]
+
+# Offensive scenarios
+offensive_scenarios = [
+    "Select Scenario",
+    "Attaque Positionnelle",
+    "Contre-Attaque Rapide",
+    "Débordement sur les Côtés",
+    "Jeu en Profondeur",
+    "Centre en Retrait",
+    "Mouvement de Rupture (Appel sans Ballon)"
+]
+
+# Defensive scenarios
+defensive_scenarios = [
+    "Select Scenario",
+    "Défense en Bloc Bas",
+    "Marquage Individuel",
+    "Marquage en Zone",
+    "Réaction Rapide après un Tir Contré",
+    "Interception des Passes",
+    "Défense en Bloc Haut"
+]
+
+# Offensive scenarios with player positions
+offensive_scenarios = {
+    "Select Scenario": None,
+    "Attaque Positionnelle": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [40, 30]},  # Player 1
+            {"position": [60, 50]},  # Player 2
+            {"position": [80, 60]},  # Player 3
+            {"position": [100, 40]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 20]},  # Opp Player 1
+            {"position": [85, 50]},  # Opp Player 2
+            {"position": [80, 35]},  # Opp Player 3
+            {"position": [75, 45]}  # Opp Player 4
+        ],
+        "main_player": [60, 50],
+        "ball": [58, 48]
+    },
+    "Contre-Attaque Rapide": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [30, 50]},  # Player 1
+            {"position": [50, 40]},  # Player 2
+            {"position": [70, 45]},  # Player 3
+            {"position": [90, 55]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [100, 35]},  # Opp Player 1
+            {"position": [95, 50]},  # Opp Player 2
+            {"position": [85, 40]},  # Opp Player 3
+            {"position": [80, 30]}  # Opp Player 4
+        ],
+        "main_player": [70, 45],
+        "ball": [68, 43]
+    },
+    "Mouvement de Rupture (Appel sans Ballon)": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [30, 60]},  # Player 1
+            {"position": [50, 70]},  # Player 2
+            {"position": [80, 65]},  # Player 3
+            {"position": [100, 60]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 55]},  # Opp Player 1
+            {"position": [85, 65]},  # Opp Player 2
+            {"position": [80, 50]},  # Opp Player 3
+            {"position": [75, 40]}  # Opp Player 4
+        ],
+        "main_player": [80, 65],
+        "ball": [78, 63]
+    },
+    "Jeu en Profondeur": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [30, 60]},  # Player 1
+            {"position": [50, 70]},  # Player 2
+            {"position": [80, 65]},  # Player 3
+            {"position": [100, 60]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 55]},  # Opp Player 1
+            {"position": [85, 65]},  # Opp Player 2
+            {"position": [80, 50]},  # Opp Player 3
+            {"position": [75, 40]}  # Opp Player 4
+        ],
+        "main_player": [80, 65],
+        "ball": [78, 63]
+    },
+    "Centre en Retrait": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [30, 60]},  # Player 1
+            {"position": [50, 70]},  # Player 2
+            {"position": [80, 65]},  # Player 3
+            {"position": [100, 60]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 55]},  # Opp Player 1
+            {"position": [85, 65]},  # Opp Player 2
+            {"position": [80, 50]},  # Opp Player 3
+            {"position": [75, 40]}  # Opp Player 4
+        ],
+        "main_player": [80, 65],
+        "ball": [78, 63]
+    },
+    "Débordement sur les Côtés": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [30, 60]},  # Player 1
+            {"position": [50, 70]},  # Player 2
+            {"position": [80, 65]},  # Player 3
+            {"position": [100, 60]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 55]},  # Opp Player 1
+            {"position": [85, 65]},  # Opp Player 2
+            {"position": [80, 50]},  # Opp Player 3
+            {"position": [75, 40]}  # Opp Player 4
+        ],
+        "main_player": [80, 65],
+        "ball": [78, 63]
+    },
+    # Add more offensive scenarios as needed
+}
+
+# Defensive scenarios with player positions
+defensive_scenarios = {
+    "Select Scenario": None,
+    "Défense en Bloc Bas": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [20, 30]},  # Player 1
+            {"position": [25, 50]},  # Player 2
+            {"position": [30, 35]},  # Player 3
+            {"position": [40, 40]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 20]},  # Opp Player 1
+            {"position": [95, 50]},  # Opp Player 2
+            {"position": [85, 35]},  # Opp Player 3
+            {"position": [75, 40]}  # Opp Player 4
+        ],
+        "main_player": [25, 50],
+        "ball": [23, 48]
+    },
+    "Marquage Individuel": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [20, 40]},  # Player 1
+            {"position": [25, 35]},  # Player 2
+            {"position": [30, 50]},  # Player 3
+            {"position": [40, 45]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 30]},  # Opp Player 1
+            {"position": [95, 40]},  # Opp Player 2
+            {"position": [85, 50]},  # Opp Player 3
+            {"position": [75, 60]}  # Opp Player 4
+        ],
+        "main_player": [30, 50],
+        "ball": [28, 48]
+    },
+    "Marquage en Zone": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [20, 40]},  # Player 1
+            {"position": [25, 35]},  # Player 2
+            {"position": [30, 50]},  # Player 3
+            {"position": [40, 45]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 30]},  # Opp Player 1
+            {"position": [95, 40]},  # Opp Player 2
+            {"position": [85, 50]},  # Opp Player 3
+            {"position": [75, 60]}  # Opp Player 4
+        ],
+        "main_player": [30, 50],
+        "ball": [28, 48]
+    },
+    "Réaction Rapide après un Tir Contré": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [20, 40]},  # Player 1
+            {"position": [25, 35]},  # Player 2
+            {"position": [30, 50]},  # Player 3
+            {"position": [40, 45]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 30]},  # Opp Player 1
+            {"position": [95, 40]},  # Opp Player 2
+            {"position": [85, 50]},  # Opp Player 3
+            {"position": [75, 60]}  # Opp Player 4
+        ],
+        "main_player": [30, 50],
+        "ball": [28, 48]
+    },
+    "Interception des Passes": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [20, 40]},  # Player 1
+            {"position": [25, 35]},  # Player 2
+            {"position": [30, 50]},  # Player 3
+            {"position": [40, 45]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 30]},  # Opp Player 1
+            {"position": [95, 40]},  # Opp Player 2
+            {"position": [85, 50]},  # Opp Player 3
+            {"position": [75, 60]}  # Opp Player 4
+        ],
+        "main_player": [30, 50],
+        "ball": [28, 48]
+    },
+    "Défense en Bloc Haut": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [20, 40]},  # Player 1
+            {"position": [25, 35]},  # Player 2
+            {"position": [30, 50]},  # Player 3
+            {"position": [40, 45]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [90, 30]},  # Opp Player 1
+            {"position": [95, 40]},  # Opp Player 2
+            {"position": [85, 50]},  # Opp Player 3
+            {"position": [75, 60]}  # Opp Player 4
+        ],
+        "main_player": [30, 50],
+        "ball": [28, 48]
+    }
+    # Add more defensive scenarios as needed
+}
+
+# Other scenarios
+other_scenarios = []
+
+# Shown when neither the model nor the scenario provides usable positions
+DEFAULT_POSITIONS = {
+    "coordinates": {
+        "team_players": [
+            {"position": [5, 40]},  # GK
+            {"position": [63, 55]},  # Player 1
+            {"position": [78, 50]},  # Player 2 (MAIN)
+            {"position": [97, 5]},  # Player 3
+            {"position": [98, 76]}  # Player 4
+        ],
+        "opponent_players": [
+            {"position": [115, 40]},  # Opp GK
+            {"position": [107, 20]},  # Opp Player 1
+            {"position": [107, 60]},  # Opp Player 2
+            {"position": [99, 42]},  # Opp Player 3
+            {"position": [74, 50]}  # Opp Player 4
+        ],
+        "main_player": [78, 50],  # Player 2 (MAIN)
+        "ball": [0, 0]  # Update this if ball coordinates are provided
+    }
+}
+
+
+def scenario_presets(situation):
+    """
+    Returns the scenario name -> preset formation dict of a situation.
+    """
+    return offensive_scenarios if situation == "Offense" else defensive_scenarios
@@ -0,0 +1,269 @@
+import functools
+import json
+import math
+from collections import namedtuple
+
+# Prompt templates of the engine.
+#
+# Each prompt is split into a static system message holding the instructions and
+# the output format, identical across calls, and a short user message holding
+# only the inputs of the call. The API caches the longest prompt prefix it has
+# already seen (from 1024 tokens on), so keeping every variable part after the
+# static instructions lets repeated calls reuse the cached prefix instead of
+# paying for it again.
+
+# A prompt ready to send: `name` labels the call in the metrics and `max_tokens`
+# is the answer budget for its output shape
+Prompt = namedtuple("Prompt", ["name", "system", "user", "max_tokens"])
+
+DEFAULT_SYSTEM = "You are a helpful assistant."
+
+# Answer budgets in tokens, sized from the outputs of each shape with some margin:
+# a question with four answers in French stays under 400 tokens and the positions
+# JSON under 250. A batch gets the question budget per question asked.
+MAX_TOKENS = {
+    "text": 1000,
+    "question": 600,
+    "positions": 400,
+    "batch_question": 500,
+}
+
+# Prompts shorter than this are not cached by the API
+MIN_CACHED_PREFIX_TOKENS = 1024
+
+QUESTION_INSTRUCTIONS = [
+    "Focus on the player's decision-making process and how they should prioritize options in this scenario.",
+    "Emphasize the tactical implications of the scenario and how it impacts team dynamics.",
+    "Highlight the psychological aspects of the player's actions under pressure in this scenario.",
+    "Explore the technical skills required for a player to execute optimal actions in this situation.",
+    "Consider the game's context (e.g., time left, scoreline) and how it influences the player's choices.",
+    "Frame the question to reflect a high-stakes scenario, such as a critical moment in the match.",
+    "Incorporate elements of player positioning and spatial awareness in the decision-making process.",
+    "Focus on the interaction between teammates and how their positions affect the player's options.",
+    "Explore how the opponent's defensive setup creates challenges or opportunities for the player.",
+    "Use specific terminology related to the scenario (e.g., 'breaking the lines,' 'high press,' 'compact defense')."
+]
+
+QUESTION_SYSTEM = """You are a highly skilled soccer tactician and quiz author. Your task is to create a high quality
+question aimed at assessing a soccer player’s skills. The question should cover soccer tactics, rules,
+or specific game scenarios. Your question must be followed by four possible answers. Each answer should be
+evaluated on a scale from 1 to 4 based on its relevance to the situation, with 1 being the least optimal and 4
+being the most optimal.
+The question has to assess the player based on the axis of evaluation.
+The question doesn't have to explicitely announce the scenario, situation and axis.
+The situation, scenario, axis of evaluation, question specific instruction and difficulty are given
+as inputs in the user message.
+
+Follow these guidelines:
+
+The question and answers must be written in French.
+Each answer should be clearly associated with an evaluation score.
+Format the final output in a JSON-like structure.
+IMPERATIVE: JSON format must be wrapped with <JSON></JSON> tags, contain no extraneous
+characters, and be valid JSON.
+IMPERATIVE: Never use `//` comments.
+
+JSON format:
+<JSON>
+{
+  "question": "",
+  "answers": [
+    {
+      "text": "",
+      "score": 4
+    },
+    {
+      "text": "",
+      "score": 3
+    },
+    {
+      "text": "",
+      "score": 2
+    },
+    {
+      "text": "",
+      "score": 1
+    }
+  ]
+}
+</JSON>
+"""
+
+POSITIONS_SYSTEM = """You are an AI model tasked with generating player positions and coordinates for a
+soccer scenario based on a quiz generated by another agent. The quiz question, or the quiz inputs when
+the question is not known yet, is given in the user message.
+
+Follow these steps carefully to ensure precision:
+
+Step 1: Understand the context. The quiz question is related to soccer tactics, rules, or scenarios. The aim is to
+illustrate the scenario clearly on a soccer pitch using player positions. Consider the information provided in the
+question and options and align the positions with the given scenario.
+
+Step 2: Define the pitch dimensions. The soccer pitch dimensions are 120 (coordinates from 0 (left) to 120 (right))
+for the x-axis and 80 (from 0 (top) to 80 (bottom)) for the y-axis. This will help in placing the players
+appropriately on the field. Make sure the coordinates respect these boundaries and align logically with the scenario.
+Calculate the key stadium areas, like the penalty area, corners, attacking and defending positions, half spaces,
+goalkeeper position... these will help you be more conscious about the stadium dimensions.
+
+Step 3: Position the main player. Place the main player at a position that reflects their key role in the scenario.
+Think about whether this player is attacking or defending, and place them accordingly. Make sure to assign the main
+player a unique position.
+
+Step 4: Place the team players (5 players, including the main player and the goalkeeper). Distribute the remaining 4 players from the
+main player’s team around the pitch based on the scenario. These players should be positioned strategically to
+reflect typical game dynamics, such as positioning during an attack, defense, or counterattack.
+
+Step 5: Position the opponent players (5 players, including the goalkeeper). Place the defending team's players in
+appropriate positions to counter the team with the ball. Ensure that one of the players is clearly positioned as the
+goalkeeper, staying close to the goal. The other 4 opponent players should be positioned according to the game flow.
+
+Step 6: Place the ball. The ball should be positioned near the main player, reflecting its role in the scenario.
+Ensure that the ball’s coordinates are logical in relation to the main player's position.
+
+Format the final output in a JSON-like structure.
+IMPERATIVE: JSON format must be wrapped with <JSON></JSON> tags, contain no extraneous
+characters, and be valid JSON.
+IMPERATIVE: Never use `//` comments.
+
+Output JSON Format:
+<JSON>
+{
+  "coordinates": {
+    "team_players": [
+      {"position": [x1, y1]},
+      {"position": [x2, y2]},
+      {"position": [x3, y3]},
+      {"position": [x4, y4]},
+      {"position": [x5, y5]}
+    ],
+    "opponent_players": [
+      {"position": [x6, y6]},
+      {"position": [x7, y7]},
+      {"position": [x8, y8]},
+      {"position": [x9, y9]},
+      {"position": [x10, y10]}
+    ],
+    "main_player": [x_main, y_main],
+    "ball": [ball_x, ball_y]
+  }
+}
+</JSON>
+"""
+
+REPAIR_SYSTEM = """The JSON in the user message does not match the expected format. The user message gives
+the validation error, then the JSON.
+
+Return the corrected JSON only, keeping the content unchanged where it is valid.
+"""
+
+
+def as_prompt(prompt):
+    """
+    Returns `prompt` as a Prompt, wrapping a plain string in the generic system message.
+    """
+    if isinstance(prompt, Prompt):
+        return prompt
+    return Prompt("text", DEFAULT_SYSTEM, prompt, MAX_TOKENS["text"])
+
+
+def chat_messages(prompt):
+    prompt = as_prompt(prompt)
+    return [
+        {"role": "system", "content": prompt.system},
+        {"role": "user", "content": prompt.user}
+    ]
+
+
+def build_question_prompt(situation, scenario, axe, random_instruction, difficulty):
+    """
+    Builds the prompt asking the model for one quiz question and its four answers.
+    """
+    return Prompt("question", QUESTION_SYSTEM, f"""Inputs:
+- Situation: {situation}.
+- Scenario: {scenario}.
+- Axis of evaluation: {axe}.
+- Question specific instruction: {random_instruction}
+- Difficulty of the question: {difficulty}""", MAX_TOKENS["question"])
+
+
+def build_batch_question_prompt(situation, scenario, axe, random_instruction, difficulty, count):
+    """
+    Builds a prompt asking for `count` distinct questions in a single <JSON> array.
+    """
+    single = build_question_prompt(situation, scenario, axe, random_instruction, difficulty)
+    return single._replace(name="batch_question", max_tokens=MAX_TOKENS["batch_question"] * count, user=f"""{single.user}
+
+IMPERATIVE: Instead of a single question, create {count} distinct questions for these inputs, each
+covering a different decision. Return them as a JSON array of {count} objects, each following the
+JSON format above, wrapped in a single pair of <JSON></JSON> tags.""")
+
+
+def build_positions_prompt(context):
+    """
+    Builds the prompt asking the model for player and ball coordinates.
+
+    Args:
+        context (str): What the positions must illustrate, e.g. "Question: ..." or the
+            situation, scenario and axis lines when the question is not known yet.
+    """
+    return Prompt("positions", POSITIONS_SYSTEM, context, MAX_TOKENS["positions"])
+
+
+def scenario_context(situation, scenario, axe, difficulty):
+    """
+    Describes the quiz inputs for the positions prompt when the question itself
+    is still being generated.
+    """
+    return (f"Situation: {situation}.\nScenario: {scenario}.\nAxis of evaluation: {axe}.\n"
+            f"Difficulty of the question: {difficulty}.")
+
+
+def build_repair_prompt(prompt, model_resp, error):
+    """
+    Builds a short prompt asking the model to fix its own output to `prompt`, without
+    resending the original instructions. The answer gets the budget of the original.
+    """
+    prompt = as_prompt(prompt)
+    return Prompt(f"{prompt.name}_repair", REPAIR_SYSTEM, f"Error: {error}\n\nJSON:\n{model_resp}",
+                  prompt.max_tokens)
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        # Encoding of the gpt-4o family
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print("tiktoken is not available, estimating token counts:", str(e))
+        return None
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of `text` with tiktoken when it is installed, otherwise
+    estimates them at one token per four characters.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text))
+
+
+@functools.lru_cache(maxsize=32)
+def _prefix_tokens(system, schema):
+    return count_tokens(system) + (count_tokens(schema) if schema else 0)
+
+
+def prompt_tokens(prompt, response_format=None):
+    """
+    Measures a prompt locally.
+
+    Returns:
+        tuple: (prefix, variable) token counts, the prefix being the static system
+            message and the structured output schema, the same for every call.
+    """
+    prompt = as_prompt(prompt)
+    schema = json.dumps(response_format, sort_keys=True) if response_format else ""
+    return _prefix_tokens(prompt.system, schema), count_tokens(prompt.user)
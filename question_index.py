@@ -0,0 +1,105 @@
+import threading
+import zlib
+
+import numpy as np
+
+from text_features import normalize_text, tokenize
+
+# Mersenne prime used for the MinHash permutations; hashes are reduced below it
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text, size=5):
+    """
+    Returns the character `size`-grams of a text's meaningful words, so that
+    reformulations sharing most of their wording overlap heavily.
+    """
+    words = " ".join(tokenize(text)) or normalize_text(text)
+    if len(words) <= size:
+        return {words} if words else set()
+    return {words[i:i + size] for i in range(len(words) - size + 1)}
+
+
+class QuestionIndex:
+    """
+    MinHash/LSH index of questions for near-duplicate detection.
+
+    Each question is reduced to a MinHash signature of its character shingles and
+    filed in one bucket per band of the signature. A lookup only compares the
+    questions sharing at least one bucket, so it stays well under a millisecond
+    however large the bank grows.
+    """
+
+    def __init__(self, threshold=0.6, num_perm=128, bands=32, seed=0):
+        """
+        Args:
+            threshold (float): Estimated Jaccard similarity above which two questions
+                are considered duplicates.
+            num_perm (int): Signature length; must be a multiple of `bands`.
+            bands (int): Number of LSH bands. More bands find less similar candidates.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self._texts = []
+
+    def __len__(self):
+        return len(self._texts)
+
+    def signature(self, text):
+        """
+        Returns the MinHash signature of a text, or None if it has no words.
+        """
+        grams = shingles(text)
+        if not grams:
+            return None
+        hashes = np.fromiter((zlib.crc32(gram.encode("utf-8")) % _PRIME for gram in grams), dtype=np.uint64,
+                             count=len(grams))
+        return ((hashes[:, None] * self._a + self._b) % _PRIME).min(axis=0)
+
+    def _bands(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, text):
+        """
+        Indexes a question of the bank.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return
+        with self._lock:
+            position = len(self._texts)
+            self._texts.append(text)
+            self._signatures.append(signature)
+            for buckets, band in zip(self._buckets, self._bands(signature)):
+                buckets.setdefault(band, []).append(position)
+
+    def find(self, text):
+        """
+        Finds the indexed question most similar to `text`.
+
+        Returns:
+            tuple: (question, similarity) for the closest question at or above the
+                threshold, or (None, 0.0) if there is none.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None, 0.0
+        with self._lock:
+            candidates = set()
+            for buckets, band in zip(self._buckets, self._bands(signature)):
+                candidates.update(buckets.get(band, ()))
+            best, best_similarity = None, 0.0
+            for position in candidates:
+                similarity = float((self._signatures[position] == signature).mean())
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best, best_similarity = self._texts[position], similarity
+        return best, best_similarity
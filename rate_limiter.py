@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import count, observe
+
+# Client side rate limiting of the OpenAI calls made by every session of the
+# process, so that concurrent editors queue for the quota instead of all being
+# answered with 429s. Limits are per model, as OpenAI applies them.
+
+# Requests and tokens per minute of each model, overridden for every model with
+# OPENAI_RPM and OPENAI_TPM; 0 disables a limit
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o": (500, 30_000),
+    "gpt-4o-mini": (500, 200_000),
+}
+
+# Session the calls of the current thread or task are queued under, set by the
+# Streamlit page on every run; tasks sent with `run_async` inherit it
+current_session = contextvars.ContextVar("rate_limit_session", default="default")
+
+# How often async waiters that are not first in line check again
+ASYNC_POLL_INTERVAL = 0.05
+
+
+class RateLimiter:
+    """
+    Token buckets of requests and tokens per minute, shared by threads and by
+    coroutines of the shared event loop.
+
+    Waiting calls are queued per session and the sessions are served in turn, so a
+    batch run of one editor delays the Generate click of another by at most one
+    request. Each bucket holds `burst` seconds of quota, which smooths the start of
+    a batch rather than sending a full minute of requests at once.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, burst=10.0, name=""):
+        """
+        Args:
+            requests_per_minute (int): Request quota, 0 for none.
+            tokens_per_minute (int): Token quota, prompt and answer budget included, 0 for none.
+            burst (float): Seconds of quota the buckets hold.
+            name (str): Label of the metrics, e.g. the model.
+        """
+        self.name = name
+        self._rates = (requests_per_minute / 60, tokens_per_minute / 60)
+        self._capacities = tuple(max(1.0, rate * burst) if rate else None for rate in self._rates)
+        self._levels = [capacity or 0.0 for capacity in self._capacities]
+        self._updated = time.monotonic()
+        self._held_until = 0.0
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()  # session -> tickets, in serving order
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        for i, (rate, capacity) in enumerate(zip(self._rates, self._capacities)):
+            if capacity is not None:
+                self._levels[i] = min(capacity, self._levels[i] + rate * elapsed)
+
+    def _cost(self, tokens):
+        # A request larger than the bucket would never be served, so it waits for a full bucket instead
+        return [min(cost, capacity) if capacity is not None else 0.0
+                for cost, capacity in zip((1.0, float(tokens)), self._capacities)]
+
+    def _enqueue(self, tokens, session):
+        ticket = {"cost": self._cost(tokens)}
+        with self._condition:
+            self._queues.setdefault(session or current_session.get(), deque()).append(ticket)
+        return ticket
+
+    def _grant(self, ticket):
+        """
+        Serves the ticket if it is next in line and the quota allows it.
+
+        Returns:
+            float: 0 once served, the seconds until it can be, or None while other
+                tickets are ahead of it.
+        """
+        session, tickets = next(iter(self._queues.items()))
+        if tickets[0] is not ticket:
+            return None
+        now = time.monotonic()
+        self._refill(now)
+        wait = max([self._held_until - now] + [
+            (cost - level) / rate for cost, level, rate in zip(ticket["cost"], self._levels, self._rates)
+            if cost > level])
+        if wait > 0:
+            return wait
+        for i, cost in enumerate(ticket["cost"]):
+            self._levels[i] -= cost
+        tickets.popleft()
+        if tickets:
+            self._queues.move_to_end(session)
+        else:
+            del self._queues[session]
+        self._condition.notify_all()
+        return 0
+
+    def _withdraw(self, ticket):
+        with self._condition:
+            # Tickets are compared by identity, as equal costs make equal tickets
+            for session, tickets in list(self._queues.items()):
+                position = next((i for i, queued in enumerate(tickets) if queued is ticket), None)
+                if position is not None:
+                    del tickets[position]
+                    if not tickets:
+                        del self._queues[session]
+            self._condition.notify_all()
+
+    def _record(self, start):
+        waited = time.perf_counter() - start
+        observe("rate_limit_wait_seconds", waited, model=self.name)
+        if waited > 0.01:
+            count("rate_limit_waits_total", model=self.name)
+
+    def acquire(self, tokens=1, session=None):
+        """
+        Blocks until a request of `tokens` tokens may be sent.
+
+        Args:
+            session (str): Queue of the caller, `current_session` by default.
+        """
+        start = time.perf_counter()
+        ticket = self._enqueue(tokens, session)
+        try:
+            with self._condition:
+                while (wait := self._grant(ticket)) != 0:
+                    self._condition.wait(wait)
+        except BaseException:
+            self._withdraw(ticket)
+            raise
+        self._record(start)
+
+    async def acquire_async(self, tokens=1, session=None):
+        """
+        Same as `acquire`, waiting without blocking the event loop.
+        """
+        start = time.perf_counter()
+        ticket = self._enqueue(tokens, session)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._grant(ticket)
+                if wait == 0:
+                    break
+                await asyncio.sleep(ASYNC_POLL_INTERVAL if wait is None else wait)
+        except BaseException:
+            self._withdraw(ticket)
+            raise
+        self._record(start)
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes the quota of a request only if nobody is waiting and it is available now.
+        """
+        with self._condition:
+            if self._queues:
+                return False
+            now = time.monotonic()
+            self._refill(now)
+            cost = self._cost(tokens)
+            if now < self._held_until or any(c > level for c, level in zip(cost, self._levels)):
+                return False
+            for i, c in enumerate(cost):
+                self._levels[i] -= c
+            return True
+
+    def refund(self, tokens):
+        """
+        Gives back tokens reserved for a request but not used by it.
+        """
+        if tokens <= 0 or self._capacities[1] is None:
+            return
+        with self._condition:
+            self._levels[1] = min(self._capacities[1], self._levels[1] + tokens)
+            self._condition.notify_all()
+
+    def hold(self, seconds):
+        """
+        Stops serving requests for `seconds`, when the API answered with a rate limit.
+        """
+        with self._condition:
+            self._held_until = max(self._held_until, time.monotonic() + seconds)
+
+    def queued(self):
+        """
+        Returns the number of requests waiting.
+        """
+        with self._condition:
+            return sum(len(tickets) for tickets in self._queues.values())
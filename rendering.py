@@ -0,0 +1,157 @@
+import threading
+from io import BytesIO
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
+from mplsoccer import Pitch
+from PIL import Image
+
+from formation import Formation
+from metrics import span
+
+TEAM_COLOR = '#4CAF50'
+OPPONENT_COLOR = '#FF5733'
+MAIN_PLAYER_EDGE_COLOR = 'gold'
+EDGE_COLOR = 'black'
+MARKER_SIZE = 300
+
+
+class PlayerPositionPlotter:
+    """
+    Renders player and ball positions on a soccer pitch.
+
+    The empty pitch is drawn once, on a figure owned by the plotter and kept out of
+    the pyplot registry, and cached as a raster background. Each render restores
+    that background and draws the players of each team as a single scatter
+    collection, so only the players and the ball are drawn per image.
+    """
+
+    def __init__(self, pitch_length=120, pitch_width=80, figsize=(10, 7), dpi=100,
+                 line_color='white', pitch_color='#aabb97'):
+        """
+        Initialize the PlayerPositionPlotter with pitch dimensions and style.
+        """
+        self.pitch_length = pitch_length
+        self.pitch_width = pitch_width
+        self.figsize = figsize
+        self.dpi = dpi
+        self.pitch = Pitch(pitch_length=self.pitch_length, pitch_width=self.pitch_width,
+                           line_color=line_color, pitch_color=pitch_color)
+        # Everything that changes the image besides the positions, see image_cache.image_key
+        self.signature = (pitch_length, pitch_width, tuple(figsize), dpi, line_color, pitch_color)
+        # Matplotlib is not thread safe and Streamlit sessions run in threads
+        self._lock = threading.Lock()
+        self._fig = None
+
+    def _draw_pitch(self, fig):
+        ax = fig.add_subplot()
+        self.pitch.draw(ax=ax)
+        ax.set_title("Player and Ball Positions", fontsize=16, color='#34495e', weight='bold')
+        fig.tight_layout()
+        return ax
+
+    def _setup(self):
+        """
+        Draws the empty pitch and creates the artists updated on each render.
+        """
+        fig = Figure(figsize=self.figsize, dpi=self.dpi)
+        FigureCanvasAgg(fig)
+        ax = self._draw_pitch(fig)
+        empty = np.empty((0, 2))
+        self._team = ax.scatter(empty[:, 0], empty[:, 1], s=MARKER_SIZE, color=TEAM_COLOR, edgecolor=EDGE_COLOR,
+                                lw=2.5, zorder=3, animated=True)
+        self._opponents = ax.scatter(empty[:, 0], empty[:, 1], s=MARKER_SIZE, color=OPPONENT_COLOR,
+                                     edgecolor=EDGE_COLOR, lw=2.5, zorder=3, animated=True)
+        self._ball = Circle((0, 0), radius=1, color='white', zorder=4, animated=True)
+        ax.add_patch(self._ball)
+        fig.canvas.draw()
+        self._background = fig.canvas.copy_from_bbox(fig.bbox)
+        self._ax = ax
+        self._fig = fig
+
+    def render_rgba(self, formation):
+        """
+        Renders the positions and returns the image as an RGBA array.
+
+        Args:
+            formation (Formation): The positions to draw; a positions dict is also accepted.
+        """
+        formation = Formation.coerce(formation)
+        edge_colors = team_edge_colors(formation)
+
+        with self._lock:
+            if self._fig is None:
+                self._setup()
+            canvas = self._fig.canvas
+            canvas.restore_region(self._background)
+            self._team.set_offsets(formation.team)
+            self._team.set_edgecolor(edge_colors)
+            self._opponents.set_offsets(formation.opponents)
+            self._ax.draw_artist(self._team)
+            self._ax.draw_artist(self._opponents)
+            if formation.has_ball:
+                self._ball.set_center(formation.ball)
+                self._ax.draw_artist(self._ball)
+            return np.asarray(canvas.buffer_rgba()).copy()
+
+    def render_png(self, formation):
+        """
+        Renders the positions and returns the PNG encoded image.
+        """
+        return self.render_image(formation, "PNG")
+
+    def render_image(self, formation, image_format="PNG"):
+        """
+        Renders the positions and returns the image encoded as `image_format` ("PNG" or "WEBP").
+        """
+        buf = BytesIO()
+        with span("render_rgba"):
+            image = Image.fromarray(self.render_rgba(formation))
+        with span("encode_image", format=image_format):
+            if image_format == "PNG":
+                image.save(buf, format="PNG", compress_level=1)
+            else:
+                image.save(buf, format=image_format)
+        return buf.getvalue()
+
+    def plot_player_positions(self, formation):
+        """
+        Plots the players' positions on a new standalone figure.
+
+        The figure is not registered with pyplot, so it is freed as soon as the
+        caller drops it. Prefer `render_png` for repeated renders.
+        """
+        formation = Formation.coerce(formation)
+        fig = Figure(figsize=self.figsize, dpi=self.dpi)
+        FigureCanvasAgg(fig)
+        ax = self._draw_pitch(fig)
+
+        ax.scatter(formation.team[:, 0], formation.team[:, 1], s=MARKER_SIZE, color=TEAM_COLOR,
+                   edgecolor=team_edge_colors(formation), lw=2.5, label='Team Player', zorder=3)
+        ax.scatter(formation.opponents[:, 0], formation.opponents[:, 1], s=MARKER_SIZE, color=OPPONENT_COLOR,
+                   edgecolor=EDGE_COLOR, lw=2.5, label='Opponent Player', zorder=3)
+
+        if formation.has_ball:
+            ax.add_patch(Circle(formation.ball, radius=1, color='white', zorder=4))
+        return fig
+
+    def close(self):
+        """
+        Releases the cached figure; it is rebuilt on the next render.
+        """
+        with self._lock:
+            if self._fig is not None:
+                self._fig.clear()
+            self._fig = None
+
+
+def team_edge_colors(formation):
+    """
+    Returns the marker edge color of each team player, highlighting the main player.
+    """
+    edge_colors = [EDGE_COLOR] * len(formation.team)
+    if formation.main_index >= 0:
+        edge_colors[formation.main_index] = MAIN_PLAYER_EDGE_COLOR
+    return edge_colors
@@ -0,0 +1,328 @@
+import asyncio
+import collections
+import concurrent.futures
+import random
+import threading
+import time
+
+from metrics import count
+
+# Call policy of the OpenAI requests: a deadline per attempt, jittered retries
+# of rate limits and server errors, an optional hedged duplicate when an attempt
+# is slower than usual, and a circuit breaker that fails fast while the API is down.
+# Attempts also wait for the shared quota of an optional RateLimiter.
+
+# Threads running the hedged attempts of synchronous calls. Attempts only use a
+# thread that is free right away: a losing attempt keeps its thread until its
+# deadline, and calls queued behind those would wait, and skew the latencies
+# deciding when to hedge, so they run unhedged on the caller's thread instead.
+HEDGE_THREADS = 8
+_hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="openai-hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_THREADS)
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling the API while the circuit breaker is open.
+    """
+
+    def __init__(self, retry_in):
+        super().__init__(f"The OpenAI API is failing; calls are suspended for {retry_in:.0f}s.")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. A single probe call is then let through: its success
+    closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def retry_in(self):
+        """
+        Returns the seconds left before calls are allowed again, or None if a call
+        may be made: the circuit is closed, or its reset timeout has passed and the
+        next call will be the probe. While the probe runs, other calls wait for it.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                return None
+            return max(0.0, remaining)
+
+    def allow(self):
+        """
+        Raises CircuitOpenError if the call must not be made.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                return
+        count("openai_circuit_rejections_total")
+        raise CircuitOpenError(max(remaining, 0.0))
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self):
+        """
+        Gives up the probe slot taken by `allow` without an outcome, e.g. when the
+        call was cancelled before the API answered, so that another call can probe.
+        """
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    print(f"OpenAI circuit opened after {self._failures} failure(s)")
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def is_open(self):
+        return self.retry_in() is not None
+
+
+class LatencyTracker:
+    """
+    Recent durations of successful calls, to decide when an attempt is slow
+    enough to be hedged.
+    """
+
+    def __init__(self, samples=200, min_samples=20, quantile=0.95):
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self._lock = threading.Lock()
+        self._durations = collections.deque(maxlen=samples)
+
+    def record(self, seconds):
+        with self._lock:
+            self._durations.append(seconds)
+
+    def hedge_after(self):
+        """
+        Returns the latency quantile, or None until enough calls were seen.
+        """
+        with self._lock:
+            if len(self._durations) < self.min_samples:
+                return None
+            durations = sorted(self._durations)
+        return durations[min(len(durations) - 1, int(self.quantile * len(durations)))]
+
+
+def retryable_openai_errors():
+    """
+    Returns the OpenAI exceptions worth retrying, importing the client library on demand.
+    Timeouts are connection errors.
+    """
+    import openai
+
+    return openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+
+
+def is_outage(error):
+    # Rate limits mean the API is up, so they do not count towards opening the circuit
+    import openai
+
+    return not isinstance(error, openai.RateLimitError)
+
+
+def retry_delay(error, attempt, base_delay=1.0, max_delay=30.0):
+    """
+    Returns how long to wait before retrying, honouring the `retry-after` header of
+    rate limited responses and otherwise backing off exponentially with jitter.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _first_success(futures):
+    error = None
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if len(futures) > 1:
+                    count("openai_hedges_total", winner="primary" if future is futures[0] else "hedge")
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _spare_quota(limiter, tokens):
+    # Hedged duplicates only use quota nobody is waiting for
+    if limiter is None or limiter.try_acquire(tokens):
+        return True
+    count("openai_hedges_skipped_total")
+    return False
+
+
+def _submit_hedged(call, timeout):
+    # The caller holds a slot of `_hedge_slots`, given back once the attempt is over
+    future = _hedge_executor.submit(call, timeout)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def _attempt(call, timeout, hedge_after, limiter, tokens):
+    if hedge_after is None:
+        return call(timeout)
+    if not _hedge_slots.acquire(blocking=False):
+        count("openai_hedges_skipped_total")
+        return call(timeout)
+    futures = [_submit_hedged(call, timeout)]
+    done, _ = concurrent.futures.wait(futures, timeout=hedge_after)
+    if not done:
+        if not _hedge_slots.acquire(blocking=False):
+            count("openai_hedges_skipped_total")
+        elif _spare_quota(limiter, tokens):
+            # The slower request keeps running until its deadline; its result is ignored
+            futures.append(_submit_hedged(call, timeout))
+        else:
+            _hedge_slots.release()
+    return _first_success(futures)
+
+
+async def _attempt_async(call, timeout, hedge_after, limiter, tokens):
+    tasks = [asyncio.ensure_future(call(timeout))]
+    try:
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and _spare_quota(limiter, tokens):
+                tasks.append(asyncio.ensure_future(call(timeout)))
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        count("openai_hedges_total", winner="primary" if task is tasks[0] else "hedge")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def call_with_retries(call, breaker, latencies, attempts=3, timeout=30.0, hedge=True, limiter=None, tokens=1):
+    """
+    Runs an API call under the resilience policy.
+
+    Args:
+        call (callable): `call(timeout)` making one request with that deadline in seconds.
+        breaker (CircuitBreaker): Breaker of the API.
+        latencies (LatencyTracker): Recent latencies of this kind of call.
+        attempts (int): Attempts at most, retrying rate limits and server errors.
+        timeout (float): Deadline of each attempt.
+        hedge (bool): Send a duplicate request when an attempt is slower than the
+            latencies usually are, keeping the first answer.
+        limiter (RateLimiter): Optional quota every attempt waits for. Rate limited
+            answers pause it for every caller.
+        tokens (int): Tokens reserved per attempt, prompt and answer budget.
+
+    Raises:
+        CircuitOpenError: The circuit is open, without calling the API.
+    """
+    retryable = retryable_openai_errors()
+    for attempt in range(attempts):
+        breaker.allow()
+        try:
+            if limiter is not None:
+                limiter.acquire(tokens)
+            start = time.perf_counter()
+            response = _attempt(call, timeout, latencies.hedge_after() if hedge else None, limiter, tokens)
+        except retryable as e:
+            if is_outage(e):
+                breaker.failure()
+            else:
+                # Rate limited: the API is up but gave no verdict, so another call may probe
+                breaker.release()
+            if attempt == attempts - 1:
+                raise
+            delay = retry_delay(e, attempt)
+            if limiter is not None and not is_outage(e):
+                limiter.hold(delay)
+            count("openai_retries_total", error=type(e).__name__)
+            print(f"OpenAI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        except Exception:
+            # The API answered, e.g. with a bad request, so it is not down
+            breaker.success()
+            raise
+        except BaseException:
+            # Cancelled or interrupted without an answer
+            breaker.release()
+            raise
+        breaker.success()
+        latencies.record(time.perf_counter() - start)
+        return response
+
+
+async def call_with_retries_async(call, breaker, latencies, attempts=3, timeout=30.0, hedge=True, limiter=None,
+                                  tokens=1):
+    """
+    Async counterpart of `call_with_retries`, `call(timeout)` returning an awaitable.
+    """
+    retryable = retryable_openai_errors()
+    for attempt in range(attempts):
+        breaker.allow()
+        try:
+            if limiter is not None:
+                await limiter.acquire_async(tokens)
+            start = time.perf_counter()
+            response = await _attempt_async(call, timeout, latencies.hedge_after() if hedge else None, limiter,
+                                            tokens)
+        except retryable as e:
+            if is_outage(e):
+                breaker.failure()
+            else:
+                # Rate limited: the API is up but gave no verdict, so another call may probe
+                breaker.release()
+            if attempt == attempts - 1:
+                raise
+            delay = retry_delay(e, attempt)
+            if limiter is not None and not is_outage(e):
+                limiter.hold(delay)
+            count("openai_retries_total", error=type(e).__name__)
+            print(f"OpenAI request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        except Exception:
+            # The API answered, e.g. with a bad request, so it is not down
+            breaker.success()
+            raise
+        except BaseException:
+            # Cancelled or interrupted without an answer
+            breaker.release()
+            raise
+        breaker.success()
+        latencies.record(time.perf_counter() - start)
+        return response
@@ -0,0 +1,389 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+from image_cache import ImageCache
+from metrics import count, register_gauge, span
+from rate_limiter import DEFAULT_RATE_LIMITS, RateLimiter
+from resilience import CircuitBreaker, LatencyTracker
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+
+# Process-wide handles for the external services used by the app.
+#
+# Streamlit reruns app.py on every widget interaction, so anything created at
+# module level is rebuilt each time. The helpers below are cached with
+# `cached_resource`, which keeps one instance per process shared by every
+# session, and are only rebuilt before the OAuth token expires or when a call is
+# rejected with an authentication error. Nothing here depends on Streamlit, so
+# the same handles serve the CLI and background workers. The client libraries
+# (gspread, openai) are imported on first use to keep start-up fast.
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# HTTP statuses returned by Google when the access token is no longer accepted
+AUTH_ERROR_CODES = (401, 403)
+
+# Seconds after which the worksheet handle is rebuilt, ahead of the one hour
+# lifetime of Google access tokens
+SHEET_CONNECTION_MAX_AGE = 50 * 60
+
+
+def cached_resource(fn):
+    """
+    Caches the result of `fn` per arguments for the life of the process, like
+    st.cache_resource but without Streamlit and safe to call from any thread.
+    Concurrent first calls with the same arguments build the value once, while
+    those with other arguments do not wait for it. `fn.clear()` drops the cached
+    values.
+    """
+    lock = threading.Lock()
+    values = {}
+    key_locks = {}
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        with lock:
+            if key in values:
+                return values[key]
+            key_lock = key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with lock:
+                if key in values:
+                    return values[key]
+            value = fn(*args, **kwargs)
+            with lock:
+                values[key] = value
+            return value
+
+    def clear():
+        with lock:
+            values.clear()
+
+    wrapper.clear = clear
+    return wrapper
+
+
+def get_secret(name):
+    """
+    Reads a secret from the environment, falling back to Streamlit's secrets.toml.
+    """
+    value = os.getenv(name)
+    if value is None:
+        import streamlit as st
+        value = st.secrets[name]
+    return value
+
+
+@cached_resource
+def get_gcp_credentials():
+    """
+    Parses the service account JSON stored in secrets, once per process.
+    """
+    return json.loads(get_secret("GCP_CREDENTIALS"))
+
+
+def connect_to_google_sheet(gcp_credentials, spreadsheet_name):
+    """
+    Authenticates with Google and opens the first worksheet of a spreadsheet.
+
+    Returns:
+        tuple: The service account credentials and the worksheet handle.
+    """
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    # Use in-memory credentials
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(gcp_credentials, SCOPE)
+    client = gspread.authorize(creds)
+    sheet = client.open(spreadsheet_name).sheet1
+    return creds, sheet
+
+
+@cached_resource
+def _cached_sheet(spreadsheet_name):
+    _, sheet = connect_to_google_sheet(get_gcp_credentials(), spreadsheet_name)
+    return time.monotonic(), sheet
+
+
+def get_sheet(spreadsheet_name):
+    """
+    Returns the shared worksheet handle, reconnecting once it is older than
+    SHEET_CONNECTION_MAX_AGE so that its token never expires in use. A token
+    rejected earlier is handled by `call_sheet`.
+
+    Args:
+        spreadsheet_name (str): Name of the Google Sheets document.
+    """
+    connected_at, sheet = _cached_sheet(spreadsheet_name)
+    if time.monotonic() - connected_at > SHEET_CONNECTION_MAX_AGE:
+        refresh_sheet()
+        connected_at, sheet = _cached_sheet(spreadsheet_name)
+    return sheet
+
+
+def refresh_sheet():
+    """
+    Drops the cached worksheet handle so the next access re-authenticates.
+    """
+    _cached_sheet.clear()
+
+
+def _is_sheet_auth_error(error):
+    status = getattr(error, "code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = error.response.status_code
+    return status in AUTH_ERROR_CODES
+
+
+def call_sheet(spreadsheet_name, fn):
+    """
+    Runs `fn(sheet)` against the shared worksheet.
+
+    If Google rejects the call with an authentication error, the handle is
+    rebuilt and the call is retried once.
+
+    Args:
+        spreadsheet_name (str): Name of the Google Sheets document.
+        fn (callable): Function receiving the worksheet handle.
+    """
+    import gspread
+
+    try:
+        return fn(get_sheet(spreadsheet_name))
+    except gspread.exceptions.APIError as e:
+        if not _is_sheet_auth_error(e):
+            raise
+        print("Google Sheets auth error, reconnecting:", str(e))
+        refresh_sheet()
+        return fn(get_sheet(spreadsheet_name))
+
+
+# Rows queued for Google Sheets are spooled next to this path, in one file per
+# process, until written; the environment variable of the same name overrides
+# the location, as for RESPONSE_CACHE_PATH
+SHEET_SPOOL_PATH = os.getenv("SHEET_SPOOL_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  "sheet_spool.jsonl")
+
+
+@cached_resource
+def get_sheet_writer(spreadsheet_name):
+    """
+    Returns the process-wide write-behind queue for a spreadsheet, shared by all
+    sessions so that their rows are grouped into the same `append_rows` calls.
+    """
+    from sheet_writer import SheetWriter
+
+    def append_rows(rows):
+        with span("sheet_append_rows"):
+            call_sheet(spreadsheet_name, lambda sheet: sheet.append_rows(rows))
+        count("sheet_rows_written_total", len(rows))
+
+    return SheetWriter(append_rows, SHEET_SPOOL_PATH)
+
+
+# Local copies of the question banks, see bank_mirror.py
+BANK_MIRROR_DIR = os.getenv("BANK_MIRROR_DIR") or os.path.dirname(os.path.abspath(__file__))
+
+
+@cached_resource
+def get_bank_mirror(spreadsheet_name):
+    """
+    Returns the process-wide local mirror of a question bank, kept in a SQLite
+    file of BANK_MIRROR_DIR named after the spreadsheet.
+    """
+    from bank_mirror import BankMirror
+
+    digest = hashlib.sha1(spreadsheet_name.encode("utf-8")).hexdigest()[:12]
+    return BankMirror(os.path.join(BANK_MIRROR_DIR, f"bank_mirror-{digest}.sqlite3"))
+
+
+# Jobs of the HTTP API, shared by its worker processes, see api.py
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "api_jobs.sqlite3")
+
+
+@cached_resource
+def get_job_store():
+    """
+    Returns the process-wide handle of the API job store.
+    """
+    from jobs import JobStore
+
+    return JobStore(JOB_STORE_PATH)
+
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        "response_cache.sqlite3")
+
+
+# Used from coroutines on the shared event loop on every request, so it is kept
+# as a plain module-level singleton rather than behind `cached_resource`.
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the process-wide cache of model responses.
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+        return _response_cache
+
+
+@cached_resource
+def get_image_cache():
+    """
+    Returns the process-wide cache of rendered pitch images. Set IMAGE_CACHE_DIR
+    to also keep them on disk across restarts.
+    """
+    return ImageCache(disk_dir=os.getenv("IMAGE_CACHE_DIR"))
+
+
+@cached_resource
+def get_openai_client():
+    """
+    Returns the shared OpenAI client, built once per process.
+    """
+    import openai
+
+    # Retries are left to `call_with_retries`
+    return openai.OpenAI(api_key=get_secret("OPENAI_API_KEY"), max_retries=0)
+
+
+def refresh_openai_client():
+    """
+    Drops the cached OpenAI client so the next access builds a new one.
+    """
+    get_openai_client.clear()
+
+
+def call_openai(fn):
+    """
+    Runs `fn(client)` with the shared OpenAI client.
+
+    On an authentication error (e.g. the key was rotated in secrets) the client
+    is rebuilt and the call is retried once.
+
+    Args:
+        fn (callable): Function receiving the OpenAI client.
+    """
+    import openai
+
+    try:
+        return fn(get_openai_client())
+    except (openai.AuthenticationError, openai.PermissionDeniedError) as e:
+        print("OpenAI auth error, rebuilding client:", str(e))
+        refresh_openai_client()
+        return fn(get_openai_client())
+
+
+@cached_resource
+def get_openai_breaker():
+    """
+    Returns the process-wide circuit breaker of the OpenAI API. It opens after
+    OPENAI_BREAKER_FAILURES consecutive failures (5) for OPENAI_BREAKER_RESET seconds (30).
+    """
+    return CircuitBreaker(int(os.getenv("OPENAI_BREAKER_FAILURES", "5")),
+                          float(os.getenv("OPENAI_BREAKER_RESET", "30")))
+
+
+@cached_resource
+def get_openai_latencies(model, prompt_name):
+    """
+    Returns the recent latencies of the calls of a prompt to a model, used to hedge slow calls.
+    """
+    return LatencyTracker()
+
+
+register_gauge("openai_circuit_open", lambda: int(get_openai_breaker().is_open()))
+
+
+@cached_resource
+def get_rate_limiter(model):
+    """
+    Returns the process-wide rate limiter of a model, shared by every session.
+    OPENAI_RPM and OPENAI_TPM override the quotas of DEFAULT_RATE_LIMITS.
+    """
+    requests_per_minute, tokens_per_minute = DEFAULT_RATE_LIMITS.get(model, DEFAULT_RATE_LIMITS["gpt-4o"])
+    return RateLimiter(int(os.getenv("OPENAI_RPM", requests_per_minute)),
+                       int(os.getenv("OPENAI_TPM", tokens_per_minute)), name=model)
+
+
+@cached_resource
+def get_inflight_requests():
+    """
+    Returns the process-wide registry of the OpenAI requests in flight, so that
+    identical requests of concurrent sessions share one call.
+    """
+    return SingleFlight("openai")
+
+
+register_gauge("rate_limit_queued", lambda: {
+    (("model", model),): get_rate_limiter(model).queued() for model in DEFAULT_RATE_LIMITS})
+
+
+@cached_resource
+def get_event_loop():
+    """
+    Returns a process-wide asyncio event loop running in a daemon thread.
+
+    Streamlit scripts are synchronous, so coroutines are submitted to this loop
+    with `run_async` and awaited through the returned future. Keeping a single
+    long-lived loop lets the async OpenAI client reuse its connection pool.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="async-openai-loop", daemon=True).start()
+    return loop
+
+
+def run_async(coro):
+    """
+    Schedules a coroutine on the shared event loop.
+
+    Returns:
+        concurrent.futures.Future: Future resolving to the coroutine result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+# The async client is bound to the shared loop, so it is created lazily from
+# coroutines running there rather than from the script thread.
+_async_openai_client = None
+
+
+def get_async_openai_client():
+    """
+    Returns the shared async OpenAI client. It must only be used from coroutines
+    running on the loop returned by `get_event_loop`.
+    """
+    global _async_openai_client
+    if _async_openai_client is None:
+        import openai
+
+        _async_openai_client = openai.AsyncOpenAI(api_key=get_secret("OPENAI_API_KEY"), max_retries=0)
+    return _async_openai_client
+
+
+async def call_openai_async(fn):
+    """
+    Async counterpart of `call_openai`: awaits `fn(client)` with the shared async
+    client and rebuilds it once on an authentication error.
+    """
+    global _async_openai_client
+    import openai
+
+    try:
+        return await fn(get_async_openai_client())
+    except (openai.AuthenticationError, openai.PermissionDeniedError) as e:
+        print("OpenAI auth error, rebuilding async client:", str(e))
+        _async_openai_client = None
+        return await fn(get_async_openai_client())
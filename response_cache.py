@@ -0,0 +1,120 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from cachetools import LRUCache
+
+
+def make_cache_key(model, messages, **params):
+    """
+    Hashes everything that determines a chat completion into a cache key.
+
+    Args:
+        model (str): The model name.
+        messages (list): The chat messages sent to the model.
+        **params: Other request parameters, e.g. max_tokens.
+    """
+    payload = json.dumps({"model": model, "messages": messages, **params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of model responses.
+
+    Entries live in a SQLite file so they survive restarts, with a small in-memory
+    tier in front of it so repeated hits do not touch the disk. Entries expire
+    after `ttl` seconds and the least recently used ones are evicted once the file
+    holds more than `max_entries`.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000, memory_entries=256):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+            ttl (float): Lifetime of an entry in seconds.
+            max_entries (int): Maximum number of entries kept on disk.
+            memory_entries (int): Maximum number of entries kept in memory.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = LRUCache(maxsize=memory_entries)  # key -> (response, created)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    def get(self, key):
+        """
+        Returns the cached response for a key, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self.hits += 1
+                return entry[0]
+
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._memory[key] = row
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """
+        Stores a response and evicts the least recently used entries beyond `max_entries`.
+        """
+        now = time.time()
+        with self._lock:
+            self._memory[key] = (response, now)
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, now, now))
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self):
+        """
+        Returns the hit and miss counters since start-up and the number of stored entries.
+        """
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
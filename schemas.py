@@ -0,0 +1,87 @@
+from typing import List
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+# Payloads expected from the model. Constraints are enforced with validators rather
+# than Field bounds so that the JSON schema sent to the API only uses the keywords
+# supported by structured outputs.
+
+
+class Answer(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    text: str
+    score: int
+
+    @field_validator("text")
+    @classmethod
+    def text_not_empty(cls, value):
+        if not value.strip():
+            raise ValueError("answer text is empty")
+        return value
+
+    @field_validator("score")
+    @classmethod
+    def score_in_range(cls, value):
+        if not 1 <= value <= 4:
+            raise ValueError("score must be between 1 and 4")
+        return value
+
+
+class Question(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    question: str
+    answers: List[Answer]
+
+    @field_validator("question")
+    @classmethod
+    def question_not_empty(cls, value):
+        if not value.strip():
+            raise ValueError("question text is empty")
+        return value
+
+    @field_validator("answers")
+    @classmethod
+    def one_answer_per_score(cls, value):
+        if sorted(answer.score for answer in value) != [1, 2, 3, 4]:
+            raise ValueError("expected four answers scored 1, 2, 3 and 4")
+        return value
+
+
+def _check_point(value):
+    if len(value) != 2:
+        raise ValueError("expected [x, y] coordinates")
+    return value
+
+
+class PlayerPosition(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    position: List[float]
+
+    check_position = field_validator("position")(_check_point)
+
+
+class Coordinates(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    team_players: List[PlayerPosition]
+    opponent_players: List[PlayerPosition]
+    main_player: List[float]
+    ball: List[float]
+
+    check_points = field_validator("main_player", "ball")(_check_point)
+
+    @field_validator("team_players", "opponent_players")
+    @classmethod
+    def five_players(cls, value):
+        if len(value) != 5:
+            raise ValueError("expected 5 players per team")
+        return value
+
+
+class Positions(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    coordinates: Coordinates
@@ -0,0 +1,286 @@
+import contextlib
+import glob
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed to use the spool
+    fcntl = None
+
+# Outcome of a row write: `ok` is a bool, `error` the message when it failed, and
+# `pending` tells that the row is queued but not confirmed by the sheet yet.
+WriteResult = namedtuple("WriteResult", ["ok", "error", "pending"], defaults=[False])
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _is_retryable(error):
+    # Only the sheet refusing the request, or rows the client cannot encode, are final;
+    # transport errors of any layer (requests, httplib2 and oauth2client token refreshes,
+    # sockets) and unknown errors may succeed later. gspread is only needed once a
+    # write has failed, so it is not loaded up front
+    import gspread
+
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(error, "code", None)
+        if status is None and getattr(error, "response", None) is not None:
+            status = error.response.status_code
+        return status is None or status in RETRYABLE_STATUS_CODES
+    return not isinstance(error, TypeError)
+
+
+class SheetWriter:
+    """
+    Write-behind queue grouping rows into a single `append_rows` call.
+
+    Rows are appended to a local spool file before `submit` returns, and removed
+    from it once they have been written to the sheet, so pending rows survive a
+    restart and are sent again by the next writer (delivery is at least once).
+    Each writer has a spool of its own, "<spool_path>.<id>", locked for as long as
+    its process runs: worker processes sharing `spool_path` never replay or
+    overwrite each other's rows, and a starting writer takes over the spools left
+    by the writers that stopped.
+    Rows stay queued until the sheet accepts them; only rows the sheet rejects are
+    dropped, a rejected batch being split until the rows at fault are found. A background
+    thread flushes the queue when it holds `batch_size` rows, when the oldest row
+    has waited `flush_interval` seconds, or right away for urgent rows.
+    """
+
+    def __init__(self, append_rows, spool_path, batch_size=50, flush_interval=5.0, max_attempts=5,
+                 base_delay=1.0, max_delay=30.0):
+        """
+        Args:
+            append_rows (callable): Function writing a list of rows to the sheet.
+            spool_path (str): Base path of the JSONL files holding the rows not written yet.
+            batch_size (int): Number of pending rows triggering a flush.
+            flush_interval (float): Maximum time in seconds a row waits in the queue.
+            max_attempts (int): Attempts per flush on 429/5xx, connection and unknown errors, after which
+                the rows stay queued and the flush is tried again every `max_delay` seconds.
+            base_delay (float): First retry delay in seconds, doubled on each attempt.
+            max_delay (float): Upper bound of the retry delay in seconds.
+        """
+        self.append_rows = append_rows
+        self.spool_path = f"{spool_path}.{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._pending = {}  # row id -> (row, future, submitted at), in submission order
+        self._urgent = False
+        self._spool_lock = threading.Lock()
+        self._condition = threading.Condition()
+        # Held until the process exits, telling other writers this spool is in use
+        self._spool_owner = self._lock_spool(self.spool_path)
+        self._recover_spools(spool_path)
+        self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row, urgent=False):
+        """
+        Queues a row for writing.
+
+        Args:
+            row (list): The cell values of the row.
+            urgent (bool): Flush as soon as possible instead of waiting for a full batch,
+                e.g. when a user is waiting for the result.
+
+        Returns:
+            concurrent.futures.Future: Resolves to a WriteResult once the row is written
+                or has been rejected by the sheet.
+        """
+        row_id = uuid.uuid4().hex
+        future = Future()
+        # Holding the spool lock until the row is pending keeps a concurrent rewrite
+        # of the spool from dropping it
+        with self._spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                spool.write(json.dumps({"id": row_id, "row": row}, ensure_ascii=False) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+            with self._condition:
+                self._pending[row_id] = (row, future, time.monotonic())
+                self._urgent = self._urgent or urgent
+                self._condition.notify()
+        return future
+
+    def flush(self):
+        """
+        Asks the background thread to write every pending row now.
+        """
+        with self._condition:
+            self._urgent = True
+            self._condition.notify()
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    @staticmethod
+    def _lock_spool(path, blocking=True):
+        """
+        Locks the spool at `path` through its ".lock" file.
+
+        Returns:
+            file: The open lock file, holding the lock until closed, or None if
+                another process holds it.
+        """
+        lock = open(f"{path}.lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                lock.close()
+                return None
+        return lock
+
+    def _recover_spools(self, spool_path):
+        # The spools of stopped writers, and the single spool of earlier versions
+        paths = [spool_path] + [path for path in glob.glob(glob.escape(spool_path) + ".*")
+                                if not path.endswith((".lock", ".tmp")) and path != self.spool_path]
+        claimed = []
+        for path in paths:
+            lock = self._lock_spool(path, blocking=False)
+            if lock is None:
+                continue  # Its writer is running
+            if not os.path.exists(path):
+                # Claimed by another writer while this one listed the spools
+                lock.close()
+                continue
+            claimed.append((path, lock))
+            with open(path, encoding="utf-8") as spool:
+                for line in spool:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partial last line from a crash during submit
+                        continue
+                    self._pending[entry["id"]] = (entry["row"], Future(), time.monotonic())
+        # The rows are in this writer's spool before the claimed ones are removed. The
+        # spool is created even if empty, so that the next writer cleans it up with its lock
+        self._rewrite_spool()
+        for path, lock in claimed:
+            os.remove(path)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f"{path}.lock")
+            lock.close()
+        if self._pending:
+            print(f"Recovered {len(self._pending)} unwritten row(s) from {len(claimed)} spool(s) of {spool_path}")
+            self._urgent = True
+
+    def _rewrite_spool(self):
+        with self._spool_lock:
+            with self._condition:
+                remaining = [(row_id, row) for row_id, (row, _, _) in self._pending.items()]
+            tmp_path = self.spool_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as spool:
+                for row_id, row in remaining:
+                    spool.write(json.dumps({"id": row_id, "row": row}, ensure_ascii=False) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+            os.replace(tmp_path, self.spool_path)
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                if self._pending:
+                    oldest = next(iter(self._pending.values()))[2]
+                    wait = self.flush_interval - (time.monotonic() - oldest)
+                    if self._urgent or len(self._pending) >= self.batch_size or wait <= 0:
+                        break
+                else:
+                    wait = None
+                self._condition.wait(wait)
+            self._urgent = False
+            return [(row_id, entry[0]) for row_id, entry in itertools.islice(self._pending.items(), self.batch_size)]
+
+    def _write(self, rows):
+        """
+        Returns:
+            tuple: (error message or None, whether the error is worth retrying).
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                self.append_rows(rows)
+                return None, False
+            except Exception as e:
+                if not _is_retryable(e):
+                    return str(e), False
+                if attempt == self.max_attempts - 1:
+                    return str(e), True
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"Sheet write failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _deliver(self, batch):
+        """
+        Writes a batch, halving it while the sheet rejects it, so that only the rows
+        at fault are dropped.
+
+        Returns:
+            tuple: ({row id: error message or None} of the rows written or rejected,
+                error message if the sheet became unavailable before the others were).
+        """
+        error, retryable = self._write([row for _, row in batch])
+        if retryable:
+            return {}, error
+        if error is None or len(batch) == 1:
+            return {row_id: error for row_id, _ in batch}, None
+        middle = len(batch) // 2
+        settled, unavailable = self._deliver(batch[:middle])
+        if unavailable is None:
+            rest, unavailable = self._deliver(batch[middle:])
+            settled.update(rest)
+        return settled, unavailable
+
+    def _flush(self):
+        batch = self._next_batch()
+        settled, unavailable = self._deliver(batch)
+        rejected = [error for error in settled.values() if error]
+        if rejected:
+            print(f"Error writing {len(rejected)} row(s) to the sheet:", rejected[0])
+        if settled:
+            with self._condition:
+                results = [(self._pending.pop(row_id)[1], error) for row_id, error in settled.items()]
+                if self._pending:
+                    # Rows left over from a full batch go out without waiting again
+                    self._urgent = self._urgent or len(self._pending) >= self.batch_size
+            try:
+                self._rewrite_spool()
+            finally:
+                # Even if the spool could not be rewritten, the rows are settled; at worst
+                # the next writer sends them again
+                for future, error in results:
+                    if not future.done():
+                        future.set_result(WriteResult(error is None, error))
+        if unavailable:
+            # The sheet is unavailable rather than refusing the rows: they stay pending
+            # and spooled, and the flush is tried again once the sheet had time to recover
+            delay = self.max_delay * random.uniform(0.5, 1.0)
+            print(f"Sheet unavailable ({unavailable}), keeping {len(batch) - len(settled)} row(s) queued, "
+                  f"retrying in {delay:.1f}s")
+            time.sleep(delay)
+            with self._condition:
+                self._urgent = True
+
+    def _run(self):
+        while True:
+            try:
+                self._flush()
+            except Exception as e:
+                # The thread must outlive e.g. a full disk, or every pending row would hang
+                delay = self.max_delay * random.uniform(0.5, 1.0)
+                print(f"Sheet writer failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                with self._condition:
+                    self._urgent = True
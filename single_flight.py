@@ -0,0 +1,91 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from metrics import count
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls in flight: the first caller of a key runs the call
+    and the callers arriving before it completes get its result, or its error,
+    instead of calling again. Sync and async callers of the same key share the call.
+
+    Cancelling a waiting caller leaves the call running for the others, and when
+    the caller running it is cancelled, a waiting caller runs it again instead.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> concurrent.futures.Future of the call in flight
+
+    def _claim(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                count("coalesced_calls_total", call=self.name)
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            return future, True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # Cancelled or interrupted: the waiting callers are cancelled too
+            future.cancel()
+
+    def do(self, key, fn):
+        """
+        Returns `fn()`, or the result of the identical call in flight.
+        """
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except concurrent.futures.CancelledError:
+                # The caller running it was cancelled: run it again, possibly as the leader
+                continue
+        try:
+            result = fn()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def do_async(self, key, fn):
+        """
+        Same as `do` for a coroutine function `fn`.
+        """
+        while True:
+            future, leader = self._claim(key)
+            if leader:
+                break
+            try:
+                # Shielded, so that cancelling this caller does not cancel the shared call
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller running it was cancelled, not this one: run it again
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
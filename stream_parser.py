@@ -0,0 +1,136 @@
+import json
+
+
+class MalformedStreamError(ValueError):
+    """
+    Raised as soon as the streamed output can no longer be valid JSON between <JSON> tags.
+    """
+
+
+class StreamingQuestionParser:
+    """
+    Incremental parser for a question streamed between <JSON></JSON> tags, or as a
+    bare JSON object when the request uses structured outputs.
+
+    Chunks of model output are passed to `feed` as they arrive. The parser tracks
+    the JSON structure character by character and reports the question text and
+    each answer as soon as the corresponding JSON value is complete, without
+    re-parsing the whole buffer on every chunk.
+    """
+
+    START_TAG = "<JSON>"
+
+    def __init__(self, max_preamble=2000):
+        """
+        Args:
+            max_preamble (int): Number of characters allowed before the <JSON> tag
+                before the output is considered malformed.
+        """
+        self.max_preamble = max_preamble
+        self.buffer = ""
+        self.start = None  # Index of the first character after <JSON>
+        self.pos = 0
+        self.end = None  # Index after the closing bracket of the root value
+        self.stack = []  # Open containers: {"type", "start", "path", "expecting_key", "key", "index"}
+        self.string_start = None
+        self.escape = False
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of output.
+
+        Returns:
+            list: (field, value) events for the values completed by this chunk:
+                ("question", str) and ("answer", dict).
+
+        Raises:
+            MalformedStreamError: If the output cannot be valid anymore.
+        """
+        self.buffer += chunk
+        if self.start is None:
+            tag_index = self.buffer.find(self.START_TAG)
+            stripped = self.buffer.lstrip()
+            if tag_index != -1:
+                self.start = self.pos = tag_index + len(self.START_TAG)
+            elif stripped.startswith("{"):
+                # Structured outputs stream the bare JSON value without tags
+                self.start = self.pos = len(self.buffer) - len(stripped)
+            elif len(self.buffer) > self.max_preamble:
+                raise MalformedStreamError("No <JSON> tag found at the start of the output.")
+            else:
+                return []
+
+        events = []
+        while self.end is None and self.pos < len(self.buffer):
+            self._scan(self.buffer[self.pos], events)
+            self.pos += 1
+        return events
+
+    def result(self):
+        """
+        Returns the parsed root value once it is complete, otherwise None.
+        """
+        if self.end is None:
+            return None
+        return json.loads(self.buffer[self.start:self.end])
+
+    def _path(self):
+        return tuple(container["key"] if container["type"] == "object" else container["index"]
+                     for container in self.stack)
+
+    def _scan(self, char, events):
+        if self.string_start is not None:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                raw = self.buffer[self.string_start:self.pos + 1]
+                self.string_start = None
+                top = self.stack[-1] if self.stack else None
+                if top is not None and top["type"] == "object" and top["expecting_key"]:
+                    top["key"] = json.loads(raw)
+                else:
+                    self._complete(self._path(), raw, events)
+            return
+
+        if char in " \t\r\n":
+            return
+        if not self.stack and char not in "{[":
+            raise MalformedStreamError(f"Unexpected {char!r} before the JSON value.")
+
+        if char == '"':
+            self.string_start = self.pos
+        elif char in "{[":
+            self.stack.append({
+                "type": "object" if char == "{" else "array",
+                "start": self.pos,
+                "path": self._path(),
+                "expecting_key": True,
+                "key": None,
+                "index": 0,
+            })
+        elif char in "}]":
+            container = self.stack.pop()
+            if (char == "}") != (container["type"] == "object"):
+                raise MalformedStreamError(f"Mismatched {char!r} in the JSON value.")
+            self._complete(container["path"], self.buffer[container["start"]:self.pos + 1], events)
+            if not self.stack:
+                self.end = self.pos + 1
+        elif char == ":":
+            self.stack[-1]["expecting_key"] = False
+        elif char == ",":
+            top = self.stack[-1]
+            top["expecting_key"] = True
+            top["index"] += 1
+        elif char == "/":
+            raise MalformedStreamError("Comments are not allowed in the JSON value.")
+
+    def _complete(self, path, raw, events):
+        if path == ("question",):
+            events.append(("question", json.loads(raw)))
+        elif len(path) == 2 and path[0] == "answers" and isinstance(path[1], int) and raw.startswith("{"):
+            try:
+                events.append(("answer", json.loads(raw)))
+            except json.JSONDecodeError as e:
+                raise MalformedStreamError(f"Invalid answer: {e}")
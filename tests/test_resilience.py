@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, call_with_retries, call_with_retries_async
+
+
+class RateLimited(openai.RateLimitError):
+    # Built without an HTTP response, which the retry policy does not need
+    def __init__(self):
+        Exception.__init__(self, "rate limited")
+        self.response = None
+
+
+def opened_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.allow()
+    breaker.failure()
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    assert not breaker.is_open()
+    return breaker
+
+
+def rate_limited_once():
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            raise RateLimited()
+        return "answer"
+
+    return call, calls
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(resilience, "retry_delay", lambda error, attempt: 0.0)
+
+
+def test_rate_limited_probe_releases_the_breaker():
+    breaker = opened_breaker()
+    call, calls = rate_limited_once()
+    assert call_with_retries(call, breaker, LatencyTracker(), hedge=False) == "answer"
+    assert len(calls) == 2
+    assert breaker.retry_in() is None
+    breaker.allow()
+
+
+def test_rate_limited_probe_releases_the_breaker_async():
+    breaker = opened_breaker()
+    sync_call, calls = rate_limited_once()
+
+    async def call(timeout):
+        return sync_call(timeout)
+
+    assert asyncio.run(call_with_retries_async(call, breaker, LatencyTracker(), hedge=False)) == "answer"
+    assert len(calls) == 2
+    assert breaker.retry_in() is None
+    breaker.allow()
+
+
+def test_rate_limited_last_attempt_leaves_a_probe_available():
+    breaker = opened_breaker()
+
+    def call(timeout):
+        raise RateLimited()
+
+    with pytest.raises(openai.RateLimitError):
+        call_with_retries(call, breaker, LatencyTracker(), attempts=1, hedge=False)
+    assert breaker.retry_in() is None
+    breaker.allow()
+
+
+def test_hedged_calls_do_not_queue_behind_busy_threads():
+    latencies = LatencyTracker(min_samples=1)
+    latencies.record(0.01)
+    for _ in range(resilience.HEDGE_THREADS):
+        assert resilience._hedge_slots.acquire(blocking=False)
+    try:
+        threads = []
+
+        def call(timeout):
+            threads.append(threading.current_thread())
+            return "answer"
+
+        assert call_with_retries(call, CircuitBreaker(), latencies) == "answer"
+        assert threads == [threading.current_thread()]
+    finally:
+        for _ in range(resilience.HEDGE_THREADS):
+            resilience._hedge_slots.release()
+
+
+def test_losing_attempt_gives_its_thread_back():
+    latencies = LatencyTracker(min_samples=1)
+    latencies.record(0.01)
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            return "slow"
+        return "fast"
+
+    assert call_with_retries(call, CircuitBreaker(), latencies) == "fast"
+    time.sleep(0.3)
+    for _ in range(resilience.HEDGE_THREADS):
+        assert resilience._hedge_slots.acquire(blocking=False)
+    for _ in range(resilience.HEDGE_THREADS):
+        resilience._hedge_slots.release()
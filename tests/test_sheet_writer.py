@@ -0,0 +1,91 @@
+import glob
+import json
+import os
+import threading
+
+from sheet_writer import SheetWriter
+
+
+def blocked_append(rows):
+    # Never returns, keeping the rows of a writer pending
+    threading.Event().wait()
+
+
+def spooled_rows(path):
+    rows = []
+    for spool in glob.glob(f"{path}.*"):
+        if not spool.endswith(".lock"):
+            with open(spool, encoding="utf-8") as f:
+                rows += [json.loads(line)["row"] for line in f]
+    return rows
+
+
+def test_writers_sharing_a_spool_path_keep_their_own_rows(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    first = SheetWriter(blocked_append, path, flush_interval=60)
+    first.submit(["first"])
+    second = SheetWriter(blocked_append, path, flush_interval=60)
+    second.submit(["second"])
+    assert first.pending_count() == 1
+    assert second.pending_count() == 1
+    second._rewrite_spool()
+    assert sorted(spooled_rows(path)) == [["first"], ["second"]]
+
+
+def test_spools_of_stopped_writers_are_recovered_once(tmp_path):
+    path = str(tmp_path / "spool.jsonl")
+    with open(path, "w", encoding="utf-8") as spool:
+        spool.write(json.dumps({"id": "legacy", "row": ["legacy"]}) + "\n")
+    with open(f"{path}.1-dead", "w", encoding="utf-8") as spool:
+        spool.write(json.dumps({"id": "dead", "row": ["dead"]}) + "\n")
+    written = []
+    done = threading.Event()
+
+    def append_rows(rows):
+        written.extend(rows)
+        done.set()
+
+    SheetWriter(append_rows, path, flush_interval=60)
+    assert done.wait(5)
+    assert sorted(written) == [["dead"], ["legacy"]]
+    assert not os.path.exists(path) and not os.path.exists(f"{path}.1-dead")
+    assert SheetWriter(blocked_append, path).pending_count() == 0
+
+
+def test_rejected_batch_only_drops_the_rows_at_fault(tmp_path):
+    written = []
+
+    def append_rows(rows):
+        if ["bad"] in rows:
+            raise TypeError("cannot encode the row")
+        written.extend(rows)
+
+    writer = SheetWriter(append_rows, str(tmp_path / "spool.jsonl"), batch_size=4, flush_interval=60)
+    futures = [writer.submit([name]) for name in ("a", "bad", "c", "d")]
+    results = [future.result(5) for future in futures]
+    assert [result.ok for result in results] == [True, False, True, True]
+    assert sorted(written) == [["a"], ["c"], ["d"]]
+
+
+def test_unknown_errors_keep_the_rows_queued(tmp_path):
+    attempts = []
+
+    def append_rows(rows):
+        attempts.append(rows)
+        if len(attempts) < 3:
+            raise OSError("token refresh failed")
+
+    writer = SheetWriter(append_rows, str(tmp_path / "spool.jsonl"), max_attempts=1, max_delay=0.01)
+    assert writer.submit(["row"], urgent=True).result(5).ok
+    assert len(attempts) == 3
+
+
+def test_writer_survives_a_failing_spool(tmp_path, monkeypatch):
+    writer = SheetWriter(lambda rows: None, str(tmp_path / "spool.jsonl"), max_delay=0.01)
+
+    def full_disk():
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(writer, "_rewrite_spool", full_disk)
+    assert writer.submit(["first"], urgent=True).result(5).ok
+    assert writer.submit(["second"], urgent=True).result(5).ok
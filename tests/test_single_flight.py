@@ -0,0 +1,48 @@
+import asyncio
+
+from single_flight import SingleFlight
+
+
+def test_cancelled_follower_leaves_the_call_to_the_leader():
+    flight = SingleFlight()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.ensure_future(flight.do_async("key", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do_async("key", fn))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await leader == "answer"
+        assert follower.cancelled()
+
+    asyncio.run(main())
+    assert flight.in_flight() == 0
+
+
+def test_follower_runs_the_call_when_the_leader_is_cancelled():
+    flight = SingleFlight()
+    calls = []
+
+    async def main():
+        async def fn():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        leader = asyncio.ensure_future(flight.do_async("key", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do_async("key", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == 2
+
+    asyncio.run(main())
+    assert flight.in_flight() == 0
@@ -0,0 +1,41 @@
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+# Frequent French words that carry no meaning for comparing questions
+FRENCH_STOPWORDS = frozenset("""
+au aux avec ce ces cet cette dans de des du elle en et eux il ils je la le les leur leurs lui ma mais me
+meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un
+une vos votre vous est sont etre avoir ont fait faire plus comme tout tous toute toutes doit peut quelle
+quel quels quelles lors alors afin
+""".split())
+
+
+def normalize_text(text):
+    """
+    Lowercases a text and strips accents and punctuation, e.g. "Défense, à l'arrière"
+    becomes "defense a l arriere".
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def tokenize(text):
+    """
+    Returns the meaningful words of a text after `normalize_text`.
+    """
+    return [word for word in normalize_text(text).split() if len(word) > 2 and word not in FRENCH_STOPWORDS]
+
+
+def hashed_vector(text, dims=64):
+    """
+    Bag-of-words vector of a text using the hashing trick, L2-normalized.
+    """
+    vector = np.zeros(dims)
+    for word in tokenize(text):
+        vector[zlib.crc32(word.encode("utf-8")) % dims] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector